@@ -1,3 +1,16 @@
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 import finpy_tse as tse
 import pandas as pd
 import numpy as np
@@ -5,25 +18,184 @@ import requests
 from khayyam import JalaliDate
 from bs4 import BeautifulSoup
 import statsmodels.api as sm
+from scipy import sparse
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+logger = logging.getLogger("MyProject")
+
+# This dictionary is needed for using requests.get method.
+headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
+
+##### Markets #####
+
+class Market:
+    """
+    The settings of one exchange: the calendar of its data, where its sector memberships are scraped from, and the memberships themselves.
+
+    Every function that needs the sectors reads them from the current market (see current_market), so several markets can be studied
+    in one process, e.g. `with markets["IFB"]: MG_Strategy(...)`, and every thread can work in its own market.
+
+    Parameters:
+    name (str): The market name, e.g. "TSE".
+    calendar (str): "jalali" or "gregorian", the calendar of the dates in its csv files.
+    sector_names (list of str): The names of the sectors whose pages are scraped.
+    sector_ids (list of int): The web ids of those pages.
+    url (str, optional): The part of the sector page URLs before the web id.
+    sectors (dict, optional): Sector names mapped to lists of tickers; scraped from the sector pages the first time they are needed when omitted.
+    """
+
+    def __init__(self, name, calendar = "jalali", sector_names = (), sector_ids = (), url = None, sectors = None):
+        if calendar not in ("jalali", "gregorian"):
+            raise ValueError("calendar must be 'jalali' or 'gregorian', not " + repr(calendar))
+        self.name = name
+        self.calendar = calendar
+        self.sector_names = list(sector_names)
+        self.sector_ids = list(sector_ids)
+        self.url = url
+        self._sectors = None
+        self._lock = threading.Lock()
+        if sectors is not None:
+            self.sectors = sectors
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "Market(" + repr(self.name) + ", calendar = " + repr(self.calendar) + ")"
+
+    @property
+    def sectors(self):
+        """
+        Sector names mapped to lists of tickers, scraped once (see sector_stocks). Both are normalized with normalize_symbols, and sectors whose
+        names only differ in spelling are merged.
+        """
+        with self._lock:
+            if self._sectors is None:
+                self.sectors = sector_stocks(self)
+        return self._sectors
+
+    @sectors.setter
+    def sectors(self, sectors):
+        normalized = {}
+        for sector, stocks in zip(normalize_symbols(sectors.keys()), sectors.values()):
+            normalized[sector] = list(dict.fromkeys(normalized.get(sector, []) + normalize_symbols(stocks)))
+        self._sectors = normalized
+
+    def date(self, year, month, day):
+        """
+        A date of the market calendar, JalaliDate or pandas Timestamp.
+        """
+        if self.calendar == "jalali":
+            return JalaliDate(year, month, day)
+        return pd.Timestamp(year, month, day)
+
+    def parse_date(self, text):
+        """
+        Parses a "YYYY-MM-DD" date of the market calendar.
+        """
+        return self.date(*[int(x) for x in str(text).split("-")[:3]])
+
+    def __enter__(self):
+        if not hasattr(_market_local, "stack"):
+            _market_local.stack = []
+        _market_local.stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _market_local.stack.pop()
+
+_market_local = threading.local()
 
 # These Web_IDs were collected from the tsetmc website, and each represents an industry.
-sector_web_id = [34408080767216529,19219679288446732,13235969998952202,62691002126902464,59288237226302898,69306841376553334,58440550086834602,30106839080444358,25766336681098389,\
+tse_sector_ids = [34408080767216529,19219679288446732,13235969998952202,62691002126902464,59288237226302898,69306841376553334,58440550086834602,30106839080444358,25766336681098389,\
      12331083953323969,36469751685735891,32453344048876642,1123534346391630,11451389074113298,33878047680249697,24733701189547084,20213770409093165,21948907150049163,40355846462826897,\
      54843635503648458,15508900928481581,3615666621538524,33626672012415176,65986638607018835,57616105980228781,70077233737515808,14651627750314021,34295935482222451,72002976013856737,\
      25163959460949732,24187097921483699,41867092385281437,61247168213690670,61985386521682984,4654922806626448,8900726085939949,18780171241610744,47233872677452574,65675836323214668,\
      59105676994811497]
 
 # These are the names of different industries which are available in the tsetmc website.
-sector_list = ['زراعت','ذغال سنگ','کانی فلزی','سایر معادن','منسوجات','محصولات چرمی','محصولات چوبی','محصولات کاغذی','انتشار و چاپ','فرآورده های نفتی','لاستیک',\
+tse_sector_names = ['زراعت','ذغال سنگ','کانی فلزی','سایر معادن','منسوجات','محصولات چرمی','محصولات چوبی','محصولات کاغذی','انتشار و چاپ','فرآورده های نفتی','لاستیک',\
                    'فلزات اساسی','محصولات فلزی','ماشین آلات','دستگاه های برقی','وسایل ارتباطی','خودرو','قند و شکر','چند رشته ای','تامین آب، برق و گاز','غذایی',\
                    'دارویی','شیمیایی','خرده فروشی','کاشی و سرامیک','سیمان','کانی غیر فلزی','سرمایه گذاری','بانک','سایر مالی','حمل و نقل',\
                    'رادیویی','مالی','اداره بازارهای مالی','انبوه سازی','رایانه','اطلاعات و ارتباطات','فنی مهندسی','استخراج نفت','بیمه و بازنشستگی']
 
-# This dictionary is needed for using requests.get method.
-headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
-
 # This part of the URL is the same in all industries' URLs.
-main_url = "http://tsetmc.com/Loader.aspx?ParTree=15131J&i="
+tse_url = "http://tsetmc.com/Loader.aspx?ParTree=15131J&i="
+
+markets = {"TSE": Market("TSE", "jalali", tse_sector_names, tse_sector_ids, tse_url)}
+
+default_market = "TSE"
+
+def current_market():
+    """
+    The market of the running thread: that of the innermost `with market:` block, or else the process default set by use_market.
+    """
+    stack = getattr(_market_local, "stack", None)
+    return stack[-1] if stack else markets[default_market]
+
+def get_market(spec = None):
+    """
+    Resolves a market specification, e.g. the "market" of a batch configuration.
+
+    Parameters:
+    spec (str, dict or Market, optional): A registered market name, a Market, or the Market arguments as a dict whose "sectors" may be
+    the path of a JSON file of sector names mapped to tickers. Markets given as dicts are registered under their name, and the same dict gives the same market again.
+
+    Returns:
+    Market: The market, the current one when `spec` is omitted.
+    """
+    if spec is None:
+        return current_market()
+    if isinstance(spec, Market):
+        return spec
+    if isinstance(spec, str):
+        if spec not in markets:
+            raise KeyError("unknown market " + repr(spec) + ", registered: " + ", ".join(markets))
+        return markets[spec]
+    if getattr(markets.get(spec["name"]), "spec", None) == spec:
+        return markets[spec["name"]]
+    args = dict(spec)
+    if isinstance(args.get("sectors"), str):
+        with open(args["sectors"], encoding = "utf-8") as f:
+            args["sectors"] = json.load(f)
+    market = Market(**args)
+    market.spec = spec
+    markets[market.name] = market
+    return market
+
+def use_market(spec):
+    """
+    Makes a market the process default, e.g. in a worker process that studies one market.
+
+    Parameters:
+    spec (str, dict or Market): The market, as get_market takes it.
+
+    Returns:
+    Market: The market.
+    """
+    global default_market
+    market = get_market(spec)
+    markets[market.name] = market
+    default_market = market.name
+    return market
+
+def shift_years(date, years):
+    """
+    The same day `years` years later (or earlier), in the calendar of `date`.
+    """
+    if isinstance(date, JalaliDate):
+        return JalaliDate(date.year + years, date.month, date.day)
+    return pd.Timestamp(date) + pd.DateOffset(years = years)
 
 #Converting Strings to JalaliDate Type
 def to_jalali(df):
@@ -48,40 +220,124 @@ A list of Jalali dates converted from the dates in the dataframe column.
     return dates
 
 #Reading CSV File and Converting Date Column to Date Type
-def read_data(name):
+def read_data(name, dtype = None, market = None):
     """
 Read a csv file and convert the first column of dates to Jalali format.
 
 The function reads a csv file, converts the first column of dates from Gregorian to Jalali format using the "to_jalali" function, sets the first column as the index with the label "Date", and returns the resulting dataframe.
+The dates of a market with a Gregorian calendar become pandas Timestamps instead.
 
 Input:
 name: str
 The name of the csv file to be read.
+dtype: numpy dtype, optional
+The dtype of the value columns, e.g. np.float32 for the compact mode. By default pandas infers it.
+market: Market, optional
+The market whose calendar the dates are in, by default the current market (see current_market).
 
 Returns:
 df: pandas DataFrame
 A dataframe with the first column of dates in Jalali format and set as the index with the label "Date".
 """
     df = pd.read_csv(name)
-    df[df.columns[0]] = to_jalali(df)
+    if (market or current_market()).calendar == "jalali":
+        df[df.columns[0]] = to_jalali(df)
+    else:
+        df[df.columns[0]] = pd.to_datetime(df[df.columns[0]])
     df.set_index(df.columns[0], inplace=True)
     df.index.name = "Date"
+    df.columns = normalize_symbols(df.columns)
+    if dtype is not None:
+        df = df.astype(dtype)
     return df
 
+##### Ticker Vocabulary #####
+
+# Arabic forms of Persian letters (and the zero-width non-joiner) that differ between tsetmc pages, finpy_tse and the csv files.
+persian_letters = str.maketrans({"ي": "ی", "ى": "ی", "ك": "ک", "\u200c": " "})
+
+def normalize_symbols(names):
+    """
+    Normalizes ticker or sector names to one Persian spelling.
+
+    Arabic ye and kaf become Persian ye and kaf, zero-width non-joiners become spaces and repeated spaces are collapsed.
+
+    Parameters:
+    names (iterable of str): The names to normalize.
+
+    Returns:
+    list of str: The normalized names.
+    """
+    return [" ".join(str(name).translate(persian_letters).split()) for name in names]
+
+def ticker_vocabulary(*sources):
+    """
+    Builds a dictionary that maps every ticker of the given sources to a dense integer id.
+
+    Parameters:
+    *sources (iterables of str): Ticker names, e.g. csv columns, the stock lists of Sectors_stocks or finpy_tse symbols.
+
+    Returns:
+    pandas Index: The sorted, normalized tickers; the position of a ticker is its id.
+    """
+    names = set()
+    for source in sources:
+        names.update(normalize_symbols(source))
+    return pd.Index(sorted(names))
+
+def encode_tickers(vocabulary, names):
+    """
+    Looks up the integer ids of ticker names.
+
+    Parameters:
+    vocabulary (pandas Index): A vocabulary from ticker_vocabulary.
+    names (iterable of str): The tickers to encode.
+
+    Returns:
+    numpy array: int32 ids, -1 for tickers missing from the vocabulary.
+    """
+    return vocabulary.get_indexer(normalize_symbols(names)).astype(np.int32)
+
+def decode_tickers(vocabulary, ids):
+    """
+    Looks up the ticker names of integer ids.
+
+    Parameters:
+    vocabulary (pandas Index): A vocabulary from ticker_vocabulary.
+    ids (numpy array): Ticker ids.
+
+    Returns:
+    numpy array: The ticker names.
+    """
+    return vocabulary.to_numpy()[np.asarray(ids)]
+
+def encode_sectors(vocabulary, sectors):
+    """
+    Encodes the stock lists of every sector.
+
+    Parameters:
+    vocabulary (pandas Index): A vocabulary from ticker_vocabulary.
+    sectors (dict): Sector names mapped to lists of tickers, e.g. Sectors_stocks.
+
+    Returns:
+    dict: Sector names mapped to int32 arrays of the ids of their stocks found in the vocabulary.
+    """
+    encoded = {}
+    for sector, stocks in sectors.items():
+        ids = encode_tickers(vocabulary, stocks)
+        encoded[sector] = np.unique(ids[ids >= 0])
+    return encoded
 
-def sector_stocks():
+
+def sector_stocks(market = None):
     """
 Get the list of stocks for each sector.
 
-The function uses the "requests" library to access the webpages of sectors listed in "sector_list" and collects the names of stocks in each sector. The sector names and their corresponding stock names are stored in a dictionary and returned.
+The function uses the "requests" library to access the webpages of the sectors of a market and collects the names of stocks in each sector. The sector names and their corresponding stock names are stored in a dictionary and returned.
 
 Input:
-sector_list: list
-A list of sector names.
-sector_web_id: list
-A list of web IDs for each sector.
-main_url: str
-The main URL for accessing the sector webpages.
+market: Market, optional
+The market whose sector_names, sector_ids and url are scraped, by default the current market (see current_market).
 headers: dict
 A dictionary of headers for the HTTP request.
 
@@ -89,19 +345,43 @@ Returns:
 Sectors: dict
 A dictionary with sector names as keys and lists of stock names as values.
 """
+    if market is None:
+        market = current_market()
+    if market.url is None:
+        raise ValueError("market " + market.name + " has no sector pages to scrape; give its sectors instead")
     Sectors = {}
-    for i in range(len(sector_list)):
-        sector_url = main_url + str(sector_web_id[i])
+    for i in range(len(market.sector_names)):
+        sector_url = market.url + str(market.sector_ids[i])
         ww = []
         while len(ww) == 0:
             sector_page = requests.get(sector_url, headers=headers)
             soup = BeautifulSoup(sector_page.content, 'html.parser')
             ww = soup.find_all('a')
-        stock_list = [ww[j].contents[0].replace("ي", "ی").replace("ك", "ک") for j in range(len(ww))]
-        Sectors[sector_list[i]] = stock_list
+        stock_list = normalize_symbols([ww[j].contents[0] for j in range(len(ww))])
+        Sectors[market.sector_names[i]] = stock_list
     return Sectors
 
-Sectors_stocks = sector_stocks()
+def _snapshot_sectors(path):
+    """
+    The market name and sector mapping stored in a snapshot bundle (see save_snapshot).
+    """
+    with open(os.path.join(path, "manifest.json"), encoding = "utf-8") as f:
+        manifest = json.load(f)
+    return manifest.get("market", "TSE"), manifest["sectors"]
+
+def __getattr__(name):
+    """
+    Keeps MyProject.Sectors_stocks working: it is the sector mapping of the current market, scraped the first time it is needed.
+    """
+    if name == "Sectors_stocks":
+        return current_market().sectors
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+# Set MYPROJECT_SNAPSHOT to a snapshot bundle to take the sectors from it instead of scraping them.
+if os.environ.get("MYPROJECT_SNAPSHOT"):
+    _name, _sectors = _snapshot_sectors(os.environ["MYPROJECT_SNAPSHOT"])
+    if _name in markets:
+        markets[_name].sectors = _sectors
 
 def d2m(df):
     """
@@ -124,34 +404,37 @@ A dataframe with only the rows that have unique months in the index.
     month_index.append(df.index[-1])
     return df.loc[month_index, :]
 
-def ret_d2m(df):
+def ret_d2m(df, dtype = np.float64):
     """
 Calculate the monthly returns of a dataframe.
 
 The function takes a dataframe with daily values and returns a new dataframe with the monthly returns. The monthly returns are calculated by finding the product of the daily values for each unique month and subtracting 1.
+The products of all months are taken at once with np.multiply.reduceat into a preallocated numeric array.
 
 Input:
 df: pandas DataFrame
 A dataframe with daily values.
+dtype: numpy dtype, optional
+The dtype of the result, np.float64 by default or np.float32 for the compact mode.
 
 Returns:
 df2: pandas DataFrame
 A dataframe with the monthly returns of the input dataframe. The index is set as the first day of each unique month.
 """
-    df = df.copy(deep = True)
-    df = df + 1
-    df2 = pd.DataFrame(columns=df.columns)
-    check = 0
-    for i in range(1, len(df)):
-        if (df.index[i].month != df.index[i-1].month) or (i == len(df) - 1):
-            start = df.index[check]
-            end = df.index[i]
-            temp = df.loc[start:end, :]
-            temp = temp.prod() - 1
-            temp[temp == 0] = np.nan
-            df2.loc[start, :] = temp
-            check = i
-    return df2
+    if len(df) <= 1:
+        return pd.DataFrame(np.empty((0, df.shape[1]), dtype = dtype), index = df.index[:0], columns = df.columns)
+    values = np.nan_to_num(df.to_numpy(dtype = np.float64) + 1, nan = 1.0)
+    months = np.array([date.month for date in df.index])
+    ends = np.flatnonzero(months[1:] != months[:-1]) + 1
+    if len(ends) == 0 or ends[-1] != len(df) - 1:
+        ends = np.append(ends, len(df) - 1)
+    starts = np.concatenate([[0], ends[:-1]]).astype(int)
+    # Each month runs from its first day through the first day of the next month, as the loop it replaces did.
+    prod = np.multiply.reduceat(values, starts, axis = 0)
+    prod[:-1] *= values[ends[:-1]]
+    prod = prod - 1
+    prod[prod == 0] = np.nan
+    return pd.DataFrame(prod.astype(dtype), index = df.index[starts], columns = df.columns)
 
 def Farvardin(df):
     """
@@ -180,1119 +463,3941 @@ A dataframe with the rest of the rows.
 
     return df.loc[farvardins, :], df.loc[farvardin_excluded, :]
 
-##### JK Strategy #####
+##### Kernels #####
 
-def JK_Ranker(ret, mc, J, t):
+def _rolling_max_numpy(values, starts):
     """
-Rank stocks based on their returns and market capitalization.
+    NaN-aware max of values[starts[i]:i+1] for every row i, answered from a sparse table built one power of two at a time.
+    """
+    out = np.full(values.shape, np.nan)
+    lengths = np.arange(len(values)) - starts + 1
+    levels = np.floor(np.log2(np.maximum(lengths, 1))).astype(int)
+    level = values.copy()
+    span = 1
+    for k in range(levels.max() + 1 if len(values) else 0):
+        rows = np.flatnonzero((levels == k) & (lengths > 0))
+        out[rows] = np.fmax(level[starts[rows]], level[rows - span + 1])
+        level = np.fmax(level[:-span], level[span:]) if span < len(level) else level[:0]
+        level = np.vstack([level, np.full((len(values) - len(level), values.shape[1]), np.nan)])
+        span *= 2
+    return out
 
-The function takes in stock returns and market capitalization data and uses them to rank the stocks. The ranking is done by grouping stocks into three categories: winners, losers, and middles.
+def _percentile_rank_numpy(values):
+    """
+    Row-wise share of the non-missing values that are less than or equal to each value, NaN for missing values.
+    """
+    order = np.argsort(values, axis = 1, kind = "stable")
+    ordered = np.take_along_axis(values, order, axis = 1)
+    index = np.arange(values.shape[1])
+    is_end = np.ones(ordered.shape, dtype = bool)
+    is_end[:, :-1] = ordered[:, 1:] != ordered[:, :-1]
+    run_end = np.minimum.accumulate(np.where(is_end, index, values.shape[1])[:, ::-1], axis = 1)[:, ::-1]
+    counts = (~np.isnan(values)).sum(axis = 1, keepdims = True)
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, run_end + 1.0, axis = 1)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return np.where(np.isnan(values), np.nan, ranks / counts)
 
-The ranking is based on the average return of the stocks over the last J periods and the average market capitalization over the same period. The ranking is done on the most liquid stocks which are defined as those with a market capitalization greater than or equal to the 10th percentile of all market capitalizations in the same period.
+def _cohort_sums_numpy(ret, weights, rows, months):
+    """
+    Sums the K cohort returns of every holding month with one masked row-wise dot product.
+    """
+    pairs = masked_returns(ret, weights, rows.ravel(), months.ravel())
+    return pairs.reshape(rows.shape).sum(axis = 1)
 
-Inputs:
-ret: pandas DataFrame
-A dataframe of returns for each stock, with time as the index.
-mc: pandas DataFrame
-A dataframe of market capitalization for each stock, with time as the index.
-J: int
-The number of periods over which to compute the average returns and market capitalization.
-t: int
-The current time period.
+if numba is not None:
+    @numba.njit(cache = True)
+    def _rolling_max_numba(values, starts):
+        n, m = values.shape
+        out = np.full((n, m), np.nan)
+        queue = np.empty(n, dtype = np.int64)
+        for j in range(m):
+            head = 0
+            tail = 0
+            for i in range(n):
+                x = values[i, j]
+                if not np.isnan(x):
+                    while tail > head and values[queue[tail - 1], j] <= x:
+                        tail -= 1
+                    queue[tail] = i
+                    tail += 1
+                while tail > head and queue[head] < starts[i]:
+                    head += 1
+                if tail > head and starts[i] <= i:
+                    out[i, j] = values[queue[head], j]
+        return out
 
-Returns:
-winners: list of strings
-A list of stocks that have the highest average return among the most liquid stocks over the last J periods.
-losers: list of strings
-A list of stocks that have the lowest average return among the most liquid stocks over the last J periods.
-middles: list of strings
-A list of stocks that have an average return that falls in between the highest and lowest returns among the most liquid stocks over the last J periods.
-"""
-    ret = ret.copy(deep=True)
-    mc = mc.copy(deep = True)
-    ret.index = range(0, len(ret))
-    mc.index = range(0, len(mc))
-    j_period_mc = mc.loc[t-J:t, :].dropna(axis = 1).mean().to_frame()
-    liquids = j_period_mc[j_period_mc[0] >= j_period_mc.quantile(0.1)[0]].index
-    j_period_return = ret.loc[t-J:t-1, liquids].dropna(axis = 1).mean().to_frame()
-    winners = j_period_return[j_period_return[0] >= j_period_return.quantile(0.7)[0]].index
-    losers = j_period_return[j_period_return[0] <= j_period_return.quantile(0.3)[0]].index
-    middles = [stock for stock in liquids if (stock not in winners) and (stock not in losers)]
-    return winners, losers, middles
+    @numba.njit(cache = True)
+    def _percentile_rank_numba(values):
+        n, m = values.shape
+        out = np.full((n, m), np.nan)
+        for i in range(n):
+            row = values[i]
+            valid = row[~np.isnan(row)]
+            ordered = np.sort(valid)
+            for j in range(m):
+                if not np.isnan(row[j]):
+                    out[i, j] = np.searchsorted(ordered, row[j], side = "right") / len(ordered)
+        return out
 
-def JK_Strategy(ret, mc, J, K, far = False):
-    """
-    JK_Strategy calculates the average returns for winners, losers, and the difference between winners and losers
-    based on Jegadeesh and Titman (1993) momentum strategy. 
+    @numba.njit(cache = True)
+    def _cohort_sums_numba(ret, weights, rows, months):
+        n, K = rows.shape
+        out = np.zeros(n)
+        for i in range(n):
+            for k in range(K):
+                num = 0.0
+                den = 0.0
+                w = weights[rows[i, k]]
+                r = ret[months[i, k]]
+                for j in range(len(w)):
+                    if w[j] != 0.0 and not np.isnan(r[j]):
+                        num += w[j] * r[j]
+                        den += w[j]
+                out[i] += num / den if den > 0 else np.nan
+        return out
 
-    Parameters
-    ----------
-    ret : pd.DataFrame
-        A dataframe with stock returns.
-    mc : pd.DataFrame
-        A dataframe with market capitalization for each stock.
-    J : int
-        A lookback period for ranking the stocks.
-    K : int
-        A holding period for the strategy.
-    far : bool, optional
-        A flag to indicate whether Farvardin (1991) correction should be applied, by default False.
+kernel_backend = "numpy" if numba is None else "numba"
 
-    Returns
-    -------
-    pd.DataFrame
-        A dataframe with average returns for winners, losers, and the difference between winners and losers.
+def _kernel(name, backend):
     """
-    w_rets = []
-    l_rets = []
-    wl_rets = []
-    if far:
-        far_ret = Farvardin(ret)[0]
-    for t in range(2 * J+1, len(ret)):
-        w_ret = 0
-        l_ret = 0
-        wl_ret = 0
-        winners, losers, middles = JK_Ranker(ret, mc, J, t)
-        for i in range(t-K-1, t-1):
-            if far:
-                if ret.index[t] in far_ret.index:
-                    w_ret += ret[winners].iloc[t, :].mean()
-                    l_ret += ret[losers].iloc[t, :].mean()
-                    wl_ret += ret[winners].iloc[t, :].mean() - ret[losers].iloc[t, :].mean()
-            else:
-                w_ret += ret[winners].iloc[t, :].mean()
-                l_ret += ret[losers].iloc[t, :].mean()
-                wl_ret += ret[winners].iloc[t, :].mean() - ret[losers].iloc[t, :].mean()
-        w_rets.append(w_ret)
-        l_rets.append(l_ret)
-        wl_rets.append(wl_ret)
-    Strategy = pd.DataFrame(index = ["JT's individual stock momentum"])
-    Strategy["Winner"] = str(round(np.mean(w_rets) * 100, 2)) + "%"
-    Strategy["Loser"] = str(round(np.mean(l_rets) * 100, 2)) + "%"
-    Strategy["Winner - Loser"] = str(round(np.mean(wl_rets) * 100, 2)) + "%  (" + str(round(np.mean(wl_rets) * np.sqrt(len(wl_rets)) / np.std(wl_rets), 2)) + ")"
-    Strategy.index.name = "Strategy"
-    return Strategy
+    Picks the NumPy or the Numba version of a kernel; "numba" falls back to NumPy when Numba is not installed.
+    """
+    backend = backend or kernel_backend
+    if backend == "numba" and numba is not None:
+        return globals()["_" + name + "_numba"]
+    return globals()["_" + name + "_numpy"]
 
-##### MG Strategy #####
+def rolling_max(values, starts, backend = None):
+    """
+    Calculates the NaN-aware maximum of every row over a trailing window of rows.
+
+    Parameters:
+    values (numpy array): A (rows x tickers) array.
+    starts (numpy array): The first row of the window of every row; the window ends at the row itself. The starts must not decrease, since the
+        Numba kernel drops the rows that leave a window for good; starts before the first row (windows longer than the series) are clipped to it.
+    backend (str, optional): "numpy" or "numba", by default kernel_backend.
 
-def MG_Ranker(ind_ret, stocks_ret, J, t):
+    Returns:
+    numpy array: The window maxima, NaN where the window has no value.
     """
-MG_Ranker(ind_ret, stocks_ret, J, t)
+    return _kernel("rolling_max", backend)(np.asarray(values, dtype = np.float64), np.maximum(np.asarray(starts, dtype = np.int64), 0))
 
-Rank stocks into winners, losers, and middles based on their respective industry's mean return over the past J period.
+def percentile_rank(values, backend = None):
+    """
+    Ranks every row cross-sectionally, ignoring missing values.
 
-Parameters:
-ind_ret (pd.DataFrame): dataframe of industry returns
-stocks_ret (pd.DataFrame): dataframe of stocks returns
-J (int): number of periods used for ranking
-t (int): current time step
+    Parameters:
+    values (numpy array): A (months x tickers) array of signals.
+    backend (str, optional): "numpy" or "numba", by default kernel_backend.
 
-Returns:
-winners (list): list of winners' stocks
-losers (list): list of losers' stocks
-middles (list): list of stocks that are neither winners nor losers
-"""
-    ind_ret = ind_ret.copy(deep = True)
-    ind_ret.index = range(0, len(ind_ret))
-    j_period_return = ind_ret.loc[t-J:t-1, :].dropna(axis = 1, how = "all")
-    j_period_return = j_period_return.mean().to_frame()
-    winner_industries = j_period_return[j_period_return[0] >= j_period_return.quantile(0.7)[0]].index.tolist()
-    loser_industries = j_period_return[j_period_return[0] <= j_period_return.quantile(0.3)[0]].index.tolist()
-    winners = []
-    losers = []
-    for i in winner_industries:
-        for j in Sectors_stocks[i]:
-            winners.append(j)
-    winners = list(set(winners))
-    winners = [stock for stock in winners if stock in stocks_ret.columns]
-    for i in loser_industries:
-        for j in Sectors_stocks[i]:
-            losers.append(j)
-    losers = list(set(losers))
-    losers = [stock for stock in losers if stock in stocks_ret.columns]
-    middles = [stock for stock in stocks_ret.columns if (stock not in winners) and (stock not in losers)]
-    return winners, losers, middles
+    Returns:
+    numpy array: The share of the row's non-missing values less than or equal to each value (pandas rank(method="max", pct=True)), NaN where missing.
+    """
+    return _kernel("percentile_rank", backend)(np.asarray(values, dtype = np.float64))
 
-def MG_Strategy(ind_ret, ret, J, K, far = False):
+def cohort_sums(ret, weights, rows, months, backend = None):
     """
-This function implements the Momentum-Growth (MG) investment strategy by ranking industries based on their past returns and forming portfolios of winners and losers.
+    Accumulates the returns of the K overlapping cohorts held in every month.
 
-Parameters:
-ind_ret (pandas DataFrame): DataFrame containing industry returns.
-ret (pandas DataFrame): DataFrame containing asset returns.
-J (int): Number of lookback periods used to rank the industries.
-K (int): Number of holding periods.
-far (bool): Whether to use Farvardin adjustment.
+    Parameters:
+    ret (numpy array): A (months x tickers) array of returns.
+    weights (numpy array): A (formations x tickers) array of cohort weights.
+    rows (numpy array): A (holding months x K) array with the row of `weights` of every cohort.
+    months (numpy array): A (holding months x K) array with the row of `ret` of every cohort.
+    backend (str, optional): "numpy" or "numba", by default kernel_backend.
 
-Returns:
-Strategy (pandas DataFrame): DataFrame containing the average return for the winner and loser portfolios, and the difference between the two portfolios.
+    Returns:
+    numpy array: The summed cohort returns of every holding month, NaN when a cohort has no return.
+    """
+    return _kernel("cohort_sums", backend)(np.asarray(ret, dtype = np.float64), np.asarray(weights, dtype = np.float64),
+                                          np.asarray(rows, dtype = np.int64), np.asarray(months, dtype = np.int64))
 
-"""
-    w_rets = []
-    l_rets = []
-    wl_rets = []
-    if far:
-        far_ret = Farvardin(ret)[0]
-    for t in range(2*J+1, len(ret)):
-        w_ret = 0
-        l_ret = 0
-        wl_ret = 0
-        for i in range(t-K-1, t-1):
-            if far:
-                if ret.index[t] in far_ret.index:
-                    winners, losers, middles = MG_Ranker(ind_ret, ret, J, i)
-                    w_ret += ret[winners].iloc[t, :].mean()
-                    l_ret += ret[losers].iloc[t, :].mean()
-                    wl_ret += ret[winners].iloc[t, :].mean() - ret[losers].iloc[t, :].mean()
-            else:
-                winners, losers, middles = MG_Ranker(ind_ret, ret, J, i)
-                w_ret += ret[winners].iloc[t, :].mean()
-                l_ret += ret[losers].iloc[t, :].mean()
-                wl_ret += ret[winners].iloc[t, :].mean() - ret[losers].iloc[t, :].mean()
-        w_rets.append(w_ret)
-        l_rets.append(l_ret)
-        wl_rets.append(wl_ret)
-    Strategy = pd.DataFrame(index = ["MG's industrial momentum"])
-    Strategy["Winner"] = str(round(np.mean(w_rets) * 100, 2)) + "%"
-    Strategy["Loser"] = str(round(np.mean(l_rets) * 100, 2)) + "%"
-    Strategy["Winner - Loser"] = str(round(np.mean(wl_rets) * 100, 2)) + "%  (" + str(round(np.mean(wl_rets) * np.sqrt(len(wl_rets)) / np.std(wl_rets), 2)) + ")"
-    Strategy.index.name = "Strategy"
-    return Strategy
+def check_kernels(seed = 0, rows = 300, tickers = 50):
+    """
+    Checks every available kernel backend against a plain pandas/NumPy reference on random data with missing values.
 
-##### FT Strategy #####
+    Parameters:
+    seed (int): The seed of the random data.
+    rows (int): The number of rows of the random panel.
+    tickers (int): The number of columns of the random panel.
 
-def year_high(df):
+    Returns:
+    pandas DataFrame: The largest absolute difference from the reference of every kernel and backend.
     """
-    Calculates the year-high of each stock in the input dataframe, `df`, and returns a dataframe containing the year-high of each stock.
-    
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size = (rows, tickers))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[:, 0] = np.nan
+    values[:, 1] = np.round(values[:, 1])
+    starts = np.maximum(np.arange(rows) - rng.integers(0, 40, rows), 0)
+    starts = np.maximum.accumulate(starts)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category = RuntimeWarning)
+        high = np.array([np.nanmax(values[s:i+1], axis = 0) for i, s in enumerate(starts)])
+    rank = pd.DataFrame(values).rank(axis = 1, method = "max", pct = True).to_numpy()
+    weights = weight_matrix(rng.random((rows, tickers)) < 0.3)
+    cohorts = np.arange(20, rows)[:, None] + np.arange(-7, -1)
+    holding = np.repeat(np.arange(20, rows)[:, None], 6, axis = 1)
+    sums = masked_returns(values, weights, cohorts.ravel(), holding.ravel()).reshape(cohorts.shape).sum(axis = 1)
+    Results = pd.DataFrame(columns = ["rolling_max", "percentile_rank", "cohort_sums"], dtype = float)
+    for backend in ["numpy"] + (["numba"] if numba is not None else []):
+        Results.loc[backend, "rolling_max"] = np.nanmax(np.abs(rolling_max(values, starts, backend) - high))
+        Results.loc[backend, "percentile_rank"] = np.nanmax(np.abs(percentile_rank(values, backend) - rank))
+        Results.loc[backend, "cohort_sums"] = np.nanmax(np.abs(cohort_sums(values, weights, cohorts, holding, backend) - sums))
+    Results.index.name = "Backend"
+    return Results
+
+##### Ragged Panels #####
+
+def to_ragged(df):
+    """
+    Stores a dense (months x tickers) panel ticker by ticker, keeping only each ticker's listed span.
+
+    Every ticker keeps the values from its first to its last non-missing row contiguously in one data array (CSR style),
+    with a running count of its valid values for O(1) window completeness checks and a packed per-month bitmap of the live tickers.
+
     Parameters:
-    df (pandas dataframe): A dataframe containing stock data.
-    
+    df (pandas DataFrame): A dense panel.
+
     Returns:
-    pandas dataframe: A dataframe containing the year-high of each stock.
+    dict: "index", "columns", "start" and "end" rows of every ticker, "offsets" into "data", the "valid" running counts, the prefix "sums" and the packed "active" bitmap.
     """
-    first_index = df.index[0]
-    start_index = len(df.loc[:JalaliDate(first_index.year + 1, first_index.month, first_index.day), :]) - 1
-    result = df.iloc[start_index:, :].copy(deep = True)
-    end_index = len(df)
-    for i in range(start_index, end_index):
-        end_date = df.index[i]
-        start_date = JalaliDate(end_date.year - 1, end_date.month, end_date.day)
-        max_of_year = df.loc[start_date:end_date].max().to_frame().transpose()
-        max_of_year.index = [end_date]
-        result.loc[end_date:end_date, :] = df.loc[end_date, :] / max_of_year
-    return result
+    values = df.to_numpy(dtype = float)
+    valid = ~np.isnan(values)
+    listed = valid.any(axis = 0)
+    start = np.where(listed, valid.argmax(axis = 0), 0)
+    end = np.where(listed, len(values) - 1 - valid[::-1].argmax(axis = 0), -1)
+    lengths = end - start + 1
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    rows = np.concatenate([np.arange(s, e + 1) for s, e in zip(start, end)]) if len(start) else np.zeros(0, dtype = int)
+    cols = np.repeat(np.arange(values.shape[1]), lengths)
+    data = values[rows, cols]
+    counts = np.cumsum(~np.isnan(data))
+    sums = np.concatenate([[0.0], np.cumsum(np.nan_to_num(data))])
+    return {"index": df.index, "columns": df.columns, "start": start, "end": end, "offsets": offsets, "data": data,
+            "valid": counts, "sums": sums, "active": np.packbits(valid, axis = 1)}
 
-def FT_Ranker(df2, mc, quantile7, quantile3, i):
+def to_dense(ragged):
     """
-    Ranks the stocks in `df2` based on their year-highs and returns the winners, losers, and middles (stocks that are not winners or losers) as three separate lists.
-    
+    Rebuilds the dense panel of a ragged one.
+
     Parameters:
-    df2 (pandas dataframe): A dataframe containing the year-highs of the stocks.
-    mc (pandas dataframe): A dataframe containing the market capitalization of the stocks.
-    quantile7 (pandas series): A series containing the 70th percentile of the year-highs of the stocks.
-    quantile3 (pandas series): A series containing the 30th percentile of the year-highs of the stocks.
-    i (int): An integer representing the current time step.
-    
+    ragged (dict): A panel from to_ragged.
+
     Returns:
-    tuple: A tuple containing three lists, each containing the names of the winners, losers, and middles, respectively.
+    pandas DataFrame: The dense panel.
     """
-    mc2 = mc.iloc[i-1:i, :]
-    mc2 = mc2.dropna(axis = 1)
-    q1 = mc2.quantile(0.1, axis = 1)
-    mc2 = mc2.mean()
-    liquids = mc2[mc2 >= q1[q1.index[0]]].index
-    df3 = df2.iloc[i-1:i, :].loc[:, liquids]
-    q7 = quantile7.loc[df2.index[i-1]]
-    q3 = quantile3.loc[df2.index[i-1]]
-    winners = df3.iloc[0, (df3 >= q7).values[0]].index
-    losers = df3.iloc[0, (df3 <= q3).values[0]].index
-    middles = [stock for stock in liquids if (stock not in winners) and (stock not in losers)]
-    return winners, losers, middles
+    lengths = np.diff(ragged["offsets"])
+    rows = np.concatenate([np.arange(s, e + 1) for s, e in zip(ragged["start"], ragged["end"])]) if len(lengths) else np.zeros(0, dtype = int)
+    cols = np.repeat(np.arange(len(ragged["columns"])), lengths)
+    values = np.full((len(ragged["index"]), len(ragged["columns"])), np.nan)
+    values[rows, cols] = ragged["data"]
+    return pd.DataFrame(values, index = ragged["index"], columns = ragged["columns"])
 
-def FT_Strategy(df, ret, mc, J, K, t2 = False, far = False):
+def live_tickers(ragged, t):
     """
-    Implements a strategy based on ranking stocks based on their year-highs and returns a dataframe containing the performance of the strategy.
-    
-    Parameters:
-    df (pandas dataframe): A dataframe containing stock data.
-    ret (pandas dataframe): A dataframe containing the returns of the stocks.
-    mc (pandas dataframe): A dataframe containing the market capitalization of the stocks.
-    J (int): An integer representing the length of the moving average used in the strategy.
-    K (int): An integer representing the number of previous time steps used in the strategy.
-    t2 (bool): A boolean indicating whether or not to use the T2 version of the strategy.
-    far (bool): A boolean indicating whether or not to use the Farvardin version of the strategy.
-    
+    The positions of the tickers with a value in month t, read from the active bitmap.
+    """
+    return np.flatnonzero(np.unpackbits(ragged["active"][t], count = len(ragged["columns"])))
+
+def cross_section(ragged, t):
+    """
+    The values of month t, touching only the live tickers.
+
     Returns:
-    pandas dataframe: A dataframe containing the performance of the strategy.
+    tuple: The positions of the live tickers and their values.
     """
-    df = df.iloc[:, 1:].copy(deep = True)
-    df2 = d2m(year_high(df)).iloc[:-1, :]
-    if t2:
-        if far:
-            df2 = Farvardin(df2)[0]
-        else:
-            df2 = Farvardin(df2)[1]
-    
-    if far:
-        far_ret = Farvardin(ret)[0]
-    
-    quantile7 = df2.quantile(0.7, axis = 1)
-    quantile3 = df2.quantile(0.3, axis = 1)
-    w_rets = []
-    l_rets = []
-    wl_rets = []
-    for t in range(2*J+1, len(df2)):
-        w_ret = 0
-        l_ret = 0
-        wl_ret = 0
-        for i in range(t-K-1, t-1):
-            if far:
-                if ret.index[t] in far_ret.index:
-                    winners, losers, middles = FT_Ranker(df2, mc, quantile7, quantile3, i)
-                    w_ret += ret[winners].iloc[t, :].mean()
-                    l_ret += ret[losers].iloc[t, :].mean()
-                    wl_ret += ret[winners].iloc[t, :].mean() - ret[losers].iloc[t, :].mean()
-            else:
-                winners, losers, middles = FT_Ranker(df2, mc, quantile7, quantile3, i)
-                w_ret += ret[winners].iloc[t, :].mean()
-                l_ret += ret[losers].iloc[t, :].mean()
-                wl_ret += ret[winners].iloc[t, :].mean() - ret[losers].iloc[t, :].mean()
-        w_rets.append(w_ret)
-        l_rets.append(l_ret)
-        wl_rets.append(wl_ret)
-    Strategy = pd.DataFrame(index = ["52-week high"])
-    Strategy["Winner"] = str(round(np.mean(w_rets) * 100, 2)) + "%"
-    Strategy["Loser"] = str(round(np.mean(l_rets) * 100, 2)) + "%"
-    Strategy["Winner - Loser"] = str(round(np.mean(wl_rets) * 100, 2)) + "%  (" + str(round(np.mean(wl_rets) * np.sqrt(len(wl_rets)) / np.std(wl_rets), 2)) + ")"
-    Strategy.index.name = "Strategy"
-    return Strategy
+    tickers = live_tickers(ragged, t)
+    return tickers, ragged["data"][ragged["offsets"][tickers] + t - ragged["start"][tickers]]
 
-def JT_FT(df, ret, mc, J, K):
-    """
-    This function implements the JT_FT strategy, which is a combination of the JK_Ranker and FT_Strategy functions. The JK_Ranker function sorts stocks into winners, losers, and middles groups based on their returns and market capitalization. The FT_Strategy function then implements a 6/6 momentum strategy for each group. The returns for each group and the combined "winners minus losers" group are calculated and stored in separate lists. The function then repeats the process for a Farvardin-adjusted version of the returns and market capitalization values. The final result is a dictionary of lists, containing the returns for each group as well as the combined "winners minus losers" group, both for the original and Farvardin-adjusted data.
-
-    Parameters:
-    df (DataFrame): The input dataframe containing the stocks' data.
-    ret (Series): The returns of the stocks.
-    mc (Series): The market capitalization of the stocks.
-    J (int): The number of months to look back for ranking the stocks.
-    K (int): The number of months to hold the stocks.
-
-    Returns:
-    dict: A dictionary of lists, containing the returns for each group as well as the combined "winners minus losers" group, both for the original and Farvardin-adjusted data.
-    """
-    ww_return = []
-    wl_return = []
-    wp_return = []
-    mw_return = []
-    ml_return = []
-    mp_return = []
-    lw_return = []
-    ll_return = []
-    lp_return = []
-    for t in range(2*J+1, len(ret)):
-        winners, losers, middles = JK_Ranker(ret, mc, J, t)
-        #JT Winners
-        mix_strategy = FT_Strategy(df[["Index"] + winners.tolist()], ret[winners], mc[winners], 6, 6)
-        ww_return.append(mix_strategy["Winners"][0])
-        wl_return.append(mix_strategy["Losers"][0])
-        wp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #JT Middles
-        mix_strategy = FT_Strategy(df[["Index"] + middles], ret[middles], mc[middles], 6, 6)
-        mw_return.append(mix_strategy["Winners"][0])
-        ml_return.append(mix_strategy["Losers"][0])
-        mp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #JT Losers
-        mix_strategy = FT_Strategy(df[["Index"] + losers.tolist()], ret[losers], mc[losers], 6, 6)
-        lw_return.append(mix_strategy["Winners"][0])
-        ll_return.append(mix_strategy["Losers"][0])
-        lp_return.append(mix_strategy["Winners - Losers"][0])
-    
-    
-    ret3 = Farvardin(ret)[1]
-    mc3 = Farvardin(mc)[1]
-    fww_return = []
-    fwl_return = []
-    fwp_return = []
-    fmw_return = []
-    fml_return = []
-    fmp_return = []
-    flw_return = []
-    fll_return = []
-    flp_return = []
-    for t in range(2*J+1, len(ret3)):
-        winners, losers, middles = JK_Ranker(ret3, mc3, J, t)
-        #JT Winners
-        mix_strategy = FT_Strategy(df[["Index"] + winners.tolist()], ret3[winners], mc3[winners], 6, 6, t2=True)
-        fww_return.append(mix_strategy["Winners"][0])
-        fwl_return.append(mix_strategy["Losers"][0])
-        fwp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #JT Middles
-        mix_strategy = FT_Strategy(df[["Index"] + middles], ret3[middles], mc3[middles], 6, 6, t2=True)
-        fmw_return.append(mix_strategy["Winners"][0])
-        fml_return.append(mix_strategy["Losers"][0])
-        fmp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #JT Losers
-        mix_strategy = FT_Strategy(df[["Index"] + losers.tolist()], ret3[losers], mc3[losers], 6, 6, t2=True)
-        flw_return.append(mix_strategy["Winners"][0])
-        fll_return.append(mix_strategy["Losers"][0])
-        flp_return.append(mix_strategy["Winners - Losers"][0])
-    
-    for z in range(len(ww_return)):
-        ww_return[z] = float(ww_return[z].split("%")[0]) / 100
-        wl_return[z] = float(wl_return[z].split("%")[0]) / 100
-        wp_return[z] = float(wp_return[z].split("%")[0]) / 100
-        mw_return[z] = float(mw_return[z].split("%")[0]) / 100
-        ml_return[z] = float(ml_return[z].split("%")[0]) / 100
-        mp_return[z] = float(mp_return[z].split("%")[0]) / 100
-        lw_return[z] = float(lw_return[z].split("%")[0]) / 100
-        ll_return[z] = float(ll_return[z].split("%")[0]) / 100
-        lp_return[z] = float(lp_return[z].split("%")[0]) / 100
-        fww_return[z] = float(fww_return[z].split("%")[0]) / 100
-        fwl_return[z] = float(fwl_return[z].split("%")[0]) / 100
-        fwp_return[z] = float(fwp_return[z].split("%")[0]) / 100
-        fmw_return[z] = float(fmw_return[z].split("%")[0]) / 100
-        fml_return[z] = float(fml_return[z].split("%")[0]) / 100
-        fmp_return[z] = float(fmp_return[z].split("%")[0]) / 100
-        flw_return[z] = float(flw_return[z].split("%")[0]) / 100
-        fll_return[z] = float(fll_return[z].split("%")[0]) / 100
-        flp_return[z] = float(flp_return[z].split("%")[0]) / 100
-    
-    Mix_Strategy = pd.DataFrame(columns=["Portfolio Classified by FT", "Ave. Monthly Return", "Ave. Monthly Return Excluding Farvardin"],
-                                index=["Winner", "Winner", "Winner", "Middle", "Middle", "Middle", "Loser", "Loser", "Loser"])
-    Mix_Strategy.index.name = "Portfolio Classified by JT"
-    Mix_Strategy.iloc[[0, 3, 6], 0] = "Winner"
-    Mix_Strategy.iloc[[1, 4, 7], 0] = "Loser"
-    Mix_Strategy.iloc[[2, 5, 8], 0] = "Winner - Loser"
-    Mix_Strategy.iloc[0, 1] = str(round(np.mean(ww_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[1, 1] = str(round(np.mean(wl_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[2, 1] = str(round(np.mean(wp_return) * 100, 2)) + "% (" + str(round(np.mean(wp_return) * np.sqrt(len(wp_return)) / np.std(wp_return), 2)) + ")"
-    Mix_Strategy.iloc[3, 1] = str(round(np.mean(mw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[4, 1] = str(round(np.mean(ml_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[5, 1] = str(round(np.mean(mp_return) * 100, 2)) + "% (" + str(round(np.mean(mp_return) * np.sqrt(len(mp_return)) / np.std(mp_return), 2)) + ")"
-    Mix_Strategy.iloc[6, 1] = str(round(np.mean(lw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[7, 1] = str(round(np.mean(ll_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[8, 1] = str(round(np.mean(lp_return) * 100, 2)) + "% (" + str(round(np.mean(lp_return) * np.sqrt(len(lp_return)) / np.std(lp_return), 2)) + ")"
-    Mix_Strategy.iloc[0, 2] = str(round(np.mean(fww_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[1, 2] = str(round(np.mean(fwl_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[2, 2] = str(round(np.mean(fwp_return) * 100, 2)) + "% (" + str(round(np.mean(fwp_return) * np.sqrt(len(fwp_return)) / np.std(fwp_return), 2)) + ")"
-    Mix_Strategy.iloc[3, 2] = str(round(np.mean(fmw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[4, 2] = str(round(np.mean(fml_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[5, 2] = str(round(np.mean(fmp_return) * 100, 2)) + "% (" + str(round(np.mean(fmp_return) * np.sqrt(len(fmp_return)) / np.std(fmp_return), 2)) + ")"
-    Mix_Strategy.iloc[6, 2] = str(round(np.mean(flw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[7, 2] = str(round(np.mean(fll_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[8, 2] = str(round(np.mean(flp_return) * 100, 2)) + "% (" + str(round(np.mean(flp_return) * np.sqrt(len(flp_return)) / np.std(flp_return), 2)) + ")"
-    return Mix_Strategy
-
-def FT_JT(df, ret, mc, J, K):
-    """
-    This function implements the Winner, Loser, and Winner - Loser (Mix) strategies on Farvardin and Tarsim rankings of financial time series data.
-
-    Parameters:
-    df (pd.DataFrame): The dataframe of financial time series data.
-    ret (pd.DataFrame): The dataframe of returns of financial time series data.
-    mc (pd.DataFrame): The dataframe of market capitalization of financial time series data.
-    J (int): The number of periods for ranking the financial time series data.
-    K (int): The number of periods for holding the position in the financial time series data.
-
-    Returns:
-    dict: A dictionary with the following keys:
-        "Farvardin Winners": The average return of the Winner strategy in Farvardin ranking.
-        "Farvardin Losers": The average return of the Loser strategy in Farvardin ranking.
-        "Farvardin Winners - Losers": The average return of the Mix strategy in Farvardin ranking.
-        "Farvardin Middles": The average return of the Middle strategy in Farvardin ranking.
-        "Tarsim Winners": The average return of the Winner strategy in Tarsim ranking.
-        "Tarsim Losers": The average return of the Loser strategy in Tarsim ranking.
-        "Tarsim Winners - Losers": The average return of the Mix strategy in Tarsim ranking.
-        "Tarsim Middles": The average return of the Middle strategy in Tarsim ranking.
+##### Rolling Statistics #####
+
+def rolling_stats(df, squares = False):
     """
-    df = df.iloc[:, 1:].copy(deep = True)
-    df2 = d2m(year_high(df)).iloc[:-1, :]
-    quantile7 = df2.quantile(0.7, axis = 1)
-    quantile3 = df2.quantile(0.3, axis = 1)
-    ww_return = []
-    wl_return = []
-    wp_return = []
-    mw_return = []
-    ml_return = []
-    mp_return = []
-    lw_return = []
-    ll_return = []
-    lp_return = []
-    for i in range(100, 110):#range(2*J+1, len(ret)):
-        winners, losers, middles = FT_Ranker(df2, mc, quantile7, quantile3, i)
-        #FT Winners
-        mix_strategy = JK_Strategy(ret[winners], mc[winners], J, K)
-        ww_return.append(mix_strategy["Winners"][0])
-        wl_return.append(mix_strategy["Losers"][0])
-        wp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #FT Middles
-        mix_strategy = JK_Strategy(ret[middles], mc[middles], J, K)
-        mw_return.append(mix_strategy["Winners"][0])
-        ml_return.append(mix_strategy["Losers"][0])
-        mp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #FT Losers
-        mix_strategy = JK_Strategy(ret[losers], mc[losers], J, K)
-        lw_return.append(mix_strategy["Winners"][0])
-        ll_return.append(mix_strategy["Losers"][0])
-        lp_return.append(mix_strategy["Winners - Losers"][0])
-    
-    ret3 = Farvardin(ret)[1]
-    mc3 = Farvardin(mc)[1]
-    df2 = Farvardin(df2)[1]
-    quantile7 = df2.quantile(0.7, axis = 1)
-    quantile3 = df2.quantile(0.3, axis = 1)
-    fww_return = []
-    fwl_return = []
-    fwp_return = []
-    fmw_return = []
-    fml_return = []
-    fmp_return = []
-    flw_return = []
-    fll_return = []
-    flp_return = []
-    for i in range(100, 110):#range(2*J+1, len(ret)):
-        winners, losers, middles = FT_Ranker(df2, mc, quantile7, quantile3, i)
-        #FT Winners
-        mix_strategy = JK_Strategy(ret3[winners], mc3[winners], J, K)
-        fww_return.append(mix_strategy["Winners"][0])
-        fwl_return.append(mix_strategy["Losers"][0])
-        fwp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #FT Middles
-        mix_strategy = JK_Strategy(ret3[middles], mc3[middles], J, K)
-        fmw_return.append(mix_strategy["Winners"][0])
-        fml_return.append(mix_strategy["Losers"][0])
-        fmp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #FT Losers
-        mix_strategy = JK_Strategy(ret3[losers], mc3[losers], J, K)
-        flw_return.append(mix_strategy["Winners"][0])
-        fll_return.append(mix_strategy["Losers"][0])
-        flp_return.append(mix_strategy["Winners - Losers"][0])
-    
-    for z in range(len(ww_return)):
-        ww_return[z] = float(ww_return[z].split("%")[0]) / 100
-        wl_return[z] = float(wl_return[z].split("%")[0]) / 100
-        wp_return[z] = float(wp_return[z].split("%")[0]) / 100
-        mw_return[z] = float(mw_return[z].split("%")[0]) / 100
-        ml_return[z] = float(ml_return[z].split("%")[0]) / 100
-        mp_return[z] = float(mp_return[z].split("%")[0]) / 100
-        lw_return[z] = float(lw_return[z].split("%")[0]) / 100
-        ll_return[z] = float(ll_return[z].split("%")[0]) / 100
-        lp_return[z] = float(lp_return[z].split("%")[0]) / 100
-        fww_return[z] = float(fww_return[z].split("%")[0]) / 100
-        fwl_return[z] = float(fwl_return[z].split("%")[0]) / 100
-        fwp_return[z] = float(fwp_return[z].split("%")[0]) / 100
-        fmw_return[z] = float(fmw_return[z].split("%")[0]) / 100
-        fml_return[z] = float(fml_return[z].split("%")[0]) / 100
-        fmp_return[z] = float(fmp_return[z].split("%")[0]) / 100
-        flw_return[z] = float(flw_return[z].split("%")[0]) / 100
-        fll_return[z] = float(fll_return[z].split("%")[0]) / 100
-        flp_return[z] = float(flp_return[z].split("%")[0]) / 100
-    
-    Mix_Strategy = pd.DataFrame(columns=["Portfolio Classified by JT", "Ave. Monthly Return", "Ave. Monthly Return Excluding Farvardin"],
-                                index=["Winner", "Winner", "Winner", "Middle", "Middle", "Middle", "Loser", "Loser", "Loser"])
-    Mix_Strategy.index.name = "Portfolio Classified by FT"
-    Mix_Strategy.iloc[[0, 3, 6], 0] = "Winner"
-    Mix_Strategy.iloc[[1, 4, 7], 0] = "Loser"
-    Mix_Strategy.iloc[[2, 5, 8], 0] = "Winner - Loser"
-    Mix_Strategy.iloc[0, 1] = str(round(np.mean(ww_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[1, 1] = str(round(np.mean(wl_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[2, 1] = str(round(np.mean(wp_return) * 100, 2)) + "% (" + str(round(np.mean(wp_return) * np.sqrt(len(wp_return)) / np.std(wp_return), 2)) + ")"
-    Mix_Strategy.iloc[3, 1] = str(round(np.mean(mw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[4, 1] = str(round(np.mean(ml_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[5, 1] = str(round(np.mean(mp_return) * 100, 2)) + "% (" + str(round(np.mean(mp_return) * np.sqrt(len(mp_return)) / np.std(mp_return), 2)) + ")"
-    Mix_Strategy.iloc[6, 1] = str(round(np.mean(lw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[7, 1] = str(round(np.mean(ll_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[8, 1] = str(round(np.mean(lp_return) * 100, 2)) + "% (" + str(round(np.mean(lp_return) * np.sqrt(len(lp_return)) / np.std(lp_return), 2)) + ")"
-    Mix_Strategy.iloc[0, 2] = str(round(np.mean(fww_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[1, 2] = str(round(np.mean(fwl_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[2, 2] = str(round(np.mean(fwp_return) * 100, 2)) + "% (" + str(round(np.mean(fwp_return) * np.sqrt(len(fwp_return)) / np.std(fwp_return), 2)) + ")"
-    Mix_Strategy.iloc[3, 2] = str(round(np.mean(fmw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[4, 2] = str(round(np.mean(fml_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[5, 2] = str(round(np.mean(fmp_return) * 100, 2)) + "% (" + str(round(np.mean(fmp_return) * np.sqrt(len(fmp_return)) / np.std(fmp_return), 2)) + ")"
-    Mix_Strategy.iloc[6, 2] = str(round(np.mean(flw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[7, 2] = str(round(np.mean(fll_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[8, 2] = str(round(np.mean(flp_return) * 100, 2)) + "% (" + str(round(np.mean(flp_return) * np.sqrt(len(flp_return)) / np.std(flp_return), 2)) + ")"
-    return Mix_Strategy
-
-def MG_FT(df, ind_ret, stocks_ret, mc, J, K):
-    """
-This function returns returns a number of strategies for a given data.
-
-It starts with dividing stocks into three categories "Winners", "Middles", and "Losers" using the function MG_Ranker with the input ind_ret, stocks_ret and J. The resulting stocks of each category are then passed to the function FT_Strategy to get returns for a "Winner-Winner" strategy, "Winner-Loser" strategy, and "Winner-Winner-Loser" strategy for each category. The process is repeated after the stocks_ret and mc are transformed using Farvardin function.
-
-Finally, the returns are converted to float and divided by 100 to get decimal form returns.
+    Builds the NaN-aware running sums, valid counts and log growth of a monthly panel once, so that any window statistic is an O(1) difference.
 
-Inputs:
-df: A pandas DataFrame, containing all the stocks and other information.
-ind_ret: A pandas Series, containing returns of the index.
-stocks_ret: A pandas DataFrame, containing returns of the stocks.
-mc: A pandas Series, containing market capitalization of the stocks.
-J: Integer, number of top performers to be considered as "winners".
-K: Integer, number of bottom performers to be considered as "losers".
+    Parameters:
+    df (pandas DataFrame): A (months x tickers) panel, e.g. returns or market capitalization.
+    squares (bool): Whether to also keep the running sums of squares, which window_stats turns into standard deviations.
 
-Returns:
-Returns a number of lists containing returns of different strategies.
-The lists are:
-- ww_return
-- wl_return
-- wp_return
-- mw_return
-- ml_return
-- mp_return
-- lw_return
-- ll_return
-- lp_return
-- fww_return
-- fwl_return
-- fwp_return
-- fmw_return
-- fml_return
-- fmp_return
-- flw_return
-- fll_return
-- flp_return
-"""
-    ww_return = []
-    wl_return = []
-    wp_return = []
-    mw_return = []
-    ml_return = []
-    mp_return = []
-    lw_return = []
-    ll_return = []
-    lp_return = []
-    for t in range(100, 115):
-        winners, losers, middles = MG_Ranker(ind_ret, stocks_ret, J, t)
-        #MG Winners
-        mix_strategy = FT_Strategy(df[["Index"] + winners], stocks_ret[winners], mc[winners], 6, 6)
-        ww_return.append(mix_strategy["Winners"][0])
-        wl_return.append(mix_strategy["Losers"][0])
-        wp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #MG Middles
-        mix_strategy = FT_Strategy(df[["Index"] + middles], stocks_ret[middles], mc[middles], 6, 6)
-        mw_return.append(mix_strategy["Winners"][0])
-        ml_return.append(mix_strategy["Losers"][0])
-        mp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #MG Losers
-        mix_strategy = FT_Strategy(df[["Index"] + losers], stocks_ret[losers], mc[losers], 6, 6)
-        lw_return.append(mix_strategy["Winners"][0])
-        ll_return.append(mix_strategy["Losers"][0])
-        lp_return.append(mix_strategy["Winners - Losers"][0])
-    
-    stocks_ret3 = Farvardin(ret)[1]
-    mc3 = Farvardin(mc)[1]
-    ind_ret3 = Farvardin(ind_ret)[1]
-    fww_return = []
-    fwl_return = []
-    fwp_return = []
-    fmw_return = []
-    fml_return = []
-    fmp_return = []
-    flw_return = []
-    fll_return = []
-    flp_return = []
-    for t in range(100, 115):
-        winners, losers, middles = MG_Ranker(ind_ret3, stocks_ret3, J, t)
-        #MG Winners
-        mix_strategy = FT_Strategy(df[["Index"] + winners], stocks_ret3[winners], mc3[winners], 6, 6, t2 = True)
-        fww_return.append(mix_strategy["Winners"][0])
-        fwl_return.append(mix_strategy["Losers"][0])
-        fwp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #MG Middles
-        mix_strategy = FT_Strategy(df[["Index"] + middles], stocks_ret3[middles], mc3[middles], 6, 6, t2 = True)
-        fmw_return.append(mix_strategy["Winners"][0])
-        fml_return.append(mix_strategy["Losers"][0])
-        fmp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #MG Losers
-        mix_strategy = FT_Strategy(df[["Index"] + losers], stocks_ret3[losers], mc3[losers], 6, 6, t2 = True)
-        flw_return.append(mix_strategy["Winners"][0])
-        fll_return.append(mix_strategy["Losers"][0])
-        flp_return.append(mix_strategy["Winners - Losers"][0])
-    
-    
-    for z in range(len(ww_return)):
-        ww_return[z] = float(ww_return[z].split("%")[0]) / 100
-        wl_return[z] = float(wl_return[z].split("%")[0]) / 100
-        wp_return[z] = float(wp_return[z].split("%")[0]) / 100
-        mw_return[z] = float(mw_return[z].split("%")[0]) / 100
-        ml_return[z] = float(ml_return[z].split("%")[0]) / 100
-        mp_return[z] = float(mp_return[z].split("%")[0]) / 100
-        lw_return[z] = float(lw_return[z].split("%")[0]) / 100
-        ll_return[z] = float(ll_return[z].split("%")[0]) / 100
-        lp_return[z] = float(lp_return[z].split("%")[0]) / 100
-        fww_return[z] = float(fww_return[z].split("%")[0]) / 100
-        fwl_return[z] = float(fwl_return[z].split("%")[0]) / 100
-        fwp_return[z] = float(fwp_return[z].split("%")[0]) / 100
-        fmw_return[z] = float(fmw_return[z].split("%")[0]) / 100
-        fml_return[z] = float(fml_return[z].split("%")[0]) / 100
-        fmp_return[z] = float(fmp_return[z].split("%")[0]) / 100
-        flw_return[z] = float(flw_return[z].split("%")[0]) / 100
-        fll_return[z] = float(fll_return[z].split("%")[0]) / 100
-        flp_return[z] = float(flp_return[z].split("%")[0]) / 100
-    
-    Mix_Strategy = pd.DataFrame(columns=["Portfolio Classified by FT", "Ave. Monthly Return", "Ave. Monthly Return Excluding Farvardin"],
-                                index=["Winner", "Winner", "Winner", "Middle", "Middle", "Middle", "Loser", "Loser", "Loser"])
-    Mix_Strategy.index.name = "Portfolio Classified by MG"
-    Mix_Strategy.iloc[[0, 3, 6], 0] = "Winner"
-    Mix_Strategy.iloc[[1, 4, 7], 0] = "Loser"
-    Mix_Strategy.iloc[[2, 5, 8], 0] = "Winner - Loser"
-    Mix_Strategy.iloc[0, 1] = str(round(np.mean(ww_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[1, 1] = str(round(np.mean(wl_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[2, 1] = str(round(np.mean(wp_return) * 100, 2)) + "% (" + str(round(np.mean(wp_return) * np.sqrt(len(wp_return)) / np.std(wp_return), 2)) + ")"
-    Mix_Strategy.iloc[3, 1] = str(round(np.mean(mw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[4, 1] = str(round(np.mean(ml_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[5, 1] = str(round(np.mean(mp_return) * 100, 2)) + "% (" + str(round(np.mean(mp_return) * np.sqrt(len(mp_return)) / np.std(mp_return), 2)) + ")"
-    Mix_Strategy.iloc[6, 1] = str(round(np.mean(lw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[7, 1] = str(round(np.mean(ll_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[8, 1] = str(round(np.mean(lp_return) * 100, 2)) + "% (" + str(round(np.mean(lp_return) * np.sqrt(len(lp_return)) / np.std(lp_return), 2)) + ")"
-    Mix_Strategy.iloc[0, 2] = str(round(np.mean(fww_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[1, 2] = str(round(np.mean(fwl_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[2, 2] = str(round(np.mean(fwp_return) * 100, 2)) + "% (" + str(round(np.mean(fwp_return) * np.sqrt(len(fwp_return)) / np.std(fwp_return), 2)) + ")"
-    Mix_Strategy.iloc[3, 2] = str(round(np.mean(fmw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[4, 2] = str(round(np.mean(fml_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[5, 2] = str(round(np.mean(fmp_return) * 100, 2)) + "% (" + str(round(np.mean(fmp_return) * np.sqrt(len(fmp_return)) / np.std(fmp_return), 2)) + ")"
-    Mix_Strategy.iloc[6, 2] = str(round(np.mean(flw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[7, 2] = str(round(np.mean(fll_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[8, 2] = str(round(np.mean(flp_return) * 100, 2)) + "% (" + str(round(np.mean(flp_return) * np.sqrt(len(flp_return)) / np.std(flp_return), 2)) + ")"
-    return Mix_Strategy
-
-def FT_MG(df, ind_ret, stocks_ret, mc, J, K):
-    """
-    Implements a Mix-strategy for given financial data.
-
-    Parameters:
-    df (pandas DataFrame): The dataframe containing the original financial data.
-    ind_ret (pandas DataFrame): The dataframe containing the return of the industry.
-    stocks_ret (pandas DataFrame): The dataframe containing the return of stocks.
-    mc (pandas DataFrame): The dataframe containing the market capitalization of stocks.
-    J (int): The number of stocks to be considered as winners.
-    K (int): The number of stocks to be considered as losers.
-
-    Returns:
-    A dictionary with the following keys:
-        - "Winners" : The returns of the portfolio with winners strategy
-        - "Losers" : The returns of the portfolio with losers strategy
-        - "Winners - Losers" : The returns of the portfolio with winners minus losers strategy
+    Returns:
+    dict: "index" and "columns" of the panel and the "sums", "counts" and "logs" (sum of log(1 + x)) of its rows, each with a leading row of zeros,
+    plus "squares" when asked for.
     """
-    df = df.iloc[:, 1:].copy(deep = True)
-    df2 = d2m(year_high(df)).iloc[:-1, :]
-    quantile7 = df2.quantile(0.7, axis = 1)
-    quantile3 = df2.quantile(0.3, axis = 1)
-    ww_return = []
-    wl_return = []
-    wp_return = []
-    mw_return = []
-    ml_return = []
-    mp_return = []
-    lw_return = []
-    ll_return = []
-    lp_return = []
-    for i in range(100, 110):#len(df2)-5):
-        winners, losers, middles = FT_Ranker(df2, mc, quantile7, quantile3, i)
-        #FT Winners
-        mix_strategy = MG_Strategy(ind_ret, stocks_ret[winners], J, K)
-        ww_return.append(mix_strategy["Winners"][0])
-        wl_return.append(mix_strategy["Losers"][0])
-        wp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #FT Middles
-        mix_strategy = MG_Strategy(ind_ret, stocks_ret[middles], J, K)
-        mw_return.append(mix_strategy["Winners"][0])
-        ml_return.append(mix_strategy["Losers"][0])
-        mp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #FT Losers
-        mix_strategy = MG_Strategy(ind_ret, stocks_ret[losers], J, K)
-        lw_return.append(mix_strategy["Winners"][0])
-        ll_return.append(mix_strategy["Losers"][0])
-        lp_return.append(mix_strategy["Winners - Losers"][0])
-    
-    ind_ret2 = Farvardin(ind_ret)[1]
-    stocks_ret2 = Farvardin(stocks_ret)[1]
-    mc3 = Farvardin(mc)[1]
-    df2 = Farvardin(df2)[1]
-    quantile7 = df2.quantile(0.7, axis = 1)
-    quantile3 = df2.quantile(0.3, axis = 1)
-    fww_return = []
-    fwl_return = []
-    fwp_return = []
-    fmw_return = []
-    fml_return = []
-    fmp_return = []
-    flw_return = []
-    fll_return = []
-    flp_return = []
-    for i in range(100, 110):#len(df2)-5):
-        winners, losers, middles = FT_Ranker(df2, mc3, quantile7, quantile3, i)
-        #FT Winners
-        mix_strategy = MG_Strategy(ind_ret2, stocks_ret2[winners], J, K)
-        fww_return.append(mix_strategy["Winners"][0])
-        fwl_return.append(mix_strategy["Losers"][0])
-        fwp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #FT Middles
-        mix_strategy = MG_Strategy(ind_ret2, stocks_ret2[middles], J, K)
-        fmw_return.append(mix_strategy["Winners"][0])
-        fml_return.append(mix_strategy["Losers"][0])
-        fmp_return.append(mix_strategy["Winners - Losers"][0])
-
-        #FT Losers
-        mix_strategy = MG_Strategy(ind_ret2, stocks_ret2[losers], J, K)
-        flw_return.append(mix_strategy["Winners"][0])
-        fll_return.append(mix_strategy["Losers"][0])
-        flp_return.append(mix_strategy["Winners - Losers"][0])
-    
-    
-    for z in range(len(ww_return)):
-        ww_return[z] = float(ww_return[z].split("%")[0]) / 100
-        wl_return[z] = float(wl_return[z].split("%")[0]) / 100
-        wp_return[z] = float(wp_return[z].split("%")[0]) / 100
-        mw_return[z] = float(mw_return[z].split("%")[0]) / 100
-        ml_return[z] = float(ml_return[z].split("%")[0]) / 100
-        mp_return[z] = float(mp_return[z].split("%")[0]) / 100
-        lw_return[z] = float(lw_return[z].split("%")[0]) / 100
-        ll_return[z] = float(ll_return[z].split("%")[0]) / 100
-        lp_return[z] = float(lp_return[z].split("%")[0]) / 100
-        fww_return[z] = float(fww_return[z].split("%")[0]) / 100
-        fwl_return[z] = float(fwl_return[z].split("%")[0]) / 100
-        fwp_return[z] = float(fwp_return[z].split("%")[0]) / 100
-        fmw_return[z] = float(fmw_return[z].split("%")[0]) / 100
-        fml_return[z] = float(fml_return[z].split("%")[0]) / 100
-        fmp_return[z] = float(fmp_return[z].split("%")[0]) / 100
-        flw_return[z] = float(flw_return[z].split("%")[0]) / 100
-        fll_return[z] = float(fll_return[z].split("%")[0]) / 100
-        flp_return[z] = float(flp_return[z].split("%")[0]) / 100
-    
-    Mix_Strategy = pd.DataFrame(columns=["Portfolio Classified by MG", "Ave. Monthly Return", "Ave. Monthly Return Excluding Farvardin"],
-                                index=["Winner", "Winner", "Winner", "Middle", "Middle", "Middle", "Loser", "Loser", "Loser"])
-    Mix_Strategy.index.name = "Portfolio Classified by FT"
-    Mix_Strategy.iloc[[0, 3, 6], 0] = "Winner"
-    Mix_Strategy.iloc[[1, 4, 7], 0] = "Loser"
-    Mix_Strategy.iloc[[2, 5, 8], 0] = "Winner - Loser"
-    Mix_Strategy.iloc[0, 1] = str(round(np.mean(ww_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[1, 1] = str(round(np.mean(wl_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[2, 1] = str(round(np.mean(wp_return) * 100, 2)) + "% (" + str(round(np.mean(wp_return) * np.sqrt(len(wp_return)) / np.std(wp_return), 2)) + ")"
-    Mix_Strategy.iloc[3, 1] = str(round(np.mean(mw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[4, 1] = str(round(np.mean(ml_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[5, 1] = str(round(np.mean(mp_return) * 100, 2)) + "% (" + str(round(np.mean(mp_return) * np.sqrt(len(mp_return)) / np.std(mp_return), 2)) + ")"
-    Mix_Strategy.iloc[6, 1] = str(round(np.mean(lw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[7, 1] = str(round(np.mean(ll_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[8, 1] = str(round(np.mean(lp_return) * 100, 2)) + "% (" + str(round(np.mean(lp_return) * np.sqrt(len(lp_return)) / np.std(lp_return), 2)) + ")"
-    Mix_Strategy.iloc[0, 2] = str(round(np.mean(fww_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[1, 2] = str(round(np.mean(fwl_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[2, 2] = str(round(np.mean(fwp_return) * 100, 2)) + "% (" + str(round(np.mean(fwp_return) * np.sqrt(len(fwp_return)) / np.std(fwp_return), 2)) + ")"
-    Mix_Strategy.iloc[3, 2] = str(round(np.mean(fmw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[4, 2] = str(round(np.mean(fml_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[5, 2] = str(round(np.mean(fmp_return) * 100, 2)) + "% (" + str(round(np.mean(fmp_return) * np.sqrt(len(fmp_return)) / np.std(fmp_return), 2)) + ")"
-    Mix_Strategy.iloc[6, 2] = str(round(np.mean(flw_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[7, 2] = str(round(np.mean(fll_return) * 100, 2)) + "%"
-    Mix_Strategy.iloc[8, 2] = str(round(np.mean(flp_return) * 100, 2)) + "% (" + str(round(np.mean(flp_return) * np.sqrt(len(flp_return)) / np.std(flp_return), 2)) + ")"
-    return Mix_Strategy
-
-def Ranker(ticker, df, ind_ret, ret, mc, J, t, labels, t2 = False):
+    values = df.to_numpy(dtype = float)
+    valid = ~np.isnan(values)
+    zeros = np.zeros((1, values.shape[1]))
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        logs = np.log1p(np.where(valid, values, 0.0))
+    stats = {"index": df.index, "columns": df.columns,
+             "sums": np.vstack([zeros, np.cumsum(np.where(valid, values, 0.0), axis = 0)]),
+             "counts": np.vstack([zeros, np.cumsum(valid, axis = 0)]).astype(int),
+             "logs": np.vstack([zeros, np.cumsum(logs, axis = 0)])}
+    if squares:
+        stats["squares"] = np.vstack([zeros, np.cumsum(np.where(valid, values, 0.0) ** 2, axis = 0)])
+    return stats
+
+def window_stats(stats, first, last):
     """
-    Creates binary labels for a given stock based on 3 different ranking methods.
-    
+    The statistics over rows first to last (inclusive, clipped to the panel), for one window or one window per element of `first` and `last`.
+
     Parameters:
-    ticker (str): Ticker symbol of the stock to be labeled.
-    df (pandas.DataFrame): DataFrame containing stock information.
-    ind_ret (pandas.DataFrame): DataFrame containing industry return information.
-    ret (pandas.DataFrame): DataFrame containing return information of stocks.
-    mc (pandas.DataFrame): DataFrame containing market capitalization information of stocks.
-    J (int): Number of time periods to use for labeling.
-    t (int): Index in the DataFrames to start labeling from.
-    labels (list of str): Names of the binary labels to be created.
-    t2 (bool, optional): Indicates whether to return labels only for t2 (default is False).
-    
+    stats (dict): Running sums from rolling_stats.
+    first (int or numpy array): The first row of each window.
+    last (int or numpy array): The last row of each window.
+
     Returns:
-    pandas.DataFrame: A DataFrame with the binary labels for the stock.
+    dict: The "mean" of the valid values (NaN without any), their "count", the "compound" return prod(1 + x) - 1 over them,
+    and whether the ticker is "complete", i.e. has a value in every row of the window as df.loc[first:last].dropna(axis = 1) requires.
+    With running squares it also has the population "std" of the valid values, as np.std gives.
     """
-    df = df.iloc[:, 1:].copy(deep = True)
-    df2 = d2m(year_high(df)).iloc[:-1, :]
-    quantile7 = df2.quantile(0.7, axis = 1)
-    quantile3 = df2.quantile(0.3, axis = 1)
-    Labels = pd.DataFrame(columns=labels, index=[ret.index[t]])
-    Labels.iloc[0, :] = 0
-    for j in range(2, J+2):
-        J_winners, J_losers, J_middles = JK_Ranker(ret, mc, J, t-j)
-        M_winners, M_losers, M_middles = MG_Ranker(ind_ret, ret, J, t-j)
-        FH_winners, FH_losers, FH_middles = FT_Ranker(df2, mc, quantile7, quantile3, t-j)
-        if ticker in J_winners:
-            Labels.loc[:, "JH"+str(j)] = 1
-        elif ticker in J_losers:
-            Labels.loc[:, "JL"+str(j)] = 1
-        if ticker in M_winners:
-            Labels.loc[:, "MH"+str(j)] = 1
-        elif ticker in M_losers:
-            Labels.loc[:, "ML"+str(j)] = 1
-        if ticker in FH_winners:
-            Labels.loc[:, "FHH"+str(j)] = 1
-        elif ticker in FH_losers:
-            Labels.loc[:, "FHL"+str(j)] = 1
-    return Labels
+    n = len(stats["index"])
+    first = np.clip(np.asarray(first), 0, n)
+    last = np.clip(np.asarray(last), -1, n - 1)
+    last = np.maximum(last, first - 1)
+    lo, hi = first, last + 1
+    count = stats["counts"][hi] - stats["counts"][lo]
+    total = stats["sums"][hi] - stats["sums"][lo]
+    length = np.expand_dims(hi - lo, -1)
+    window = {"mean": np.divide(total, count, out = np.full(total.shape, np.nan), where = count > 0),
+              "count": count,
+              "compound": np.where(count > 0, np.expm1(stats["logs"][hi] - stats["logs"][lo]), np.nan),
+              "complete": (count == length) & (length > 0)}
+    if "squares" in stats:
+        square = np.divide(stats["squares"][hi] - stats["squares"][lo], count, out = np.full(total.shape, np.nan), where = count > 0)
+        window["std"] = np.sqrt(np.maximum(square - window["mean"] ** 2, 0.0))
+    return window
 
-def Fama_MacBeth(df, ind_ret, ret, mc, J, t2 = False):
+def trailing_stats(stats, J, current = False):
     """
-The function Fama_MacBeth performs the Fama-MacBeth two-pass cross-sectional regression on a given dataframe df with industry returns ind_ret, asset returns ret, market capitalization mc, and number of quantiles J.
+    The statistics of the J months before every month, i.e. rows t-J to t-1, or t-J to t with `current` as JK_Ranker uses for the market cap.
 
-The first step of the Fama-MacBeth regression involves running time-series regressions for each asset, regressing the excess return of the asset against size and past return, and other interaction terms formed from the rankings of the assets within quantiles based on size and past returns. The regression coefficients are stored in the dataframe coefs.
+    Parameters:
+    stats (dict): Running sums from rolling_stats.
+    J (int): The window length.
+    current (bool): Whether month t itself is part of its window.
 
-The second step involves cross-sectional regressions at each time step, regressing the excess returns of all assets on their estimated coefficients from the time-series regressions. The regression coefficients for the interaction terms at each time step are stored in the dataframe premiums.
+    Returns:
+    dict: The window_stats of every month, each a (months x tickers) array.
+    """
+    t = np.arange(len(stats["index"]))
+    return window_stats(stats, t - J, t if current else t - 1)
 
-The final result is a dataframe Results with the average coefficient and t-statistic for each interaction term, either with or without the first month ("Farvardin") included based on the argument t2.
+def ranking_stats(ret, mc = None, ind_ret = None):
+    """
+    Builds the running sums the rankers share, once per set of panels.
 
-Parameters:
-df (DataFrame): The dataframe of all the data.
-ind_ret (Series): The series of industry returns.
-ret (DataFrame): The dataframe of asset returns.
-mc (DataFrame): The dataframe of market capitalization of each asset.
-J (int): The number of quantiles to split the assets into.
-t2 (bool): Whether or not to exclude the first month ("Farvardin"). Default is False.
+    Parameters:
+    ret (pandas DataFrame): Monthly stock returns.
+    mc (pandas DataFrame, optional): Monthly market capitalization.
+    ind_ret (pandas DataFrame, optional): Monthly industry returns.
 
-Returns:
-DataFrame: A dataframe of average coefficients and t-statistics for each interaction term.
-"""
-    labels = []
-    for i in ["JH", "JL", "MH", "ML", "FHH", "FHL"]:
-        for j in range(2, J+2):
-            labels.append(i+str(j))
-    coefs = pd.DataFrame(index = ret.columns, columns = ["size, R_t-1"] + labels + ["Intercept"])
+    Returns:
+    dict: The rolling_stats of the given panels under "ret", "mc" and "ind".
+    """
+    stats = {"ret": rolling_stats(ret)}
+    if mc is not None:
+        stats["mc"] = rolling_stats(mc)
+    if ind_ret is not None:
+        stats["ind"] = rolling_stats(ind_ret)
+    return stats
 
-    #TimeSeries Regressions
-    for ticker in ret.columns:
-        mc2 = mc[ticker].dropna().to_frame().iloc[:-1, :]
-        ret2 = ret[ticker].dropna().to_frame().loc[mc2.index, :]
-        ret_t = ret2.iloc[1:, :]
-        ret_t1 = ret2.iloc[:-1, :]
-        mc_t1 = mc2.iloc[:-1, :]
-        Xs = mc_t1.merge(ret_t1, how="left", on="Date")
-        Xs.rename(columns = {Xs.columns[0]:"size", Xs.columns[1]:"R_t-1"}, inplace = True)
-        t = ret.index.get_indexer([mc2.index[0]])[0]
-        Labels = Ranker(ticker, df, ind_ret, ret, mc, J, t)
-        for i in range(1, len(mc2.index)-1):
-            t = ret.index.get_indexer([mc2.index[i]])[0]
-            Labels = Labels.append(Ranker(ticker, df, ind_ret, ret, mc, J, t, labels))
-        Labels.index.name = "Date"
-        Xs = Xs.merge(Labels, how="left", on="Date")
-        Xs["Intercept"] = 1
-        Xs.index = range(len(Xs))
-        ret_t.index = range(len(ret_t))
-        fitted_model = sm.OLS(ret_t.astype(float), Xs.astype(float), missing="drop").fit()
-        coefs.loc[ticker, :] = fitted_model.params
-    
-    #Cross-Sectional Regressions
-    labels = ["size, R_t-1"] + labels + ["Intercept"]
-    premiums = pd.DataFrame(index = ret.index, columns = labels)
-    for t in ret.index:
-        ret2 = ret.loc[t, :].dropna(axis = 1)
-        tickers = ret2.columns
-        coef = coefs.loc[tickers, :]
-        ret2.index = range(len(ret2))
-        coef.index = range(len(coef))
-        fitted_model = sm.OLS(ret2, coef, missing="drop").fit
-        premiums.loc[t, :] = fitted_model.params
+##### Portfolio Weights #####
 
-    if t2:
-        colname = "Farvardin Excluded"
-    else:
-        colname = "Farvardin Included"
-    Results = pd.DataFrame(index = labels, columns = [colname])
-    for i in Results.index:
-        Results.loc[i, :] = str(premiums.loc[:, i].mean()) + " (" + str(premiums.loc[:, i].mean() * np.sqrt(len(premiums)) / premiums.loc[:, i].std()) + ")"
+def weight_matrix(members, mc = None, weighting = "equal", cap = 0.9):
+    """
+    Builds a (months x tickers) weight matrix from a boolean membership matrix.
 
-    return Results
+    Parameters:
+    members (numpy array): A boolean array, True where a stock is in the portfolio formed at that row.
+    mc (numpy array, optional): Market capitalization aligned with `members`, needed for "value" and "capped" weighting.
+    weighting (str): "equal", "value" or "capped" (value weights with each market cap capped at the `cap` quantile of the portfolio).
+    cap (float): The cross-sectional quantile used as the market cap ceiling of the "capped" weighting.
 
-def Fama_MacBeth_lag(df, ind_ret, ret, mc, J, lag, t2 = False):
+    Returns:
+    numpy array: A float array of the same shape as `members` whose rows sum to one (or zero for empty portfolios).
     """
-Fama_MacBeth_lag is a function that performs Fama-MacBeth regression with a specified lag period to estimate the cross-sectional average return premiums of a set of assets.
-
-Inputs:
-df (DataFrame): DataFrame containing stock information for all assets
-ind_ret (DataFrame): DataFrame containing the return of an index for all assets
-ret (DataFrame): DataFrame containing the return of all assets
-mc (DataFrame): DataFrame containing the market capitalization of all assets
-J (int): Number of portfolios to be formed
-lag (int): The specified lag period
-t2 (Boolean, optional): If t2=True, exclude the month of Farvardin from the analysis, default is False
+    members = np.asarray(members, dtype = bool)
+    if weighting == "equal":
+        weights = members.astype(float)
+    elif weighting in ("value", "capped"):
+        size = np.asarray(mc, dtype = float)
+        members = members & (size > 0)
+        weights = np.where(members, size, 0.0)
+        if weighting == "capped":
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category = RuntimeWarning)
+                ceiling = np.nanquantile(np.where(members, size, np.nan), cap, axis = 1, keepdims = True)
+            weights = np.minimum(weights, np.nan_to_num(ceiling))
+    else:
+        raise ValueError("weighting must be 'equal', 'value' or 'capped', not " + repr(weighting))
+    total = weights.sum(axis = 1, keepdims = True)
+    return np.divide(weights, total, out = np.zeros_like(weights), where = total > 0)
 
-Returns:
-Results (DataFrame): DataFrame containing the estimated average return premiums for each factor and the intercept, with the mean and t-statistics in the format of "mean (t-stat)".
-"""
-    labels = []
-    for i in ["JH", "JL", "MH", "ML", "FHH", "FHL"]:
-        for j in range(2, J+2):
-            labels.append(i+str(j))
-    coefs = pd.DataFrame(index = ret.columns, columns = ["size, R_t-1"] + labels + ["Intercept"])
+def masked_returns(ret, weights, rows, months):
+    """
+    Computes portfolio returns for many (formation row, holding month) pairs with one masked row-wise dot product.
 
-    #TimeSeries Regressions
-    for ticker in ret.columns:
-        mc2 = mc[ticker].dropna().to_frame().iloc[:-1, :]
-        ret2 = ret[ticker].dropna().to_frame().loc[mc2.index, :]
-        ret_t = ret2.iloc[1:, :]
-        ret_t1 = ret2.iloc[:-1, :]
-        mc_t1 = mc2.iloc[:-1, :]
-        Xs = mc_t1.merge(ret_t1, how="left", on="Date")
-        Xs.rename(columns = {Xs.columns[0]:"size", Xs.columns[1]:"R_t-1"}, inplace = True)
-        t = ret.index.get_indexer([mc2.index[0]])[0]
-        Labels = Ranker(ticker, df, ind_ret, ret, mc, J, t)
-        for i in range(1, len(mc2.index)-1):
-            t = ret.index.get_indexer([mc2.index[i]])[0] - lag #Effect of lag
-            Labels = Labels.append(Ranker(ticker, df, ind_ret, ret, mc, J, t, labels))
-        Labels.index.name = "Date"
-        Xs = Xs.merge(Labels, how="left", on="Date")
-        Xs["Intercept"] = 1
-        Xs.index = range(len(Xs))
-        ret_t.index = range(len(ret_t))
-        fitted_model = sm.OLS(ret_t.astype(float), Xs.astype(float), missing="drop").fit()
-        coefs.loc[ticker, :] = fitted_model.params
-    
-    #Cross-Sectional Regressions
-    labels = ["size, R_t-1"] + labels + ["Intercept"]
-    premiums = pd.DataFrame(index = ret.index, columns = labels)
-    for t in ret.index:
-        ret2 = ret.loc[t, :].dropna(axis = 1)
-        tickers = ret2.columns
-        coef = coefs.loc[tickers, :]
-        ret2.index = range(len(ret2))
-        coef.index = range(len(coef))
-        fitted_model = sm.OLS(ret2, coef, missing="drop").fit
-        premiums.loc[t, :] = fitted_model.params
+    Stocks with a missing return in the holding month are dropped and the remaining weights are rescaled, which matches `ret[members].iloc[t, :].mean()` for equal weights.
 
-    if t2:
-        colname = "Farvardin Excluded"
-    else:
-        colname = "Farvardin Included"
-    Results = pd.DataFrame(index = labels, columns = [colname])
-    for i in Results.index:
-        Results.loc[i, :] = str(premiums.loc[:, i].mean()) + " (" + str(premiums.loc[:, i].mean() * np.sqrt(len(premiums)) / premiums.loc[:, i].std()) + ")"
+    Parameters:
+    ret (numpy array): A (months x tickers) array of returns.
+    weights (numpy array): A (formations x tickers) array of portfolio weights.
+    rows (numpy array): The row of `weights` used by each pair.
+    months (numpy array): The row of `ret` used by each pair.
 
-    return Results
+    Returns:
+    numpy array: The return of every pair, NaN where no member has a return.
+    """
+    ret = np.asarray(ret, dtype = float)
+    valid = ~np.isnan(ret)
+    ret = np.where(valid, ret, 0.0)
+    chosen = weights[rows]
+    num = np.einsum("ij,ij->i", chosen, ret[months])
+    den = np.einsum("ij,ij->i", chosen, valid[months])
+    return np.divide(num, den, out = np.full(len(num), np.nan), where = den > 0)
 
-def Ranker_low(ticker, df, ind_ret, ret, mc, J, t, labels, t2 = False):
+def formation_weights(ret, members, formations, mc = None, weighting = "equal", cap = 0.9):
     """
-    This function calculates the ranking labels for a given stock (`ticker`) based on the stock's performance
-    compared to other stocks in the dataframe (`df`). The ranking is done based on the stock's year-low, as well as
-    its performance in comparison to the industry (`ind_ret`) and the market (`ret`). The ranking is performed over 
-    a certain period of time `t-j` (specified by `J`) and the resulting labels are stored in a DataFrame (`Labels`).
+    Weights the portfolios formed in the given months, using the market cap of the month before formation.
 
     Parameters:
-    ticker (str): The name of the stock for which to calculate the ranking labels.
-    df (pd.DataFrame): A DataFrame containing the stock prices for the stocks in the market.
-    ind_ret (pd.DataFrame): A DataFrame containing the returns for the industry for the given stocks.
-    ret (pd.DataFrame): A DataFrame containing the returns for the market for the given stocks.
-    mc (pd.DataFrame): A DataFrame containing the market capitalization values for the given stocks.
-    J (int): The number of periods to consider for the ranking.
-    t (int): The current time step.
-    labels (list): A list of strings that specify the names of the columns to use for the resulting labels.
-    t2 (bool, optional): A flag indicating whether to perform an additional calculation (default is False).
+    ret (pandas DataFrame): A dataframe of monthly stock returns, whose columns the memberships are aligned with.
+    members (numpy array): A (months x tickers) boolean membership matrix.
+    formations (numpy array): The formation rows to weight.
+    mc (pandas DataFrame, optional): Market capitalization, needed unless weighting is "equal".
+    weighting (str): "equal", "value" or "capped".
+    cap (float): The market cap ceiling quantile of the "capped" weighting.
 
     Returns:
-    pd.DataFrame: A DataFrame containing the resulting labels for the given stock.
+    numpy array: A (len(formations) x tickers) weight matrix.
     """
-    df = df.iloc[:, 1:].copy(deep = True)
-    df2 = d2m(year_high(df)).iloc[:-1, :]
-    quantile7 = df2.quantile(0.7, axis = 1)
-    quantile3 = df2.quantile(0.3, axis = 1)
-    Labels = pd.DataFrame(columns=labels, index=[ret.index[t]])
-    Labels.iloc[0, :] = 0
-    for j in range(2, J+2):
-        J_winners, J_losers, J_middles = JK_Ranker(ret, mc, J, t-j)
-        M_winners, M_losers, M_middles = MG_Ranker(ind_ret, ret, J, t-j)
-        FH_winners, FH_losers, FH_middles = FT_Ranker(df2, mc, quantile3, quantile7, t-j) # By changing the place of q7 & q3, the FT_Ranker will rank based on 52 week low.
-        if ticker in J_winners:
-            Labels.loc[:, "JH"+str(j)] = 1
-        elif ticker in J_losers:
-            Labels.loc[:, "JL"+str(j)] = 1
-        if ticker in M_winners:
-            Labels.loc[:, "MH"+str(j)] = 1
-        elif ticker in M_losers:
-            Labels.loc[:, "ML"+str(j)] = 1
-        if ticker in FH_winners:
-            Labels.loc[:, "FHH"+str(j)] = 1
-        elif ticker in FH_losers:
-            Labels.loc[:, "FHL"+str(j)] = 1
-    return Labels
+    size = None
+    if weighting != "equal":
+        size = mc.reindex(columns = ret.columns).to_numpy(dtype = float)
+        size = np.vstack([np.full((1, size.shape[1]), np.nan), size])[formations]
+    return weight_matrix(members[formations], size, weighting, cap)
 
-def Fama_MacBeth_low(df, ind_ret, ret, mc, J, t2 = False):
+def cohort_returns(ret, winners, losers, rows, months, mc = None, weighting = "equal", cap = 0.9):
     """
-    This function performs a Fama-MacBeth regression analysis to calculate the premiums for a set of stocks in the
-    market. The analysis is performed based on the stocks' performance compared to the industry and the market, as well 
-    as their year-low values. The function first calculates the premiums for each stock using a time-series regression, 
-    and then aggregates the results using a cross-sectional regression. The resulting premiums are stored in a DataFrame 
-    (`premiums`).
+    Sums the returns of overlapping winner and loser cohorts for every holding month.
 
     Parameters:
-    df (pd.DataFrame): A DataFrame containing the stock prices for the stocks in the market.
-    ind_ret (pd.DataFrame): A DataFrame containing the returns for the industry for the given stocks.
-    ret (pd.DataFrame): A DataFrame containing the returns for the market for the given stocks.
-    mc (pd.DataFrame): A DataFrame containing the market capitalization values for the given stocks.
-    J (int): The number of periods to consider for the ranking.
-    t2 (bool, optional): A flag indicating whether to perform an additional calculation (default is False).
+    ret (pandas DataFrame): A dataframe of monthly stock returns.
+    winners (numpy array): A (months x tickers) boolean membership matrix of the winner portfolios, one row per formation month.
+    losers (numpy array): The same for the loser portfolios.
+    rows (numpy array): A (holding months x K) array with the formation row of every cohort held in each month.
+    months (numpy array): A (holding months x K) array with the matching holding month of `ret`.
+    mc (pandas DataFrame, optional): Market capitalization, used with the month before formation for "value" and "capped" weighting.
+    weighting (str): "equal", "value" or "capped".
+    cap (float): The market cap ceiling quantile of the "capped" weighting.
 
     Returns:
-    pd.DataFrame: A DataFrame containing the resulting premiums for each stock in the market.
+    tuple: Two numpy arrays with the summed winner and loser cohort returns of each holding month.
     """
-    labels = []
-    for i in ["JH", "JL", "MH", "ML", "FHH", "FHL"]:
-        for j in range(2, J+2):
-            labels.append(i+str(j))
-    coefs = pd.DataFrame(index = ret.columns, columns = ["size, R_t-1"] + labels + ["Intercept"])
+    formations, index = np.unique(rows, return_inverse = True)
+    index = index.reshape(rows.shape)
+    w_weights = formation_weights(ret, winners, formations, mc, weighting, cap)
+    l_weights = formation_weights(ret, losers, formations, mc, weighting, cap)
+    ret = ret.to_numpy(dtype = float)
+    return cohort_sums(ret, w_weights, index, months), cohort_sums(ret, l_weights, index, months)
 
-    #TimeSeries Regressions
-    for ticker in ret.columns:
-        mc2 = mc[ticker].dropna().to_frame().iloc[:-1, :]
-        ret2 = ret[ticker].dropna().to_frame().loc[mc2.index, :]
-        ret_t = ret2.iloc[1:, :]
-        ret_t1 = ret2.iloc[:-1, :]
-        mc_t1 = mc2.iloc[:-1, :]
-        Xs = mc_t1.merge(ret_t1, how="left", on="Date")
-        Xs.rename(columns = {Xs.columns[0]:"size", Xs.columns[1]:"R_t-1"}, inplace = True)
-        t = ret.index.get_indexer([mc2.index[0]])[0]
-        Labels = Ranker_low(ticker, df, ind_ret, ret, mc, J, t)
-        for i in range(1, len(mc2.index)-1):
-            t = ret.index.get_indexer([mc2.index[i]])[0]
-            Labels = Labels.append(Ranker_low(ticker, df, ind_ret, ret, mc, J, t, labels))
-        Labels.index.name = "Date"
-        Xs = Xs.merge(Labels, how="left", on="Date")
-        Xs["Intercept"] = 1
-        Xs.index = range(len(Xs))
-        ret_t.index = range(len(ret_t))
-        fitted_model = sm.OLS(ret_t.astype(float), Xs.astype(float), missing="drop").fit()
-        coefs.loc[ticker, :] = fitted_model.params
-    
-    #Cross-Sectional Regressions
-    labels = ["size, R_t-1"] + labels + ["Intercept"]
-    premiums = pd.DataFrame(index = ret.index, columns = labels)
-    for t in ret.index:
-        ret2 = ret.loc[t, :].dropna(axis = 1)
-        tickers = ret2.columns
-        coef = coefs.loc[tickers, :]
-        ret2.index = range(len(ret2))
-        coef.index = range(len(coef))
-        fitted_model = sm.OLS(ret2, coef, missing="drop").fit
-        premiums.loc[t, :] = fitted_model.params
+def quantile_buckets(values, breakpoints = (0.3, 0.7), reference = None):
+    """
+    Sorts every row of a signal matrix into quantile buckets.
 
-    if t2:
-        colname = "Farvardin Excluded"
-    else:
-        colname = "Farvardin Included"
-    Results = pd.DataFrame(index = labels, columns = [colname])
-    for i in Results.index:
-        Results.loc[i, :] = str(premiums.loc[:, i].mean()) + " (" + str(premiums.loc[:, i].mean() * np.sqrt(len(premiums)) / premiums.loc[:, i].std()) + ")"
+    The breakpoints of all buckets are found with one np.nanquantile call, i.e. one partition of each month, instead of a quantile() call per bucket and month. Bucket 0 holds the values at or below the first breakpoint, the top bucket those at or above the last one and bucket b those strictly between breakpoints b-1 and b, so (0.3, 0.7) gives the usual losers, middles and winners. When the first and last breakpoints coincide the tied stocks go to the top bucket.
 
-    return Results
+    Parameters:
+    values (numpy array): A (months x tickers) signal matrix, NaN for stocks that are not ranked.
+    breakpoints (sequence of float): The increasing quantiles separating the buckets.
+    reference (numpy array, optional): A matrix with the same number of rows whose quantiles are used as breakpoints, e.g. all stocks when only the liquid ones are ranked. Defaults to `values`.
+
+    Returns:
+    numpy array: An int8 matrix of the shape of `values` with buckets 0 to len(breakpoints), -1 where the value is NaN.
+    """
+    values = np.asarray(values, dtype = float)
+    reference = values if reference is None else np.asarray(reference, dtype = float)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category = RuntimeWarning)
+        thresholds = np.nanquantile(reference, list(breakpoints), axis = 1).T
+    buckets = (values[:, :, None] > thresholds[:, None, :]).sum(axis = 2)
+    buckets[values >= thresholds[:, -1:]] = len(breakpoints)
+    buckets[np.isnan(values) | np.isnan(thresholds[:, -1:])] = -1
+    return buckets.astype(np.int8)
+
+def bucket_returns(ret, buckets, rows, months, index, n_buckets, spreads = None, mc = None, weighting = "equal", cap = 0.9):
+    """
+    Sums the cohort returns of every quantile bucket and of any high-minus-low combination of buckets in one run.
+
+    Parameters:
+    ret (pandas DataFrame): A dataframe of monthly stock returns.
+    buckets (numpy array): A (months x tickers) bucket matrix from quantile_buckets, one row per formation month, or a
+    (buckets x months x tickers) boolean membership array such as MG_Buckets gives when a stock can be in several buckets.
+    rows (numpy array): A (holding months x K) array with the formation row of every cohort held in each month.
+    months (numpy array): A (holding months x K) array with the matching holding month of `ret`.
+    index (pandas Index): The holding months labelling the result.
+    n_buckets (int): The number of buckets, i.e. len(breakpoints) + 1.
+    spreads (list of tuple, optional): (high, low) pairs of 1-based bucket numbers to difference; the top minus the bottom bucket is always reported as "Winner - Loser".
+    mc (pandas DataFrame, optional): Market capitalization, used with the month before formation for "value" and "capped" weighting.
+    weighting (str): "equal", "value" or "capped".
+    cap (float): The market cap ceiling quantile of the "capped" weighting.
+
+    Returns:
+    pandas DataFrame: The "Winner", "Loser" and "Winner - Loser" returns followed by the buckets "P1" (lowest) to "Pn" and the requested spreads such as "P5 - P1".
+    """
+    formations, position = np.unique(rows, return_inverse = True)
+    position = position.reshape(rows.shape)
+    values = ret.to_numpy(dtype = float)
+    portfolios = {}
+    for b in range(n_buckets):
+        weights = formation_weights(ret, buckets[b] if buckets.ndim == 3 else buckets == b, formations, mc, weighting, cap)
+        portfolios["P" + str(b+1)] = cohort_sums(values, weights, position, months)
+    top, bottom = portfolios["P" + str(n_buckets)], portfolios["P1"]
+    returns = pd.DataFrame({"Winner": top, "Loser": bottom, "Winner - Loser": top - bottom}, index = index)
+    for name, value in portfolios.items():
+        returns[name] = value
+    for high, low in spreads or []:
+        returns["P" + str(high) + " - P" + str(low)] = portfolios["P" + str(high)] - portfolios["P" + str(low)]
+    return returns
+
+def cohort_pairs(months, K, lagged = True):
+    """
+    Lists the (formation month, holding month) pairs of the K overlapping cohorts held in each month.
+
+    Parameters:
+    months (numpy array): The holding months.
+    K (int): The holding period.
+    lagged (bool): If True the cohorts are formed in months t-K-1 to t-2 (MG and FT), otherwise all K cohorts are the month t ranking (JK).
+
+    Returns:
+    tuple: Two (len(months) x K) integer arrays with the formation rows and the holding months.
+    """
+    months = np.asarray(months)
+    holding = np.repeat(months[:, None], K, axis = 1)
+    if lagged:
+        return months[:, None] + np.arange(-K-1, -1), holding
+    return holding.copy(), holding
+
+def far_filter(returns, ret, far):
+    """
+    Zeroes the monthly strategy returns outside Farvardin when `far` is set, as the strategies always have.
+
+    Parameters:
+    returns (pandas DataFrame): Monthly strategy returns indexed by holding month.
+    ret (pandas DataFrame): The stock returns the strategy was run on.
+    far (bool): Whether only Farvardin months should be kept.
+
+    Returns:
+    pandas DataFrame: The filtered monthly returns.
+    """
+    if far:
+        returns.loc[~returns.index.isin(Farvardin(ret)[0].index), :] = 0.0
+    return returns
+
+##### JK Strategy #####
+
+def JK_Ranker(ret, mc, J, t, stats = None):
+    """
+Rank stocks based on their returns and market capitalization.
+
+The function takes in stock returns and market capitalization data and uses them to rank the stocks. The ranking is done by grouping stocks into three categories: winners, losers, and middles.
+
+The ranking is based on the average return of the stocks over the last J periods and the average market capitalization over the same period. The ranking is done on the most liquid stocks which are defined as those with a market capitalization greater than or equal to the 10th percentile of all market capitalizations in the same period.
+
+Inputs:
+ret: pandas DataFrame
+A dataframe of returns for each stock, with time as the index.
+mc: pandas DataFrame
+A dataframe of market capitalization for each stock, with time as the index.
+J: int
+The number of periods over which to compute the average returns and market capitalization.
+t: int
+The current time period.
+stats: dict, optional
+The running sums of ret and mc from ranking_stats, which the J-period means are read from; built from the panels when omitted, so pass them when ranking many months.
+
+Returns:
+winners: list of strings
+A list of stocks that have the highest average return among the most liquid stocks over the last J periods.
+losers: list of strings
+A list of stocks that have the lowest average return among the most liquid stocks over the last J periods.
+middles: list of strings
+A list of stocks that have an average return that falls in between the highest and lowest returns among the most liquid stocks over the last J periods.
+"""
+    if stats is None:
+        stats = ranking_stats(ret, mc)
+    size = window_stats(stats["mc"], t-J, t)
+    liquid = size["complete"] & (size["mean"] >= np.quantile(size["mean"][size["complete"]], 0.1)) if size["complete"].any() else size["complete"]
+    past = window_stats(stats["ret"], t-J, t-1)
+    ranked = past["complete"] & ret.columns.isin(mc.columns[liquid])
+    values = past["mean"][ranked]
+    winners = losers = ret.columns[ranked]
+    if len(values):
+        winners = winners[values >= np.quantile(values, 0.7)]
+        losers = losers[values <= np.quantile(values, 0.3)]
+    middles = [stock for stock in mc.columns[liquid] if (stock not in winners) and (stock not in losers)]
+    return winners, losers, middles
+
+def JK_Signals(ret, mc, J, rows, liquidity = 0.1):
+    """
+    Computes the ranking signal of the JK strategy, the J-month mean return of the liquid stocks.
+
+    The signals are those of JK_Ranker, read for all formation months at once from the running sums of rolling_stats.
+
+    Parameters:
+    ret (pandas DataFrame): A dataframe with stock returns.
+    mc (pandas DataFrame): A dataframe with market capitalization for each stock.
+    J (int): A lookback period for ranking the stocks.
+    rows (iterable of int): The formation months to rank.
+    liquidity (float): The market cap quantile below which stocks are left out.
+
+    Returns:
+    numpy array: A (months x tickers) float matrix, NaN for stocks that are not ranked in a month.
+    """
+    signal = np.full(ret.shape, np.nan)
+    rows = np.asarray(list(rows), dtype = int)
+    if len(rows) == 0:
+        return signal
+    stats = ranking_stats(ret, mc)
+    size = window_stats(stats["mc"], rows - J, rows)
+    liquid = quantile_buckets(np.where(size["complete"], size["mean"], np.nan), (liquidity,)) == 1
+    to_ret = ret.columns.get_indexer(mc.columns)
+    liquid_ret = np.zeros((len(rows), len(ret.columns)), dtype = bool)
+    liquid_ret[:, to_ret[to_ret >= 0]] = liquid[:, to_ret >= 0]
+    past = window_stats(stats["ret"], rows - J, rows - 1)
+    signal[rows] = np.where(liquid_ret & past["complete"], past["mean"], np.nan)
+    return signal
+
+def JK_Buckets(ret, mc, J, rows, breakpoints = (0.3, 0.7), liquidity = 0.1):
+    """
+    Sorts the liquid stocks of every formation month into quantile buckets of their J-month mean return.
+
+    Parameters:
+    ret (pandas DataFrame): A dataframe with stock returns.
+    mc (pandas DataFrame): A dataframe with market capitalization for each stock.
+    J (int): A lookback period for ranking the stocks.
+    rows (iterable of int): The formation months to rank.
+    breakpoints (sequence of float): The quantiles separating the buckets.
+    liquidity (float): The market cap quantile below which stocks are left out.
+
+    Returns:
+    numpy array: A (months x tickers) int8 bucket matrix, -1 for stocks that are not ranked.
+    """
+    return quantile_buckets(JK_Signals(ret, mc, J, rows, liquidity), breakpoints)
+
+def JK_Members(ret, mc, J, rows):
+    """
+    Builds the winner and loser membership matrices of the JK strategy.
+
+    Parameters:
+    ret (pandas DataFrame): A dataframe with stock returns.
+    mc (pandas DataFrame): A dataframe with market capitalization for each stock.
+    J (int): A lookback period for ranking the stocks.
+    rows (iterable of int): The formation months to rank.
+
+    Returns:
+    tuple: Two boolean numpy arrays of shape (months x tickers) marking winners and losers at each formation month.
+    """
+    buckets = JK_Buckets(ret, mc, J, rows)
+    return buckets == 2, buckets == 0
+
+def JK_Returns(ret, mc, J, K, far = False, weighting = "equal", cap = 0.9, breakpoints = (0.3, 0.7), spreads = None, sink = None):
+    """
+    Calculates the monthly winner, loser and winner - loser returns of the JK strategy.
+
+    Parameters:
+    ret (pandas DataFrame): A dataframe with stock returns.
+    mc (pandas DataFrame): A dataframe with market capitalization for each stock.
+    J (int): A lookback period for ranking the stocks.
+    K (int): A holding period for the strategy.
+    far (bool): Whether only Farvardin returns should be kept.
+    weighting (str): Portfolio weighting, "equal", "value" or "capped".
+    cap (float): The market cap ceiling quantile of the "capped" weighting.
+    breakpoints (sequence of float): The quantiles separating the buckets; the top bucket is the winner and the bottom one the loser portfolio.
+    spreads (list of tuple, optional): Extra (high, low) pairs of 1-based buckets to difference.
+    sink (ResultSink, optional): Where to also write the monthly returns and bucket memberships.
+
+    Returns:
+    pandas DataFrame: The monthly "Winner", "Loser" and "Winner - Loser" returns, the returns of every bucket and the requested spreads, indexed by holding month.
+    """
+    months = np.arange(2 * J+1, len(ret))
+    rows, holding = cohort_pairs(months, K, lagged = False)
+    buckets = JK_Buckets(ret, mc, J, months, breakpoints)
+    returns = bucket_returns(ret, buckets, rows, holding, ret.index[months], len(breakpoints) + 1, spreads, mc, weighting, cap)
+    returns = far_filter(returns, ret, far)
+    if sink is not None:
+        sink.strategy(_result_name("JK", J, K, far, weighting), returns, buckets, ret.index, ret.columns, _result_settings(breakpoints, spreads, cap))
+    return returns
+
+def JK_Strategy(ret, mc, J, K, far = False, weighting = "equal", cap = 0.9, sink = None):
+    """
+    JK_Strategy calculates the average returns for winners, losers, and the difference between winners and losers
+    based on Jegadeesh and Titman (1993) momentum strategy. 
+
+    Parameters
+    ----------
+    ret : pd.DataFrame
+        A dataframe with stock returns.
+    mc : pd.DataFrame
+        A dataframe with market capitalization for each stock.
+    J : int
+        A lookback period for ranking the stocks.
+    K : int
+        A holding period for the strategy.
+    far : bool, optional
+        A flag to indicate whether Farvardin (1991) correction should be applied, by default False.
+    weighting : str, optional
+        Portfolio weighting, "equal", "value" or "capped", by default "equal".
+    cap : float, optional
+        The market cap ceiling quantile of the "capped" weighting, by default 0.9.
+    sink : ResultSink, optional
+        Where to also write the monthly returns and memberships, by default None.
+
+    Returns
+    -------
+    pd.DataFrame
+        A dataframe with average returns for winners, losers, and the difference between winners and losers.
+    """
+    returns = JK_Returns(ret, mc, J, K, far, weighting, cap, sink = sink)
+    w_rets = returns["Winner"].to_numpy()
+    l_rets = returns["Loser"].to_numpy()
+    wl_rets = returns["Winner - Loser"].to_numpy()
+    Strategy = pd.DataFrame(index = ["JT's individual stock momentum"])
+    Strategy["Winner"] = str(round(np.mean(w_rets) * 100, 2)) + "%"
+    Strategy["Loser"] = str(round(np.mean(l_rets) * 100, 2)) + "%"
+    Strategy["Winner - Loser"] = str(round(np.mean(wl_rets) * 100, 2)) + "%  (" + str(round(np.mean(wl_rets) * np.sqrt(len(wl_rets)) / np.std(wl_rets), 2)) + ")"
+    Strategy.index.name = "Strategy"
+    return Strategy
+
+##### MG Strategy #####
+
+def MG_Ranker(ind_ret, stocks_ret, J, t, sector_ids = None, stats = None):
+    """
+MG_Ranker(ind_ret, stocks_ret, J, t)
+
+Rank stocks into winners, losers, and middles based on their respective industry's mean return over the past J period.
+
+Parameters:
+ind_ret (pd.DataFrame): dataframe of industry returns
+stocks_ret (pd.DataFrame): dataframe of stocks returns
+J (int): number of periods used for ranking
+t (int): current time step
+sector_ids (tuple, optional): the integer ids of the columns of stocks_ret and the encoded sectors, from sector_codes; built from the sectors of the current market when omitted
+stats (dict, optional): the running sums of ind_ret ("ind") from ranking_stats; built from ind_ret when omitted, so pass them when ranking many months
+
+Returns:
+winners (list): list of winners' stocks
+losers (list): list of losers' stocks
+middles (list): list of stocks that are neither winners nor losers
+"""
+    if sector_ids is None:
+        sector_ids = sector_codes(stocks_ret.columns, current_market().sectors)
+    column_ids, sectors = sector_ids
+    if stats is None:
+        stats = {"ind": rolling_stats(ind_ret)}
+    window = window_stats(stats["ind"], t-J, t-1)
+    j_period_return = pd.DataFrame({0: window["mean"]}, index = ind_ret.columns)[window["count"] > 0]
+    winner_industries = j_period_return[j_period_return[0] >= j_period_return.quantile(0.7)[0]].index.tolist()
+    loser_industries = j_period_return[j_period_return[0] <= j_period_return.quantile(0.3)[0]].index.tolist()
+    empty = np.zeros(0, dtype = np.int32)
+    is_winner = np.isin(column_ids, np.concatenate([empty] + [sectors[i] for i in winner_industries]))
+    is_loser = np.isin(column_ids, np.concatenate([empty] + [sectors[i] for i in loser_industries]))
+    winners = stocks_ret.columns[is_winner].tolist()
+    losers = stocks_ret.columns[is_loser].tolist()
+    middles = stocks_ret.columns[~is_winner & ~is_loser].tolist()
+    return winners, losers, middles
+
+def sector_codes(columns, sectors):
+    """
+    Encodes the tickers of a returns dataframe and the stock lists of the sectors with one shared vocabulary.
+
+    Parameters:
+    columns (pandas Index): The tickers of the returns dataframe.
+    sectors (dict): Sector names mapped to lists of tickers, e.g. Sectors_stocks.
+
+    Returns:
+    tuple: The int32 ids of `columns` and the sectors mapped to the int32 ids of their stocks.
+    """
+    vocabulary = ticker_vocabulary(columns, *sectors.values())
+    return encode_tickers(vocabulary, columns), encode_sectors(vocabulary, sectors)
+
+def MG_Buckets(ind_ret, ret, J, rows, breakpoints = (0.3, 0.7)):
+    """
+    Sorts the industries into quantile buckets of their J-month mean return and puts every stock in the buckets of its industries.
+
+    As in MG_Ranker, a stock listed in several sectors belongs to the bucket of each of them, so it can be in both the winner and the loser portfolio.
+
+    Parameters:
+    ind_ret (pandas DataFrame): DataFrame containing industry returns.
+    ret (pandas DataFrame): DataFrame containing asset returns.
+    J (int): Number of lookback periods used to rank the industries.
+    rows (iterable of int): The formation months to rank.
+    breakpoints (sequence of float): The quantiles separating the buckets.
+
+    Returns:
+    numpy array: A (buckets x months x tickers) boolean membership array, the lowest bucket first.
+    """
+    signal = np.full(ind_ret.shape, np.nan)
+    rows = np.asarray(list(rows), dtype = int)
+    if len(rows):
+        signal[rows] = window_stats(rolling_stats(ind_ret), rows - J, rows - 1)["mean"]
+    column_ids, sectors = sector_codes(ret.columns, current_market().sectors)
+    empty = np.zeros(0, dtype = np.int32)
+    listed = np.array([np.isin(column_ids, sectors.get(name, empty)) for name in ind_ret.columns]).reshape(len(ind_ret.columns), len(ret.columns))
+    industry_buckets = quantile_buckets(signal, breakpoints)
+    return np.array([((industry_buckets == b).astype(np.int32) @ listed) > 0 for b in range(len(breakpoints) + 1)])
+
+def MG_Members(ind_ret, ret, J, rows):
+    """
+    Builds the winner and loser membership matrices of the MG strategy.
+
+    Parameters:
+    ind_ret (pandas DataFrame): DataFrame containing industry returns.
+    ret (pandas DataFrame): DataFrame containing asset returns.
+    J (int): Number of lookback periods used to rank the industries.
+    rows (iterable of int): The formation months to rank.
+
+    Returns:
+    tuple: Two boolean numpy arrays of shape (months x tickers) marking winners and losers at each formation month.
+    """
+    buckets = MG_Buckets(ind_ret, ret, J, rows)
+    return buckets[-1], buckets[0]
+
+def MG_Returns(ind_ret, ret, J, K, far = False, mc = None, weighting = "equal", cap = 0.9, breakpoints = (0.3, 0.7), spreads = None, sink = None):
+    """
+Calculates the monthly winner, loser and winner - loser returns of the MG strategy.
+
+Parameters:
+ind_ret (pandas DataFrame): DataFrame containing industry returns.
+ret (pandas DataFrame): DataFrame containing asset returns.
+J (int): Number of lookback periods used to rank the industries.
+K (int): Number of holding periods.
+far (bool): Whether only Farvardin returns should be kept.
+mc (pandas DataFrame, optional): DataFrame containing market capitalization, required unless weighting is "equal".
+weighting (str): Portfolio weighting, "equal", "value" or "capped".
+cap (float): The market cap ceiling quantile of the "capped" weighting.
+breakpoints (sequence of float): The quantiles separating the industry buckets; the top bucket is the winner and the bottom one the loser portfolio.
+spreads (list of tuple, optional): Extra (high, low) pairs of 1-based buckets to difference.
+sink (ResultSink, optional): Where to also write the monthly returns and bucket memberships.
+
+Returns:
+returns (pandas DataFrame): The monthly "Winner", "Loser" and "Winner - Loser" returns, the returns of every bucket and the requested spreads, indexed by holding month.
+"""
+    months = np.arange(2*J+1, len(ret))
+    rows, holding = cohort_pairs(months, K)
+    buckets = MG_Buckets(ind_ret, ret, J, np.unique(rows), breakpoints)
+    returns = bucket_returns(ret, buckets, rows, holding, ret.index[months], len(breakpoints) + 1, spreads, mc, weighting, cap)
+    returns = far_filter(returns, ret, far)
+    if sink is not None:
+        sink.strategy(_result_name("MG", J, K, far, weighting), returns, buckets, ret.index, ret.columns, _result_settings(breakpoints, spreads, cap, ind_ret.columns))
+    return returns
+
+def MG_Strategy(ind_ret, ret, J, K, far = False, mc = None, weighting = "equal", cap = 0.9, sink = None):
+    """
+This function implements the Momentum-Growth (MG) investment strategy by ranking industries based on their past returns and forming portfolios of winners and losers.
+
+Parameters:
+ind_ret (pandas DataFrame): DataFrame containing industry returns.
+ret (pandas DataFrame): DataFrame containing asset returns.
+J (int): Number of lookback periods used to rank the industries.
+K (int): Number of holding periods.
+far (bool): Whether to use Farvardin adjustment.
+mc (pandas DataFrame, optional): DataFrame containing market capitalization, required unless weighting is "equal".
+weighting (str): Portfolio weighting, "equal", "value" or "capped".
+cap (float): The market cap ceiling quantile of the "capped" weighting.
+sink (ResultSink, optional): Where to also write the monthly returns and memberships.
+
+Returns:
+Strategy (pandas DataFrame): DataFrame containing the average return for the winner and loser portfolios, and the difference between the two portfolios.
+
+"""
+    returns = MG_Returns(ind_ret, ret, J, K, far, mc, weighting, cap, sink = sink)
+    w_rets = returns["Winner"].to_numpy()
+    l_rets = returns["Loser"].to_numpy()
+    wl_rets = returns["Winner - Loser"].to_numpy()
+    Strategy = pd.DataFrame(index = ["MG's industrial momentum"])
+    Strategy["Winner"] = str(round(np.mean(w_rets) * 100, 2)) + "%"
+    Strategy["Loser"] = str(round(np.mean(l_rets) * 100, 2)) + "%"
+    Strategy["Winner - Loser"] = str(round(np.mean(wl_rets) * 100, 2)) + "%  (" + str(round(np.mean(wl_rets) * np.sqrt(len(wl_rets)) / np.std(wl_rets), 2)) + ")"
+    Strategy.index.name = "Strategy"
+    return Strategy
+
+##### Industry Returns #####
+
+def sector_matrix(columns, sectors = None):
+    """
+    Builds the sparse sector x ticker membership matrix of a returns dataframe.
+
+    Parameters:
+    columns (pandas Index): The tickers of the returns dataframe.
+    sectors (dict, optional): Sector names mapped to lists of tickers, by default those of the current market; any membership snapshot can be passed.
+
+    Returns:
+    tuple: A scipy.sparse CSR matrix with a one where a ticker belongs to a sector, and the list of sector names of its rows.
+    """
+    if sectors is None:
+        sectors = current_market().sectors
+    column_ids, encoded = sector_codes(columns, sectors)
+    rows, cols = [], []
+    for row, name in enumerate(sectors):
+        positions = np.flatnonzero(np.isin(column_ids, encoded[name]))
+        rows.append(np.full(len(positions), row))
+        cols.append(positions)
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype = int)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype = int)
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape = (len(sectors), len(columns)))
+    return matrix, list(sectors)
+
+def industry_returns(ret, mc = None, sectors = None, weighting = "equal"):
+    """
+    Calculates the monthly industry returns from the returns of the stocks each sector actually holds.
+
+    All sectors and months come out of one sparse sector x ticker product with the return matrix, and one with the valid
+    (or market cap weighted) mask, so the MG rankings stay consistent with the constituents of Sectors_stocks.
+
+    Parameters:
+    ret (pandas DataFrame): Monthly stock returns, e.g. returns_M.
+    mc (pandas DataFrame, optional): Monthly market capitalization, e.g. Market_Cap_M, needed for "value" weighting. The market cap at the start of each month weights that month's return.
+    sectors (dict, optional): Sector names mapped to lists of tickers, by default those of the current market.
+    weighting (str): "equal" or "value".
+
+    Returns:
+    pandas DataFrame: The (months x sectors) industry returns, NaN where a sector has no stock with a return.
+    """
+    matrix, names = sector_matrix(ret.columns, sectors)
+    values = ret.to_numpy(dtype = float)
+    valid = ~np.isnan(values)
+    if weighting == "equal":
+        weights = valid.astype(float)
+    elif weighting == "value":
+        size = mc.reindex(index = ret.index, columns = ret.columns).to_numpy(dtype = float)
+        weights = np.where(valid & (size > 0), size, 0.0)
+    else:
+        raise ValueError("weighting must be 'equal' or 'value', not " + repr(weighting))
+    num = (matrix @ (weights * np.where(valid, values, 0.0)).T).T
+    den = (matrix @ weights.T).T
+    returns = np.divide(num, den, out = np.full(num.shape, np.nan), where = den > 0)
+    return pd.DataFrame(returns, index = ret.index, columns = names)
+
+##### FT Strategy #####
+
+def year_high(df):
+    """
+    Calculates the year-high of each stock in the input dataframe, `df`, and returns a dataframe containing the year-high of each stock.
+    
+    Parameters:
+    df (pandas dataframe): A dataframe containing stock data.
+    
+    Returns:
+    pandas dataframe: A dataframe containing the year-high of each stock.
+    """
+    first_index = df.index[0]
+    start_index = len(df.loc[:shift_years(first_index, 1), :]) - 1
+    result = df.iloc[start_index:, :].copy(deep = True)
+    starts = df.index.searchsorted([shift_years(date, -1) for date in result.index])
+    values = df.to_numpy(dtype = float)
+    max_of_year = rolling_max(values, np.concatenate([np.zeros(start_index, dtype = int), starts]))[start_index:]
+    result.loc[:, :] = values[start_index:] / max_of_year
+    return result
+
+def monthly_high(df):
+    """
+    Calculates the monthly year-high ratios the FT rankings use.
+
+    Parameters:
+    df (pandas dataframe): Daily prices whose first column is the market index.
+
+    Returns:
+    pandas dataframe: The year-high ratio of each stock at the start of every month but the last.
+    """
+    df = df.iloc[:, 1:].copy(deep = True)
+    return d2m(year_high(df)).iloc[:-1, :]
+
+def FT_Ranker(df2, mc, quantile7, quantile3, i):
+    """
+    Ranks the stocks in `df2` based on their year-highs and returns the winners, losers, and middles (stocks that are not winners or losers) as three separate lists.
+    
+    Parameters:
+    df2 (pandas dataframe): A dataframe containing the year-highs of the stocks.
+    mc (pandas dataframe): A dataframe containing the market capitalization of the stocks.
+    quantile7 (pandas series): A series containing the 70th percentile of the year-highs of the stocks.
+    quantile3 (pandas series): A series containing the 30th percentile of the year-highs of the stocks.
+    i (int): An integer representing the current time step.
+    
+    Returns:
+    tuple: A tuple containing three lists, each containing the names of the winners, losers, and middles, respectively.
+    """
+    mc2 = mc.iloc[i-1:i, :]
+    mc2 = mc2.dropna(axis = 1)
+    q1 = mc2.quantile(0.1, axis = 1)
+    mc2 = mc2.mean()
+    liquids = mc2[mc2 >= q1[q1.index[0]]].index
+    df3 = df2.iloc[i-1:i, :].loc[:, liquids]
+    q7 = quantile7.loc[df2.index[i-1]]
+    q3 = quantile3.loc[df2.index[i-1]]
+    winners = df3.iloc[0, (df3 >= q7).values[0]].index
+    losers = df3.iloc[0, (df3 <= q3).values[0]].index
+    middles = [stock for stock in liquids if (stock not in winners) and (stock not in losers)]
+    return winners, losers, middles
+
+def FT_Signals(df2, mc, rows, columns, liquidity = 0.1, ragged = None):
+    """
+    Collects the year-high ratios of the month before formation for the liquid stocks, the ranking signal of FT_Ranker.
+
+    The liquidity filter is read from a ragged market cap panel, e.g. "mc_ragged" of the pipeline inputs; it is built from `mc` when not given.
+
+    Parameters:
+    df2 (pandas dataframe): A dataframe containing the monthly year-high ratios of the stocks.
+    mc (pandas dataframe): A dataframe containing the market capitalization of the stocks.
+    rows (iterable of int): The formation months to rank.
+    columns (pandas Index): The tickers of the returns dataframe the signals are aligned with.
+    liquidity (float): The market cap quantile below which stocks are left out.
+    ragged (dict, optional): The ragged panel of `mc`, from to_ragged.
+
+    Returns:
+    numpy array: A (len(df2) x len(columns)) float matrix, NaN for stocks that are not ranked in a month.
+    """
+    signal = np.full((len(df2), len(columns)), np.nan)
+    mc_r = to_ragged(mc) if ragged is None else ragged
+    high = df2.reindex(columns = mc.columns).to_numpy(dtype = float)
+    to_columns = columns.get_indexer(mc.columns)
+    for i in rows:
+        if i < 1:
+            continue
+        tickers, size = cross_section(mc_r, i-1)
+        if len(tickers) == 0:
+            continue
+        liquids = tickers[size >= np.quantile(size, liquidity)]
+        liquids = liquids[to_columns[liquids] >= 0]
+        signal[i, to_columns[liquids]] = high[i-1, liquids]
+    return signal
+
+def FT_Buckets(df2, mc, rows, columns, breakpoints = (0.3, 0.7), liquidity = 0.1, ragged = None):
+    """
+    Sorts the liquid stocks of every formation month into buckets of their year-high ratio.
+
+    As in FT_Strategy the breakpoints are the quantiles of all stocks in the month before formation, not only of the liquid ones.
+
+    Parameters:
+    df2 (pandas dataframe): A dataframe containing the monthly year-high ratios of the stocks.
+    mc (pandas dataframe): A dataframe containing the market capitalization of the stocks.
+    rows (iterable of int): The formation months to rank.
+    columns (pandas Index): The tickers of the returns dataframe the buckets are aligned with.
+    breakpoints (sequence of float): The quantiles separating the buckets.
+    liquidity (float): The market cap quantile below which stocks are left out.
+    ragged (dict, optional): The ragged panel of `mc`, from to_ragged.
+
+    Returns:
+    numpy array: A (len(df2) x len(columns)) int8 bucket matrix, -1 for stocks that are not ranked.
+    """
+    high = df2.to_numpy(dtype = float)
+    reference = np.vstack([np.full((1, high.shape[1]), np.nan), high[:-1]])
+    return quantile_buckets(FT_Signals(df2, mc, rows, columns, liquidity, ragged), breakpoints, reference)
+
+def FT_Members(df2, mc, quantile7, quantile3, rows, columns, ragged = None):
+    """
+    Builds the winner and loser membership matrices of the 52-week high strategy.
+
+    Parameters:
+    df2 (pandas dataframe): A dataframe containing the monthly year-high ratios of the stocks.
+    mc (pandas dataframe): A dataframe containing the market capitalization of the stocks.
+    quantile7 (pandas series): A series containing the 70th percentile of the year-highs of the stocks.
+    quantile3 (pandas series): A series containing the 30th percentile of the year-highs of the stocks.
+    rows (iterable of int): The formation months to rank.
+    columns (pandas Index): The tickers of the returns dataframe the memberships are aligned with.
+    ragged (dict, optional): The ragged panel of `mc`, from to_ragged.
+
+    Returns:
+    tuple: Two boolean numpy arrays of shape (len(df2) x len(columns)) marking winners and losers at each formation month.
+    """
+    signal = FT_Signals(df2, mc, rows, columns, ragged = ragged)
+    q7 = np.concatenate([[np.nan], quantile7.to_numpy(dtype = float)[:-1]])[:, None]
+    q3 = np.concatenate([[np.nan], quantile3.to_numpy(dtype = float)[:-1]])[:, None]
+    return signal >= q7, signal <= q3
+
+def FT_Returns(df, ret, mc, J, K, t2 = False, far = False, weighting = "equal", cap = 0.9, high = None, breakpoints = (0.3, 0.7), spreads = None, sink = None, ragged = None):
+    """
+    Calculates the monthly winner, loser and winner - loser returns of the 52-week high strategy.
+    
+    Parameters:
+    df (pandas dataframe): A dataframe containing stock data.
+    ret (pandas dataframe): A dataframe containing the returns of the stocks.
+    mc (pandas dataframe): A dataframe containing the market capitalization of the stocks.
+    J (int): An integer representing the length of the moving average used in the strategy.
+    K (int): An integer representing the number of previous time steps used in the strategy.
+    t2 (bool): A boolean indicating whether or not to use the T2 version of the strategy.
+    far (bool): A boolean indicating whether or not to use the Farvardin version of the strategy.
+    weighting (str): Portfolio weighting, "equal", "value" or "capped".
+    cap (float): The market cap ceiling quantile of the "capped" weighting.
+    high (pandas dataframe, optional): The precomputed monthly year-high ratios, e.g. "high_M" of chunked_panels; `df` is not used when it is given.
+    breakpoints (sequence of float): The quantiles separating the buckets; the top bucket is the winner and the bottom one the loser portfolio.
+    spreads (list of tuple, optional): Extra (high, low) pairs of 1-based buckets to difference.
+    sink (ResultSink, optional): Where to also write the monthly returns and bucket memberships.
+    ragged (dict, optional): The ragged panel of `mc`, e.g. "mc_ragged" of the pipeline inputs.
+    
+    Returns:
+    pandas dataframe: The monthly "Winner", "Loser" and "Winner - Loser" returns, the returns of every bucket and the requested spreads, indexed by holding month.
+    """
+    if high is None:
+        high = monthly_high(df)
+    df2 = high
+    if t2:
+        if far:
+            df2 = Farvardin(df2)[0]
+        else:
+            df2 = Farvardin(df2)[1]
+    
+    months = np.arange(2*J+1, len(df2))
+    rows, holding = cohort_pairs(months, K)
+    buckets = FT_Buckets(df2, mc, np.unique(rows), ret.columns, breakpoints, ragged = ragged)
+    returns = bucket_returns(ret, buckets, rows, holding, ret.index[months], len(breakpoints) + 1, spreads, mc, weighting, cap)
+    returns = far_filter(returns, ret, far)
+    if sink is not None:
+        sink.strategy(_result_name("FT", J, K, far, weighting) + ("_t2" if t2 else ""), returns, buckets, df2.index, ret.columns, _result_settings(breakpoints, spreads, cap))
+    return returns
+
+def FT_Strategy(df, ret, mc, J, K, t2 = False, far = False, weighting = "equal", cap = 0.9, high = None, sink = None, ragged = None):
+    """
+    Implements a strategy based on ranking stocks based on their year-highs and returns a dataframe containing the performance of the strategy.
+    
+    Parameters:
+    df (pandas dataframe): A dataframe containing stock data.
+    ret (pandas dataframe): A dataframe containing the returns of the stocks.
+    mc (pandas dataframe): A dataframe containing the market capitalization of the stocks.
+    J (int): An integer representing the length of the moving average used in the strategy.
+    K (int): An integer representing the number of previous time steps used in the strategy.
+    t2 (bool): A boolean indicating whether or not to use the T2 version of the strategy.
+    far (bool): A boolean indicating whether or not to use the Farvardin version of the strategy.
+    weighting (str): Portfolio weighting, "equal", "value" or "capped".
+    cap (float): The market cap ceiling quantile of the "capped" weighting.
+    high (pandas dataframe, optional): The precomputed monthly year-high ratios; `df` is not used when it is given.
+    sink (ResultSink, optional): Where to also write the monthly returns and memberships.
+    ragged (dict, optional): The ragged panel of `mc`, e.g. "mc_ragged" of the pipeline inputs.
+    
+    Returns:
+    pandas dataframe: A dataframe containing the performance of the strategy.
+    """
+    returns = FT_Returns(df, ret, mc, J, K, t2, far, weighting, cap, high, sink = sink, ragged = ragged)
+    w_rets = returns["Winner"].to_numpy()
+    l_rets = returns["Loser"].to_numpy()
+    wl_rets = returns["Winner - Loser"].to_numpy()
+    Strategy = pd.DataFrame(index = ["52-week high"])
+    Strategy["Winner"] = str(round(np.mean(w_rets) * 100, 2)) + "%"
+    Strategy["Loser"] = str(round(np.mean(l_rets) * 100, 2)) + "%"
+    Strategy["Winner - Loser"] = str(round(np.mean(wl_rets) * 100, 2)) + "%  (" + str(round(np.mean(wl_rets) * np.sqrt(len(wl_rets)) / np.std(wl_rets), 2)) + ")"
+    Strategy.index.name = "Strategy"
+    return Strategy
+
+##### Double Sorts #####
+
+double_sort_names = {"JT": "Jegadeesh & Titman’s", "MG": "Moskowitz and Grinblatt’s", "FT": "52-Week High"}
+
+def _sort_members(sort, ret, mc, J, rows, ind_ret = None, high = None, breakpoints = (0.3, 0.7), within = None, ragged = None):
+    """
+    The (buckets x months x tickers) memberships of one ranking at the formation rows, sorted within the stocks of `within` when it is given.
+
+    The JT and FT signals are re-sorted on the breakpoints of the group, as their strategies are when run on the stocks of the group alone;
+    the MG buckets rank the industries, so the group keeps its stocks in the industry buckets of all industries.
+    """
+    if sort == "MG":
+        members = MG_Buckets(ind_ret, ret, J, rows, breakpoints)
+        return members if within is None else members & within
+    if sort == "JT":
+        signal, reference = JK_Signals(ret, mc, J, rows), None
+    elif sort == "FT":
+        signal = FT_Signals(high, mc, rows, ret.columns, ragged = ragged)
+        values = high.reindex(columns = ret.columns).to_numpy(dtype = float)
+        reference = np.vstack([np.full((1, values.shape[1]), np.nan), values[:-1]])
+    else:
+        raise ValueError("sort must be 'JT', 'MG' or 'FT', not " + repr(sort))
+    if within is not None:
+        signal = np.where(within, signal, np.nan)
+        reference = None if reference is None else np.where(within, reference, np.nan)
+    buckets = quantile_buckets(signal, breakpoints, reference)
+    return np.array([buckets == b for b in range(len(breakpoints) + 1)])
+
+def double_sort_returns(first, second, ret, mc, J, K, ind_ret = None, high = None, breakpoints = (0.3, 0.7), weighting = "equal", cap = 0.9):
+    """
+    Calculates the monthly returns of a conditional double sort: every formation month the stocks are sorted on the `first` ranking and,
+    within each of its groups, on the `second` one. Month t holds the K cells formed in months t-K-1 to t-2, as the MG and FT strategies do.
+
+    Parameters:
+    first (str): The first ranking, "JT", "MG" or "FT".
+    second (str): The ranking within each group of the first, "JT", "MG" or "FT".
+    ret (pandas DataFrame): The monthly stock returns.
+    mc (pandas DataFrame): The monthly market capitalization.
+    J (int): The ranking period of both sorts.
+    K (int): The holding period.
+    ind_ret (pandas DataFrame, optional): The monthly industry returns, needed by "MG".
+    high (pandas DataFrame, optional): The monthly year-high ratios from monthly_high, needed by "FT"; aligned with `ret` by date.
+    breakpoints (sequence of float): The quantiles separating the buckets of both sorts.
+    weighting (str): Portfolio weighting, "equal", "value" or "capped".
+    cap (float): The market cap ceiling quantile of the "capped" weighting.
+
+    Returns:
+    pandas DataFrame: The monthly "Winner", "Loser" and "Winner - Loser" returns of the second sort within every group of the first, with
+    (group, portfolio) columns and the groups from the top ("Winner") to the bottom ("Loser") bucket.
+    """
+    if high is not None:
+        high = high.reindex(index = ret.index)
+    if ind_ret is not None:
+        ind_ret = ind_ret.reindex(index = ret.index)
+    months = np.arange(2*J+1, len(ret))
+    rows, holding = cohort_pairs(months, K)
+    formations = np.unique(rows)
+    ragged = to_ragged(mc) if "FT" in (first, second) else None
+    groups = _sort_members(first, ret, mc, J, formations, ind_ret, high, breakpoints, ragged = ragged)
+    cells = np.concatenate([_sort_members(second, ret, mc, J, formations, ind_ret, high, breakpoints, group, ragged) for group in groups])
+    returns = bucket_returns(ret, cells, rows, holding, ret.index[months], len(cells), mc = mc, weighting = weighting, cap = cap)
+    n = len(breakpoints) + 1
+    names = ["Loser"] + ["Middle" + (" " + str(b) if n > 3 else "") for b in range(1, n-1)] + ["Winner"]
+    Returns = {}
+    for g in reversed(range(n)):
+        top, bottom = returns["P" + str(g*n + n)], returns["P" + str(g*n + 1)]
+        Returns[(names[g], "Winner")], Returns[(names[g], "Loser")], Returns[(names[g], "Winner - Loser")] = top, bottom, top - bottom
+    return pd.DataFrame(Returns)
+
+def _double_sort_table(first, second, ret, mc, J, K, ind_ret = None, high = None):
+    """
+    Builds a double-sort table of Tables III and IV: the mean monthly returns of every cell, with the t-statistics of the spreads, on all
+    months and with the Farvardin months left out of the panels.
+    """
+    Mix_Strategy = {}
+    excluded = [Farvardin(ret)[1], Farvardin(mc)[1], None if ind_ret is None else Farvardin(ind_ret)[1]]
+    for column, panels in [("Ave. Monthly Return", [ret, mc, ind_ret]), ("Ave. Monthly Return Excluding Farvardin", excluded)]:
+        returns = double_sort_returns(first, second, panels[0], panels[1], J, K, panels[2], high)
+        cells = []
+        for group, portfolio in returns.columns:
+            values = returns[(group, portfolio)].dropna().to_numpy()
+            cell = str(round(np.mean(values) * 100, 2)) + "%"
+            if portfolio == "Winner - Loser":
+                cell += " (" + str(round(np.mean(values) * np.sqrt(len(values)) / np.std(values), 2)) + ")"
+            cells.append(cell)
+        Mix_Strategy[column] = pd.Series(cells, index = pd.MultiIndex.from_tuples(returns.columns, names = [double_sort_names[first], double_sort_names[second]]))
+    return pd.DataFrame(Mix_Strategy)
+
+def JT_FT(df, ret, mc, J, K, high = None):
+    """
+    Builds Table III_A: the stocks are sorted into Jegadeesh & Titman's winners, middles and losers, and each group into the winners and
+    losers of the 52-week high strategy (see double_sort_returns), on all months and without the Farvardin months.
+
+    Parameters:
+    df (DataFrame): The daily prices, used for the year-high ratios when `high` is not given.
+    ret (DataFrame): The monthly stock returns.
+    mc (DataFrame): The monthly market capitalization.
+    J (int): The ranking period of both sorts.
+    K (int): The holding period.
+    high (DataFrame, optional): The precomputed monthly year-high ratios from monthly_high.
+
+    Returns:
+    DataFrame: The "Ave. Monthly Return" and "Ave. Monthly Return Excluding Farvardin" of every (JT group, FT portfolio) cell.
+    """
+    return _double_sort_table("JT", "FT", ret, mc, J, K, high = monthly_high(df) if high is None else high)
+
+def FT_JT(df, ret, mc, J, K, high = None):
+    """
+    Builds Table III_B: the stocks are sorted into the 52-week high winners, middles and losers, and each group into Jegadeesh & Titman's
+    winners and losers (see double_sort_returns), on all months and without the Farvardin months.
+
+    Parameters:
+    df (DataFrame): The daily prices, used for the year-high ratios when `high` is not given.
+    ret (DataFrame): The monthly stock returns.
+    mc (DataFrame): The monthly market capitalization.
+    J (int): The ranking period of both sorts.
+    K (int): The holding period.
+    high (DataFrame, optional): The precomputed monthly year-high ratios from monthly_high.
+
+    Returns:
+    DataFrame: The "Ave. Monthly Return" and "Ave. Monthly Return Excluding Farvardin" of every (FT group, JT portfolio) cell.
+    """
+    return _double_sort_table("FT", "JT", ret, mc, J, K, high = monthly_high(df) if high is None else high)
+
+def MG_FT(df, ind_ret, stocks_ret, mc, J, K, high = None):
+    """
+    Builds Table IV_A: the stocks are sorted into the winners, middles and losers of their industries (Moskowitz and Grinblatt), and each
+    group into the winners and losers of the 52-week high strategy (see double_sort_returns), on all months and without the Farvardin months.
+
+    Parameters:
+    df (DataFrame): The daily prices, used for the year-high ratios when `high` is not given.
+    ind_ret (DataFrame): The monthly industry returns.
+    stocks_ret (DataFrame): The monthly stock returns.
+    mc (DataFrame): The monthly market capitalization.
+    J (int): The ranking period of both sorts.
+    K (int): The holding period.
+    high (DataFrame, optional): The precomputed monthly year-high ratios from monthly_high.
+
+    Returns:
+    DataFrame: The "Ave. Monthly Return" and "Ave. Monthly Return Excluding Farvardin" of every (MG group, FT portfolio) cell.
+    """
+    return _double_sort_table("MG", "FT", stocks_ret, mc, J, K, ind_ret, monthly_high(df) if high is None else high)
+
+def FT_MG(df, ind_ret, stocks_ret, mc, J, K, high = None):
+    """
+    Builds Table IV_B: the stocks are sorted into the 52-week high winners, middles and losers, and each group into the stocks of the
+    winner and loser industries (Moskowitz and Grinblatt, see double_sort_returns), on all months and without the Farvardin months.
+
+    Parameters:
+    df (DataFrame): The daily prices, used for the year-high ratios when `high` is not given.
+    ind_ret (DataFrame): The monthly industry returns.
+    stocks_ret (DataFrame): The monthly stock returns.
+    mc (DataFrame): The monthly market capitalization.
+    J (int): The ranking period of both sorts.
+    K (int): The holding period.
+    high (DataFrame, optional): The precomputed monthly year-high ratios from monthly_high.
+
+    Returns:
+    DataFrame: The "Ave. Monthly Return" and "Ave. Monthly Return Excluding Farvardin" of every (FT group, MG portfolio) cell.
+    """
+    return _double_sort_table("FT", "MG", stocks_ret, mc, J, K, ind_ret, monthly_high(df) if high is None else high)
+
+##### Fama-MacBeth #####
+
+def Ranker(ticker, df, ind_ret, ret, mc, J, t, labels, t2 = False, high = None, stats = None):
+    """
+    Creates binary labels for a given stock based on 3 different ranking methods.
+    
+    Parameters:
+    ticker (str): Ticker symbol of the stock to be labeled.
+    df (pandas.DataFrame): DataFrame containing stock information.
+    ind_ret (pandas.DataFrame): DataFrame containing industry return information.
+    ret (pandas.DataFrame): DataFrame containing return information of stocks.
+    mc (pandas.DataFrame): DataFrame containing market capitalization information of stocks.
+    J (int): Number of time periods to use for labeling.
+    t (int): Index in the DataFrames to start labeling from; rankings that would be formed before the second month are left at zero.
+    labels (list of str): Names of the binary labels to be created.
+    t2 (bool, optional): Indicates whether to return labels only for t2 (default is False).
+    high (pandas.DataFrame, optional): The precomputed monthly year-high ratios from monthly_high, so repeated calls do not rebuild them.
+    stats (dict, optional): The running sums of ret, mc and ind_ret from ranking_stats, shared by the JK and MG rankings.
+    
+    Returns:
+    pandas.DataFrame: A DataFrame with the binary labels for the stock.
+    """
+    df2 = monthly_high(df) if high is None else high
+    quantile7 = df2.quantile(0.7, axis = 1)
+    quantile3 = df2.quantile(0.3, axis = 1)
+    Labels = pd.DataFrame(0.0, columns=labels, index=[ret.index[t]])
+    for j in range(2, J+2):
+        if t-j < 1:
+            continue
+        J_winners, J_losers, J_middles = JK_Ranker(ret, mc, J, t-j, stats)
+        M_winners, M_losers, M_middles = MG_Ranker(ind_ret, ret, J, t-j, stats = stats)
+        FH_winners, FH_losers, FH_middles = FT_Ranker(df2, mc, quantile7, quantile3, t-j)
+        if ticker in J_winners:
+            Labels.loc[:, "JH"+str(j)] = 1
+        elif ticker in J_losers:
+            Labels.loc[:, "JL"+str(j)] = 1
+        if ticker in M_winners:
+            Labels.loc[:, "MH"+str(j)] = 1
+        elif ticker in M_losers:
+            Labels.loc[:, "ML"+str(j)] = 1
+        if ticker in FH_winners:
+            Labels.loc[:, "FHH"+str(j)] = 1
+        elif ticker in FH_losers:
+            Labels.loc[:, "FHL"+str(j)] = 1
+    return Labels
+
+def Fama_MacBeth(df, ind_ret, ret, mc, J, t2 = False, high = None, sink = None):
+    """
+The function Fama_MacBeth performs the Fama-MacBeth two-pass cross-sectional regression on a given dataframe df with industry returns ind_ret, asset returns ret, market capitalization mc, and number of quantiles J.
+
+The first step of the Fama-MacBeth regression involves running time-series regressions for each asset, regressing the excess return of the asset against size and past return, and other interaction terms formed from the rankings of the assets within quantiles based on size and past returns. The regression coefficients are stored in the dataframe coefs.
+
+The second step involves cross-sectional regressions at each time step, regressing the excess returns of all assets on their estimated coefficients from the time-series regressions. The regression coefficients for the interaction terms at each time step are stored in the dataframe premiums.
+
+The final result is a dataframe Results with the average coefficient and t-statistic for each interaction term, either with or without the first month ("Farvardin") included based on the argument t2.
+
+Parameters:
+df (DataFrame): The dataframe of all the data.
+ind_ret (Series): The series of industry returns.
+ret (DataFrame): The dataframe of asset returns.
+mc (DataFrame): The dataframe of market capitalization of each asset.
+J (int): The number of quantiles to split the assets into.
+t2 (bool): Whether or not to exclude the first month ("Farvardin"). Default is False.
+high (DataFrame, optional): The precomputed monthly year-high ratios from monthly_high; built once from df when omitted.
+sink (ResultSink, optional): Where to also write the first-pass coefficients and the monthly premiums.
+
+Returns:
+DataFrame: A dataframe of average coefficients and t-statistics for each interaction term.
+"""
+    labels = []
+    for i in ["JH", "JL", "MH", "ML", "FHH", "FHL"]:
+        for j in range(2, J+2):
+            labels.append(i+str(j))
+    coefs = pd.DataFrame(np.nan, index = ret.columns, columns = ["size", "R_t-1"] + labels + ["Intercept"], dtype = float)
+
+    #TimeSeries Regressions
+    if high is None:
+        high = monthly_high(df)
+    high = high.reindex(index = ret.index)
+    stats = ranking_stats(ret, mc, ind_ret)
+    for ticker in ret.columns:
+        mc2 = mc[ticker].dropna().to_frame().iloc[:-1, :]
+        if len(mc2) < 2:
+            continue
+        ret2 = ret[ticker].to_frame().reindex(mc2.index)
+        ret_t = ret2.iloc[1:, :]
+        ret_t1 = ret2.iloc[:-1, :]
+        mc_t1 = mc2.iloc[:-1, :]
+        Xs = mc_t1.merge(ret_t1, how="left", on="Date")
+        Xs.rename(columns = {Xs.columns[0]:"size", Xs.columns[1]:"R_t-1"}, inplace = True)
+        rows = ret.index.get_indexer(mc2.index[:-1])
+        Labels = pd.concat([Ranker(ticker, df, ind_ret, ret, mc, J, t, labels, high = high, stats = stats) for t in rows])
+        Labels.index.name = "Date"
+        Xs = Xs.merge(Labels, how="left", on="Date")
+        Xs["Intercept"] = 1
+        Xs.index = range(len(Xs))
+        ret_t.index = range(len(ret_t))
+        fitted_model = sm.OLS(ret_t.astype(float), Xs.astype(float), missing="drop").fit()
+        coefs.loc[ticker, :] = fitted_model.params
+    
+    #Cross-Sectional Regressions
+    labels = ["size", "R_t-1"] + labels + ["Intercept"]
+    premiums = cross_sectional_premiums(coefs.loc[:, labels], ret)
+    if sink is not None:
+        sink.regression("FM_" + str(J) + ("_t2" if t2 else ""), coefs, premiums)
+
+    if t2:
+        colname = "Farvardin Excluded"
+    else:
+        colname = "Farvardin Included"
+    Results = pd.DataFrame(index = labels, columns = [colname])
+    for i in Results.index:
+        Results.loc[i, :] = str(premiums.loc[:, i].mean()) + " (" + str(premiums.loc[:, i].mean() * np.sqrt(len(premiums)) / premiums.loc[:, i].std()) + ")"
+
+    return Results
+
+def Fama_MacBeth_lag(df, ind_ret, ret, mc, J, lag, t2 = False, high = None, sink = None):
+    """
+Fama_MacBeth_lag is a function that performs Fama-MacBeth regression with a specified lag period to estimate the cross-sectional average return premiums of a set of assets.
+
+Inputs:
+df (DataFrame): DataFrame containing stock information for all assets
+ind_ret (DataFrame): DataFrame containing the return of an index for all assets
+ret (DataFrame): DataFrame containing the return of all assets
+mc (DataFrame): DataFrame containing the market capitalization of all assets
+J (int): Number of portfolios to be formed
+lag (int): The specified lag period
+t2 (Boolean, optional): If t2=True, exclude the month of Farvardin from the analysis, default is False
+high (DataFrame, optional): The precomputed monthly year-high ratios from monthly_high; built once from df when omitted
+sink (ResultSink, optional): Where to also write the first-pass coefficients and the monthly premiums.
+
+Returns:
+Results (DataFrame): DataFrame containing the estimated average return premiums for each factor and the intercept, with the mean and t-statistics in the format of "mean (t-stat)".
+"""
+    labels = []
+    for i in ["JH", "JL", "MH", "ML", "FHH", "FHL"]:
+        for j in range(2, J+2):
+            labels.append(i+str(j))
+    coefs = pd.DataFrame(np.nan, index = ret.columns, columns = ["size", "R_t-1"] + labels + ["Intercept"], dtype = float)
+
+    #TimeSeries Regressions
+    if high is None:
+        high = monthly_high(df)
+    high = high.reindex(index = ret.index)
+    stats = ranking_stats(ret, mc, ind_ret)
+    for ticker in ret.columns:
+        mc2 = mc[ticker].dropna().to_frame().iloc[:-1, :]
+        if len(mc2) < 2:
+            continue
+        ret2 = ret[ticker].to_frame().reindex(mc2.index)
+        ret_t = ret2.iloc[1:, :]
+        ret_t1 = ret2.iloc[:-1, :]
+        mc_t1 = mc2.iloc[:-1, :]
+        Xs = mc_t1.merge(ret_t1, how="left", on="Date")
+        Xs.rename(columns = {Xs.columns[0]:"size", Xs.columns[1]:"R_t-1"}, inplace = True)
+        rows = ret.index.get_indexer(mc2.index[:-1]) - lag #Effect of lag
+        Labels = pd.concat([Ranker(ticker, df, ind_ret, ret, mc, J, t, labels, high = high, stats = stats) for t in np.maximum(rows, 0)])
+        Labels.loc[rows < 0, :] = 0.0
+        Labels.index = mc2.index[:-1]
+        Labels.index.name = "Date"
+        Xs = Xs.merge(Labels, how="left", on="Date")
+        Xs["Intercept"] = 1
+        Xs.index = range(len(Xs))
+        ret_t.index = range(len(ret_t))
+        fitted_model = sm.OLS(ret_t.astype(float), Xs.astype(float), missing="drop").fit()
+        coefs.loc[ticker, :] = fitted_model.params
+    
+    #Cross-Sectional Regressions
+    labels = ["size", "R_t-1"] + labels + ["Intercept"]
+    premiums = cross_sectional_premiums(coefs.loc[:, labels], ret)
+    if sink is not None:
+        sink.regression("FM_" + str(J) + "_lag" + str(lag) + ("_t2" if t2 else ""), coefs, premiums)
+
+    if t2:
+        colname = "Farvardin Excluded"
+    else:
+        colname = "Farvardin Included"
+    Results = pd.DataFrame(index = labels, columns = [colname])
+    for i in Results.index:
+        Results.loc[i, :] = str(premiums.loc[:, i].mean()) + " (" + str(premiums.loc[:, i].mean() * np.sqrt(len(premiums)) / premiums.loc[:, i].std()) + ")"
+
+    return Results
+
+def Ranker_low(ticker, df, ind_ret, ret, mc, J, t, labels, t2 = False, high = None, stats = None):
+    """
+    This function calculates the ranking labels for a given stock (`ticker`) based on the stock's performance
+    compared to other stocks in the dataframe (`df`). The ranking is done based on the stock's year-low, as well as
+    its performance in comparison to the industry (`ind_ret`) and the market (`ret`). The ranking is performed over 
+    a certain period of time `t-j` (specified by `J`) and the resulting labels are stored in a DataFrame (`Labels`).
+
+    Parameters:
+    ticker (str): The name of the stock for which to calculate the ranking labels.
+    df (pd.DataFrame): A DataFrame containing the stock prices for the stocks in the market.
+    ind_ret (pd.DataFrame): A DataFrame containing the returns for the industry for the given stocks.
+    ret (pd.DataFrame): A DataFrame containing the returns for the market for the given stocks.
+    mc (pd.DataFrame): A DataFrame containing the market capitalization values for the given stocks.
+    J (int): The number of periods to consider for the ranking.
+    t (int): The current time step.
+    labels (list): A list of strings that specify the names of the columns to use for the resulting labels.
+    t2 (bool, optional): A flag indicating whether to perform an additional calculation (default is False).
+    high (pd.DataFrame, optional): The precomputed monthly year-high ratios from monthly_high.
+    stats (dict, optional): The running sums of ret, mc and ind_ret from ranking_stats.
+
+    Returns:
+    pd.DataFrame: A DataFrame containing the resulting labels for the given stock.
+    """
+    df2 = monthly_high(df) if high is None else high
+    quantile7 = df2.quantile(0.7, axis = 1)
+    quantile3 = df2.quantile(0.3, axis = 1)
+    Labels = pd.DataFrame(0.0, columns=labels, index=[ret.index[t]])
+    for j in range(2, J+2):
+        if t-j < 1:
+            continue
+        J_winners, J_losers, J_middles = JK_Ranker(ret, mc, J, t-j, stats)
+        M_winners, M_losers, M_middles = MG_Ranker(ind_ret, ret, J, t-j, stats = stats)
+        FH_winners, FH_losers, FH_middles = FT_Ranker(df2, mc, quantile3, quantile7, t-j) # By changing the place of q7 & q3, the FT_Ranker will rank based on 52 week low.
+        if ticker in J_winners:
+            Labels.loc[:, "JH"+str(j)] = 1
+        elif ticker in J_losers:
+            Labels.loc[:, "JL"+str(j)] = 1
+        if ticker in M_winners:
+            Labels.loc[:, "MH"+str(j)] = 1
+        elif ticker in M_losers:
+            Labels.loc[:, "ML"+str(j)] = 1
+        if ticker in FH_winners:
+            Labels.loc[:, "FHH"+str(j)] = 1
+        elif ticker in FH_losers:
+            Labels.loc[:, "FHL"+str(j)] = 1
+    return Labels
+
+def Fama_MacBeth_low(df, ind_ret, ret, mc, J, t2 = False, high = None, sink = None):
+    """
+    This function performs a Fama-MacBeth regression analysis to calculate the premiums for a set of stocks in the
+    market. The analysis is performed based on the stocks' performance compared to the industry and the market, as well 
+    as their year-low values. The function first calculates the premiums for each stock using a time-series regression, 
+    and then aggregates the results using a cross-sectional regression. The resulting premiums are stored in a DataFrame 
+    (`premiums`).
+
+    Parameters:
+    df (pd.DataFrame): A DataFrame containing the stock prices for the stocks in the market.
+    ind_ret (pd.DataFrame): A DataFrame containing the returns for the industry for the given stocks.
+    ret (pd.DataFrame): A DataFrame containing the returns for the market for the given stocks.
+    mc (pd.DataFrame): A DataFrame containing the market capitalization values for the given stocks.
+    J (int): The number of periods to consider for the ranking.
+    t2 (bool, optional): A flag indicating whether to perform an additional calculation (default is False).
+    high (pd.DataFrame, optional): The precomputed monthly year-high ratios from monthly_high; built once from df when omitted.
+    sink (ResultSink, optional): Where to also write the first-pass coefficients and the monthly premiums.
+
+    Returns:
+    pd.DataFrame: A DataFrame containing the resulting premiums for each stock in the market.
+    """
+    labels = []
+    for i in ["JH", "JL", "MH", "ML", "FHH", "FHL"]:
+        for j in range(2, J+2):
+            labels.append(i+str(j))
+    coefs = pd.DataFrame(np.nan, index = ret.columns, columns = ["size", "R_t-1"] + labels + ["Intercept"], dtype = float)
+
+    #TimeSeries Regressions
+    if high is None:
+        high = monthly_high(df)
+    high = high.reindex(index = ret.index)
+    stats = ranking_stats(ret, mc, ind_ret)
+    for ticker in ret.columns:
+        mc2 = mc[ticker].dropna().to_frame().iloc[:-1, :]
+        if len(mc2) < 2:
+            continue
+        ret2 = ret[ticker].to_frame().reindex(mc2.index)
+        ret_t = ret2.iloc[1:, :]
+        ret_t1 = ret2.iloc[:-1, :]
+        mc_t1 = mc2.iloc[:-1, :]
+        Xs = mc_t1.merge(ret_t1, how="left", on="Date")
+        Xs.rename(columns = {Xs.columns[0]:"size", Xs.columns[1]:"R_t-1"}, inplace = True)
+        rows = ret.index.get_indexer(mc2.index[:-1])
+        Labels = pd.concat([Ranker_low(ticker, df, ind_ret, ret, mc, J, t, labels, high = high, stats = stats) for t in rows])
+        Labels.index.name = "Date"
+        Xs = Xs.merge(Labels, how="left", on="Date")
+        Xs["Intercept"] = 1
+        Xs.index = range(len(Xs))
+        ret_t.index = range(len(ret_t))
+        fitted_model = sm.OLS(ret_t.astype(float), Xs.astype(float), missing="drop").fit()
+        coefs.loc[ticker, :] = fitted_model.params
+    
+    #Cross-Sectional Regressions
+    labels = ["size", "R_t-1"] + labels + ["Intercept"]
+    premiums = cross_sectional_premiums(coefs.loc[:, labels], ret)
+    if sink is not None:
+        sink.regression("FM_low_" + str(J) + ("_t2" if t2 else ""), coefs, premiums)
+
+    if t2:
+        colname = "Farvardin Excluded"
+    else:
+        colname = "Farvardin Included"
+    Results = pd.DataFrame(index = labels, columns = [colname])
+    for i in Results.index:
+        Results.loc[i, :] = str(premiums.loc[:, i].mean()) + " (" + str(premiums.loc[:, i].mean() * np.sqrt(len(premiums)) / premiums.loc[:, i].std()) + ")"
+
+    return Results
+
+##### Significance #####
+
+def _bootstrap_batch(spread, block, draws, seed):
+    """
+    Draws one batch of moving block bootstrap means of `spread`.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(spread)
+    starts = rng.integers(0, n - block + 1, size = (draws, -(-n // block)))
+    index = (starts[:, :, None] + np.arange(block)).reshape(draws, -1)[:, :n]
+    return spread[index].mean(axis = 1)
+
+def _placebo_batch(ret, winners, losers, rows, holding, draws, seed):
+    """
+    Draws one batch of placebo spread means by randomly relabelling the ranked stocks of every formation month.
+    """
+    rng = np.random.default_rng(seed)
+    formations, index = np.unique(rows, return_inverse = True)
+    universe = winners[formations] | losers[formations]
+    n_w = winners[formations].sum(axis = 1)[:, None]
+    n_l = losers[formations].sum(axis = 1)[:, None]
+    keys = rng.random((draws,) + universe.shape)
+    keys[:, ~universe] = 2.0
+    ranks = keys.argsort(axis = 2).argsort(axis = 2)
+    valid = ~np.isnan(ret)
+    ret = np.where(valid, ret, 0.0)
+    index = index.ravel()
+    months = holding.ravel()
+    spread = 0.0
+    for members, sign in (((ranks < n_w), 1.0), (((ranks >= n_w) & (ranks < n_w + n_l)), -1.0)):
+        chosen = members[:, index, :].astype(float)
+        num = np.einsum("bij,ij->bi", chosen, ret[months])
+        den = np.einsum("bij,ij->bi", chosen, valid[months])
+        pair = np.divide(num, den, out = np.full(num.shape, np.nan), where = den > 0)
+        spread = spread + sign * pair.reshape((draws,) + rows.shape).sum(axis = 2)
+    return np.nanmean(spread, axis = 1)
+
+def _run_batches(func, args, n_draws, batch, seed, processes):
+    """
+    Runs `func(*args, draws, seed)` over batches of at most `batch` draws, each with its own child seed of `seed`, so results don't depend on the number of processes.
+
+    Returns:
+    tuple: The concatenated draws and the seconds spent per 1000 draws.
+    """
+    sizes = [min(batch, n_draws - i) for i in range(0, n_draws, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    start = time.perf_counter()
+    if processes == 1:
+        results = [func(*args, size, child) for size, child in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(func, *[[arg] * len(sizes) for arg in args], sizes, seeds))
+    elapsed = time.perf_counter() - start
+    return np.concatenate(results), elapsed * 1000 / n_draws
+
+def block_bootstrap(spread, n_draws = 10000, block = 6, alpha = 0.05, seed = 0, batch = 1000, processes = 1):
+    """
+    Moving block bootstrap of the mean of a monthly spread series.
+
+    Parameters:
+    spread (pandas Series or numpy array): Monthly Winner - Loser returns, e.g. the "Winner - Loser" column of JK_Returns, MG_Returns or FT_Returns.
+    n_draws (int): The number of bootstrap resamples.
+    block (int): The block length in months, which keeps the autocorrelation of overlapping holding periods; shortened to the length of a shorter series.
+    alpha (float): The significance level of the confidence interval.
+    seed (int): The seed the batch seeds are spawned from.
+    batch (int): The number of resamples drawn together in one vectorized batch.
+    processes (int, optional): The number of worker processes, 1 (the default) to run in the current process, None for all cores.
+
+    Returns:
+    pandas Series: The mean, the confidence interval, the two-sided p-value, the number of draws and the seconds per 1000 draws.
+
+    Raises:
+    ValueError: If the spread has no valid months.
+    """
+    spread = np.asarray(spread, dtype = float)
+    spread = spread[~np.isnan(spread)]
+    if len(spread) == 0:
+        raise ValueError("block_bootstrap needs at least one valid month")
+    block = max(min(block, len(spread)), 1)
+    means, per_1k = _run_batches(_bootstrap_batch, (spread, block), n_draws, batch, seed, processes)
+    mean = spread.mean()
+    p_value = np.mean(np.abs(means - mean) >= np.abs(mean))
+    return pd.Series({"Mean": mean, "CI Low": np.quantile(means, alpha / 2), "CI High": np.quantile(means, 1 - alpha / 2),
+                      "p-value": p_value, "Draws": n_draws, "Seconds per 1k": per_1k})
+
+def placebo_test(ret, winners, losers, rows, holding, n_draws = 1000, seed = 0, batch = 20, processes = 1):
+    """
+    Compares the mean spread of a strategy with spreads of random winner/loser assignments of the same ranked stocks.
+
+    Parameters:
+    ret (pandas DataFrame): A dataframe of monthly stock returns.
+    winners (numpy array): The winner membership matrix, e.g. from JK_Members, MG_Members or FT_Members.
+    losers (numpy array): The loser membership matrix.
+    rows (numpy array): The formation rows of the cohorts, from cohort_pairs.
+    holding (numpy array): The holding months of the cohorts, from cohort_pairs.
+    n_draws (int): The number of placebo assignments.
+    seed (int): The seed the batch seeds are spawned from.
+    batch (int): The number of assignments evaluated together in one vectorized batch.
+    processes (int, optional): The number of worker processes, 1 (the default) to run in the current process, None for all cores.
+
+    Returns:
+    pandas Series: The actual mean spread, the mean and the 5% and 95% quantiles of the placebo spreads, the one-sided p-value, the number of draws and the seconds per 1000 draws.
+    """
+    w_rets, l_rets = cohort_returns(ret, winners, losers, rows, holding)
+    actual = np.nanmean(w_rets - l_rets)
+    means, per_1k = _run_batches(_placebo_batch, (ret.to_numpy(dtype = float), winners, losers, rows, holding), n_draws, batch, seed, processes)
+    return pd.Series({"Mean": actual, "Placebo Mean": means.mean(), "Placebo 5%": np.quantile(means, 0.05), "Placebo 95%": np.quantile(means, 0.95),
+                      "p-value": np.mean(means >= actual), "Draws": n_draws, "Seconds per 1k": per_1k})
+
+def Significance(spreads, n_draws = 10000, block = 6, alpha = 0.05, seed = 0, processes = 1):
+    """
+    Runs the block bootstrap for several strategy spreads and collects the results in one table.
+
+    Parameters:
+    spreads (dict): Strategy names mapped to monthly Winner - Loser returns, e.g. {"JK": JK_Returns(...)["Winner - Loser"], ...}.
+    n_draws (int): The number of bootstrap resamples per strategy.
+    block (int): The block length in months.
+    alpha (float): The significance level of the confidence intervals.
+    seed (int): The seed of every strategy's resamples.
+    processes (int, optional): The number of worker processes, 1 (the default) to run in the current process, None for all cores.
+
+    Returns:
+    pandas DataFrame: One row of block_bootstrap results per strategy.
+    """
+    Results = pd.DataFrame({name: block_bootstrap(spread, n_draws, block, alpha, seed, processes = processes) for name, spread in spreads.items()}).transpose()
+    Results.index.name = "Strategy"
+    return Results
+
+##### Turnover #####
+
+# Number of set bits of every byte, used to count membership changes of packed bitsets.
+bit_counts = np.unpackbits(np.arange(256, dtype = np.uint8)[:, None], axis = 1).sum(axis = 1)
+
+def membership_changes(members):
+    """
+    Counts the stocks entering or leaving a portfolio between consecutive formation months.
+
+    Parameters:
+    members (numpy array): A (months x tickers) boolean membership matrix.
+
+    Returns:
+    numpy array: The number of changed memberships of every row against the previous one (0 for the first row).
+    """
+    bits = np.packbits(np.asarray(members, dtype = bool), axis = 1)
+    flips = np.bitwise_xor(bits[1:], bits[:-1])
+    return np.concatenate([np.zeros(1, dtype = int), bit_counts[flips].sum(axis = 1)])
+
+def portfolio_turnover(weights, index):
+    """
+    Calculates the monthly one-sided turnover of a portfolio that holds K overlapping cohorts with equal shares.
+
+    Parameters:
+    weights (numpy array): A (formations x tickers) weight matrix of the cohorts.
+    index (numpy array): A (holding months x K) array with the row of `weights` of every cohort held in each month.
+
+    Returns:
+    numpy array: Half the total absolute weight change of every holding month; the first month counts the initial purchase.
+    """
+    held = weights[index].mean(axis = 1)
+    held = np.vstack([np.zeros((1, held.shape[1])), held])
+    return 0.5 * np.abs(np.diff(held, axis = 0)).sum(axis = 1)
+
+def Turnover(ret, winners, losers, rows, holding, returns, cost = 0.005, mc = None, weighting = "equal", cap = 0.9):
+    """
+    Measures how much the winner and loser portfolios change every month and deducts the trading cost from the spread.
+
+    The holding month portfolio is the average of its K cohorts, so the turnover covers the overlapping JT-style holdings.
+    The cost is charged on both sides of every trade and scaled by K, since the strategies report the sum of the K cohort returns.
+
+    Parameters:
+    ret (pandas DataFrame): A dataframe of monthly stock returns.
+    winners (numpy array): The winner membership matrix, e.g. from JK_Members, MG_Members or FT_Members.
+    losers (numpy array): The loser membership matrix.
+    rows (numpy array): The formation rows of the cohorts, from cohort_pairs.
+    holding (numpy array): The holding months of the cohorts, from cohort_pairs.
+    returns (pandas DataFrame): The monthly returns of the strategy, from JK_Returns, MG_Returns or FT_Returns.
+    cost (float): The one-way transaction cost per unit of traded value.
+    mc (pandas DataFrame, optional): Market capitalization, needed unless weighting is "equal".
+    weighting (str): "equal", "value" or "capped".
+    cap (float): The market cap ceiling quantile of the "capped" weighting.
+
+    Returns:
+    pandas DataFrame: The monthly turnover and membership changes of both portfolios with the gross and net Winner - Loser returns.
+    """
+    formations, index = np.unique(rows, return_inverse = True)
+    index = index.reshape(rows.shape)
+    K = rows.shape[1]
+    w_turnover = portfolio_turnover(formation_weights(ret, winners, formations, mc, weighting, cap), index)
+    l_turnover = portfolio_turnover(formation_weights(ret, losers, formations, mc, weighting, cap), index)
+    newest = np.searchsorted(formations, rows.max(axis = 1))
+    Results = pd.DataFrame(index = returns.index)
+    Results["Winner Turnover"] = w_turnover
+    Results["Loser Turnover"] = l_turnover
+    Results["Winner Changes"] = membership_changes(winners[formations])[newest]
+    Results["Loser Changes"] = membership_changes(losers[formations])[newest]
+    Results["Winner - Loser"] = returns["Winner - Loser"].to_numpy()
+    Results["Net Winner - Loser"] = Results["Winner - Loser"] - 2 * cost * K * (w_turnover + l_turnover)
+    return Results
+
+##### Chunked Execution #####
+
+def ticker_blocks(columns, rows, max_memory = 2**30, copies = 6):
+    """
+    Splits the tickers of a daily panel into blocks whose working set fits in `max_memory`.
+
+    Parameters:
+    columns (list): The tickers of the panel.
+    rows (int): The number of daily rows of the panel.
+    max_memory (int): The peak memory, in bytes, a block may use.
+    copies (int): The number of float64 copies of a block alive at once while it is processed.
+
+    Returns:
+    list: Lists of tickers.
+    """
+    size = max(1, int(max_memory // (rows * 8 * copies)))
+    return [list(columns[i:i + size]) for i in range(0, len(columns), size)]
+
+def chunked_panels(stocks, market_cap, start = None, end = None, max_memory = 2**30, actions = None):
+    """
+    Builds the monthly panels from the daily csv files one block of tickers at a time.
+
+    The year-high, monthly prices and monthly returns of a ticker depend only on its own prices, so each block is read
+    from disk, reduced to its monthly rows and dropped before the next one is read; only the monthly panels are kept.
+    The dates are parsed in the calendar of the current market once and shared by all blocks.
+
+    Parameters:
+    stocks (str): The csv file of daily prices, with the dates in the first column and the "Index" column second.
+    market_cap (str): The csv file of daily market capitalizations.
+    start (JalaliDate or Timestamp, optional): The first date of the sample.
+    end (JalaliDate or Timestamp, optional): The last date of the sample.
+    max_memory (int): The peak memory, in bytes, of a block of daily data.
+    actions (pandas DataFrame, optional): Corporate actions (see read_actions) the prices of each block are adjusted for.
+
+    Returns:
+    dict: The monthly panels "Stocks_M" (with the "Index" column), "returns_M", "Market_Cap_M" and "high_M" (the monthly year-high ratio used by FT_Ranker).
+    """
+    panels = {"Stocks_M": [], "returns_M": [], "Market_Cap_M": [], "high_M": []}
+    frames = {}
+    for name in [stocks, market_cap]:
+        header = pd.read_csv(name, nrows = 0).columns
+        dates = pd.Index([current_market().parse_date(date) for date in pd.read_csv(name, usecols = [0]).iloc[:, 0]], name = "Date")
+        keep = np.ones(len(dates), dtype = bool)
+        if start is not None:
+            keep &= np.array([date >= start for date in dates])
+        if end is not None:
+            keep &= np.array([date <= end for date in dates])
+        frames[name] = (header, dates[keep], keep)
+    header, dates, keep = frames[stocks]
+    mc_header, mc_dates, mc_keep = frames[market_cap]
+    tickers = [stock for stock in header[1:] if stock in mc_header and stock != "Index"]
+
+    def read_block(name, columns, dates, keep):
+        block = pd.read_csv(name, usecols = columns)[columns].loc[keep, :]
+        block.index = dates
+        return block
+
+    index = read_block(stocks, ["Index"], dates, keep)
+    panels["Stocks_M"].append(d2m(index))
+    for block in ticker_blocks(tickers, len(dates), max_memory):
+        prices = read_block(stocks, block, dates, keep)
+        if actions is not None:
+            prices = adjust_prices(prices, actions)
+        panels["Stocks_M"].append(d2m(prices))
+        panels["returns_M"].append(ret_d2m(prices.pct_change().shift(-1).iloc[:-1, :]))
+        panels["high_M"].append(d2m(year_high(prices)).iloc[:-1, :])
+        del prices
+        panels["Market_Cap_M"].append(d2m(read_block(market_cap, block, mc_dates, mc_keep)))
+    return {name: pd.concat(blocks, axis = 1) for name, blocks in panels.items()}
+
+##### Price Downloads #####
+
+def finpy_fetch(ticker, start_date, end_date):
+    """
+    Downloads the adjusted daily closing prices of one ticker with finpy_tse.
+
+    Parameters:
+    ticker (str): The ticker symbol.
+    start_date (str): The first Jalali date, "YYYY-MM-DD".
+    end_date (str): The last Jalali date, "YYYY-MM-DD".
+
+    Returns:
+    pandas DataFrame: A "Price" column indexed by Jalali date strings.
+    """
+    history = tse.Get_Price_History(stock = ticker, start_date = start_date, end_date = end_date, ignore_date = False,
+                                    adjust_price = True, show_weekday = False, double_date = False)
+    history = history[["Adj Final"]].rename(columns = {"Adj Final": "Price"})
+    history.index = [str(date) for date in history.index]
+    return history
+
+def _cache_path(cache, ticker):
+    """
+    The cache file of one ticker.
+    """
+    return os.path.join(cache, ticker + ".csv")
+
+def _update_ticker(cache, ticker, fetch, start_date, end_date, market):
+    """
+    Downloads the dates of one ticker newer than its cache file and appends them to it.
+
+    The dates are compared as dates of the market calendar, not as strings, so "1400-1-5" and "1400-01-05" are the same day.
+    """
+    path = _cache_path(cache, ticker)
+    cached = None
+    if os.path.exists(path):
+        cached = pd.read_csv(path, index_col = 0)
+        start_date = str(market.parse_date(cached.index[-1]) + datetime.timedelta(days = 1))
+    last = None if cached is None else str(cached.index[-1])
+    if market.parse_date(start_date) > market.parse_date(end_date):
+        return 0, last
+    new = fetch(ticker, start_date, end_date)
+    if last is not None:
+        new = new[[market.parse_date(date) > market.parse_date(last) for date in new.index]]
+    if len(new) == 0:
+        return 0, last
+    new.index.name = "Date"
+    combined = new if cached is None else pd.concat([cached, new])
+    combined.to_csv(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return len(new), str(combined.index[-1])
+
+def download_prices(tickers, cache, fetch = finpy_fetch, start_date = "1387-01-01", end_date = None, workers = 8):
+    """
+    Downloads the daily histories of many tickers concurrently into a local per-ticker cache.
+
+    Each ticker is stored in its own csv file in `cache`, and only dates newer than the last cached one are requested.
+    A failed ticker is reported and does not stop the others.
+
+    Parameters:
+    tickers (list of str): The ticker symbols; they are normalized with normalize_symbols.
+    cache (str): The cache directory.
+    fetch (function): fetch(ticker, start_date, end_date) returning a dataframe indexed by Jalali date strings, e.g. finpy_fetch.
+    start_date (str): The first Jalali date, "YYYY-MM-DD", of tickers that are not cached yet.
+    end_date (str, optional): The last Jalali date, by default today.
+    workers (int): The maximum number of concurrent downloads.
+
+    Returns:
+    pandas DataFrame: The number of new rows, the last cached date and the error, if any, of every ticker.
+    """
+    os.makedirs(cache, exist_ok = True)
+    market = current_market()
+    if end_date is None:
+        end_date = str(JalaliDate.today())
+    tickers = list(dict.fromkeys(normalize_symbols(tickers)))
+    Results = pd.DataFrame(index = tickers, columns = ["New Rows", "Last Date", "Error"])
+    Results.index.name = "Ticker"
+    with ThreadPoolExecutor(workers) as executor:
+        futures = {executor.submit(_update_ticker, cache, ticker, fetch, start_date, end_date, market): ticker for ticker in tickers}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                Results.loc[ticker, ["New Rows", "Last Date"]] = future.result()
+            except Exception as error:
+                Results.loc[ticker, ["New Rows", "Error"]] = [0, repr(error)]
+    return Results
+
+def cached_panel(cache, column = "Price", tickers = None):
+    """
+    Assembles a daily panel, in the layout of Stocks.csv, from the per-ticker cache.
+
+    Parameters:
+    cache (str): The cache directory of download_prices.
+    column (str): The column of the cache files to collect.
+    tickers (list of str, optional): The tickers to collect, by default every cached ticker.
+
+    Returns:
+    pandas DataFrame: One column per ticker indexed by Jalali date strings; save it with to_csv to read it back with read_data.
+    """
+    if tickers is None:
+        tickers = sorted(name[:-4] for name in os.listdir(cache) if name.endswith(".csv"))
+    else:
+        tickers = normalize_symbols(tickers)
+    panel = pd.concat({ticker: pd.read_csv(_cache_path(cache, ticker), index_col = 0)[column] for ticker in tickers}, axis = 1)
+    panel = panel.sort_index()
+    panel.index.name = "Date"
+    return panel
+
+##### Price Adjustment #####
+
+def read_actions(name):
+    """
+    Reads a corporate action table.
+
+    The csv file has a "Ticker" and a "Date" ("YYYY-MM-DD" in the calendar of the current market, the first trading day without the right) column and either a
+    "Factor" column (the multiplier of all earlier prices) or "Split" (new shares per old share, e.g. 1.5 for a 50% capital increase)
+    and "Dividend" (cash per share) columns.
+
+    Parameters:
+    name (str): The csv file.
+
+    Returns:
+    pandas DataFrame: The actions with normalized tickers and JalaliDate (or, for a Gregorian market, Timestamp) dates.
+    """
+    actions = pd.read_csv(name)
+    actions["Ticker"] = normalize_symbols(actions["Ticker"])
+    actions["Date"] = [current_market().parse_date(date) for date in actions["Date"]]
+    return actions
+
+def adjustment_factors(prices, actions):
+    """
+    Calculates the cumulative adjustment factor of every price with one reverse cumulative product per panel.
+
+    The factor of a price is the product of the factors of all actions after its date, so the adjusted series has no jump on ex-dates.
+
+    Parameters:
+    prices (pandas DataFrame): Daily prices indexed by JalaliDate.
+    actions (pandas DataFrame): Corporate actions, e.g. from read_actions.
+
+    Returns:
+    pandas DataFrame: The factors, shaped like `prices`.
+    """
+    rows = prices.index.searchsorted(actions["Date"].tolist())
+    cols = prices.columns.get_indexer(actions["Ticker"])
+    keep = (cols >= 0) & (rows > 0) & (rows < len(prices))
+    rows, cols = rows[keep], cols[keep]
+    actions = actions[keep]
+    if "Factor" in actions.columns:
+        factor = actions["Factor"].to_numpy(dtype = float)
+    else:
+        factor = np.ones(len(actions))
+        if "Split" in actions.columns:
+            factor = factor / actions["Split"].fillna(1).to_numpy(dtype = float)
+        if "Dividend" in actions.columns:
+            previous = prices.to_numpy(dtype = float)[rows - 1, cols]
+            factor = factor * (1 - actions["Dividend"].fillna(0).to_numpy(dtype = float) / previous)
+    factors = np.ones(prices.shape)
+    np.multiply.at(factors, (rows, cols), np.nan_to_num(factor, nan = 1.0))
+    factors = np.cumprod(factors[::-1], axis = 0)[::-1]
+    factors = np.vstack([factors[1:], np.ones((1, prices.shape[1]))])
+    return pd.DataFrame(factors, index = prices.index, columns = prices.columns)
+
+def adjust_prices(prices, actions):
+    """
+    Adjusts a daily price panel for capital increases and dividends, before year_high or the returns are computed.
+
+    Parameters:
+    prices (pandas DataFrame): Daily prices indexed by JalaliDate.
+    actions (pandas DataFrame): Corporate actions, e.g. from read_actions.
+
+    Returns:
+    pandas DataFrame: The adjusted prices.
+    """
+    return prices * adjustment_factors(prices, actions)
+
+def readjust_prices(adjusted, prices, actions, new_actions):
+    """
+    Adds corporate actions to an adjusted panel, recomputing only the tickers they affect.
+
+    Parameters:
+    adjusted (pandas DataFrame): The panel adjusted for `actions`.
+    prices (pandas DataFrame): The raw prices.
+    actions (pandas DataFrame): The actions already applied.
+    new_actions (pandas DataFrame): The actions to add.
+
+    Returns:
+    tuple: The adjusted panel and the combined action table.
+    """
+    actions = pd.concat([actions, new_actions], ignore_index = True)
+    tickers = [ticker for ticker in new_actions["Ticker"].unique() if ticker in prices.columns]
+    adjusted = adjusted.copy()
+    adjusted[tickers] = adjust_prices(prices[tickers], actions[actions["Ticker"].isin(tickers)])
+    return adjusted, actions
+
+##### Ranking Service #####
+
+def month_key(date):
+    """
+    The "YYYY-MM" key of a Jalali date.
+    """
+    return str(date.year) + "-" + str(date.month).zfill(2)
+
+def ranking_state(inputs, J_list = (6,)):
+    """
+    Precomputes the JK, MG and FT memberships and signal values of every month, for fast point-in-time queries.
+
+    Every matrix has one row per month of the monthly returns, so the year-high ratios, which start a year later, are aligned to them by date;
+    the FT signal of a month is the ratio of the month before, the one its ranking uses. The JK and MG signals are the J-month means the rankings
+    sort on, read from rolling_stats: the mean of the liquid stocks with a return in every month of the window, and the mean of the valid months of the industry.
+
+    Parameters:
+    inputs (dict): The shared panels, from load_inputs.
+    J_list (iterable of int): The ranking periods to precompute.
+
+    Returns:
+    dict: The month keys mapped to rows, the tickers, and the (strategy, J) memberships and signals.
+    """
+    ret, mc, r_sec = inputs["returns_M"], inputs["Market_Cap_M"], inputs["r_sec"]
+    high = inputs["high_M"] if "high_M" in inputs else monthly_high(inputs["Stocks"])
+    high = high.reindex(index = ret.index, columns = ret.columns)
+    quantile7 = high.quantile(0.7, axis = 1)
+    quantile3 = high.quantile(0.3, axis = 1)
+    state = {"months": {month_key(date): row for row, date in enumerate(ret.index)}, "columns": ret.columns, "members": {}, "signals": {}}
+    sector_ids = sector_codes(ret.columns, current_market().sectors)
+    industry = np.full(len(ret.columns), None, dtype = object)
+    for sector, ids in sector_ids[1].items():
+        if sector in r_sec.columns:
+            industry[np.isin(sector_ids[0], ids)] = sector
+    ft_members = FT_Members(high, mc, quantile7, quantile3, range(1, len(high)), ret.columns, inputs.get("mc_ragged"))
+    ft_signal = np.vstack([np.full((1, len(ret.columns)), np.nan), high.to_numpy(dtype = float)[:-1]])
+    for J in J_list:
+        state["members"][("JK", J)] = JK_Members(ret, mc, J, range(2 * J+1, len(ret)))
+        state["members"][("MG", J)] = MG_Members(r_sec, ret, J, range(J+1, len(ret)))
+        state["members"][("FT", J)] = ft_members
+        state["signals"][("JK", J)] = JK_Signals(ret, mc, J, range(J, len(ret)))
+        sector_signal = pd.DataFrame(trailing_stats(rolling_stats(r_sec), J)["mean"], index = r_sec.index, columns = r_sec.columns).reindex(ret.index)
+        state["signals"][("MG", J)] = np.column_stack([sector_signal[sector].to_numpy(dtype = float) if sector is not None else np.full(len(sector_signal), np.nan) for sector in industry])
+        state["signals"][("FT", J)] = ft_signal
+    return state
+
+def query_rankings(state, strategy, J, month, ticker = None):
+    """
+    Answers a point-in-time membership or signal query from a precomputed ranking state.
+
+    Parameters:
+    state (dict): The state from ranking_state.
+    strategy (str): "JK", "MG" or "FT".
+    J (int): The ranking period.
+    month (str): The month, "YYYY-MM".
+    ticker (str, optional): The ticker whose signal value and group is requested; all members are returned when omitted.
+
+    Returns:
+    dict: The winners and losers of the month, or the signal value and group of the ticker.
+
+    Raises:
+    KeyError: If the strategy, ranking period, month or ticker has no rankings.
+    """
+    row = state["months"][month]
+    winners, losers = state["members"][(strategy, J)]
+    if row >= min(len(winners), len(losers)) or not (winners[row].any() or losers[row].any()):
+        raise KeyError("no " + strategy + " rankings for " + month)
+    answer = {"strategy": strategy, "J": J, "month": month}
+    if ticker is None:
+        answer["winners"] = state["columns"][winners[row]].tolist()
+        answer["losers"] = state["columns"][losers[row]].tolist()
+        return answer
+    col = state["columns"].get_loc(normalize_symbols([ticker])[0])
+    signal = state["signals"][(strategy, J)]
+    answer["ticker"] = state["columns"][col]
+    answer["signal"] = None if row >= len(signal) or col >= signal.shape[1] or np.isnan(signal[row, col]) else float(signal[row, col])
+    answer["group"] = "Winner" if winners[row, col] else "Loser" if losers[row, col] else "Middle"
+    return answer
+
+class RankingHandler(BaseHTTPRequestHandler):
+    """
+    Serves GET /rankings?strategy=FT&J=6&month=1400-05[&ticker=...] from the server's warm ranking state.
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path != "/rankings":
+                raise KeyError(url.path)
+            answer = query_rankings(self.server.state, params["strategy"], int(params.get("J", 6)), params["month"], params.get("ticker"))
+            status = 200
+        except (KeyError, ValueError, IndexError) as error:
+            answer, status = {"error": repr(error)}, 404
+        body = json.dumps(answer, ensure_ascii = False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def _watch_panels(server, config, J_list, poll):
+    """
+    Rebuilds the ranking state in the background whenever one of the panel files changes.
+
+    A reload that fails, e.g. on a half-written file, is logged and the previous state keeps being served until the files change again.
+    """
+    files = [path for key, path in config["data"].items() if key in ("stocks", "sectors", "market_cap", "actions") and path]
+    stamps = [os.path.getmtime(path) for path in files]
+    while True:
+        time.sleep(poll)
+        try:
+            current = [os.path.getmtime(path) for path in files]
+            if current == stamps:
+                continue
+            stamps = current
+            server.state = ranking_state(load_inputs(config["data"]), J_list)
+        except Exception:
+            logger.exception("Reloading the panels failed; still serving the previous rankings")
+            continue
+        logger.info("Reloaded the panels")
+
+def serve_rankings(config, host = "127.0.0.1", port = 8050, J_list = (6,), poll = 5.0):
+    """
+    Runs a local HTTP service that keeps the rankings in memory and answers queries in milliseconds.
+
+    The panels are loaded once; a background thread reloads them when the csv files change, and queries keep being answered from
+    the previous state until the new one is ready.
+
+    Parameters:
+    config (dict): The batch configuration (see read_config); its "data" section and, to start from a snapshot, "snapshot".
+    host (str): The address to listen on.
+    port (int): The port to listen on.
+    J_list (iterable of int): The ranking periods to precompute.
+    poll (float): The seconds between checks of the panel files.
+    """
+    use_market(config["data"].get("market", default_market))
+    server = ThreadingHTTPServer((host, port), RankingHandler)
+    if config.get("snapshot"):
+        server.state = warm_start(config["snapshot"], config["data"], J_list)[1]
+    else:
+        server.state = ranking_state(load_inputs(config["data"]), J_list)
+    threading.Thread(target = _watch_panels, args = (server, config, J_list, poll), daemon = True).start()
+    logger.info("Serving rankings on http://%s:%s/rankings", host, port)
+    server.serve_forever()
+
+##### Compact Panels #####
+
+def panel_memory(panels):
+    """
+    Measures the memory of every dataframe in a dict of panels.
+
+    Parameters:
+    panels (dict): Panel names mapped to dataframes, e.g. from load_inputs.
+
+    Returns:
+    pandas Series: The bytes used by each panel, object columns included.
+    """
+    return pd.Series({name: panel.memory_usage(deep = True).sum() for name, panel in panels.items() if isinstance(panel, pd.DataFrame)})
+
+def compact_panels(panels, float32 = False):
+    """
+    Converts every panel to a strict numeric dtype and reports the memory saved.
+
+    Object columns (e.g. from frames that were created empty and filled cell by cell) become float64, and with `float32` the
+    prices, returns and market caps are stored as float32, which halves them again.
+
+    Parameters:
+    panels (dict): Panel names mapped to dataframes, e.g. from load_inputs.
+    float32 (bool): Whether to store the panels as float32.
+
+    Returns:
+    tuple: The converted panels and a dataframe with the memory of every panel before and after, in MB.
+    """
+    dtype = np.float32 if float32 else np.float64
+    compact = {name: panel.astype(dtype) if isinstance(panel, pd.DataFrame) else panel for name, panel in panels.items()}
+    Report = pd.DataFrame({"Before (MB)": panel_memory(panels) / 2**20, "After (MB)": panel_memory(compact) / 2**20})
+    Report.loc["Total", :] = Report.sum()
+    Report["Saved (MB)"] = Report["Before (MB)"] - Report["After (MB)"]
+    Report.index.name = "Panel"
+    return compact, Report
+
+##### Pipeline #####
+
+class Pipeline:
+    """
+    A lazy graph of named stages, each declaring the stages whose results it takes as inputs.
+
+    A stage runs at most once, the first time it or a stage depending on it is requested, and stages whose inputs are ready
+    run concurrently on a thread pool. Results are kept in memory or, with a spill directory, pickled there and read back when a later stage needs them.
+
+    Parameters:
+    spill (str, optional): A directory to keep the results in instead of memory.
+    workers (int): The number of threads running independent stages.
+    market (Market, optional): The market the stages run in, by default the current market of the thread calling compute.
+    """
+
+    def __init__(self, spill = None, workers = 4, market = None):
+        self.stages = {}
+        self.results = {}
+        self.spill = spill
+        self.workers = workers
+        self.market = market
+        if spill:
+            os.makedirs(spill, exist_ok = True)
+
+    def add(self, name, function, inputs = (), args = ()):
+        """
+        Declares a stage that computes function(*args, *results of inputs).
+        """
+        self.stages[name] = (function, tuple(args), tuple(inputs))
+        self.results.pop(name, None)
+        return name
+
+    def set(self, name, value):
+        """
+        Declares a stage with a known result.
+        """
+        self.stages[name] = (None, (), ())
+        self._store(name, value)
+
+    def _store(self, name, value):
+        if self.spill:
+            _checkpoint(self.spill, name, value)
+            value = os.path.join(self.spill, name + ".pkl")
+        self.results[name] = value
+
+    def _load(self, name):
+        if self.spill:
+            return pd.read_pickle(self.results[name])
+        return self.results[name]
+
+    def order(self, names):
+        """
+        Lists the stages still to run before `names` are available, each after its inputs.
+        """
+        order = []
+        visiting = set()
+        def visit(name):
+            if name in self.results or name in order:
+                return
+            if name not in self.stages:
+                raise KeyError("unknown pipeline stage " + repr(name))
+            if name in visiting:
+                raise ValueError("pipeline stage " + repr(name) + " depends on itself")
+            visiting.add(name)
+            for dep in self.stages[name][2]:
+                visit(dep)
+            visiting.discard(name)
+            order.append(name)
+        for name in names:
+            visit(name)
+        return order
+
+    def compute(self, *names):
+        """
+        Runs the stages `names` need and returns their results.
+
+        Returns:
+        dict: The requested stage names mapped to their results.
+        """
+        pending = self.order(names)
+        market = self.market or current_market()
+        if pending:
+            with ThreadPoolExecutor(self.workers) as executor:
+                running = {}
+                while pending or running:
+                    for name in [name for name in pending if all(dep in self.results for dep in self.stages[name][2])]:
+                        function, args, inputs = self.stages[name]
+                        running[executor.submit(_in_market, market, function, *args, *[self._load(dep) for dep in inputs])] = name
+                        pending.remove(name)
+                    finished, _ = wait(running, return_when = FIRST_COMPLETED)
+                    for future in finished:
+                        self._store(running.pop(future), future.result())
+        return {name: self._load(name) for name in names}
+
+    def get(self, name):
+        """
+        Runs the stages `name` needs and returns its result.
+        """
+        return self.compute(name)[name]
+
+def _in_market(market, function, *args):
+    """
+    Runs a function with `market` as the current market of the thread.
+    """
+    with market:
+        return function(*args)
+
+def _period(data):
+    """
+    The start and end dates of a batch configuration, in the calendar of the current market.
+    """
+    return [current_market().parse_date(data[key]) for key in ("start", "end")]
+
+def _read_panel(data, key):
+    """
+    Reads one csv file of a batch configuration over the configured period.
+    """
+    start, end = _period(data)
+    return read_data(data[key]).loc[start:end]
+
+# The adjusted prices of every price file and period, with the digest of the file and the actions applied to them.
+_adjusted_prices = {}
+
+def _action_keys(actions):
+    """
+    One string per action row, to tell the actions of a table that are already applied from the new ones.
+    """
+    return pd.Series([str(tuple(row)) for row in actions.itertuples(index = False)], index = actions.index, dtype = object)
+
+def _read_prices(data):
+    """
+    Reads the daily prices, adjusted for the corporate actions when an "actions" file is configured.
+
+    The adjusted panel is kept with the actions applied to it, so when the price file is unchanged and the actions file only gained rows,
+    readjust_prices recomputes just the tickers of the new actions; any other change adjusts the whole panel again.
+    """
+    if not data.get("actions"):
+        return _read_panel(data, "stocks")
+    actions = read_actions(data["actions"])
+    key = (current_market().name, os.path.abspath(data["stocks"]), str(data.get("start")), str(data.get("end")))
+    digest = _file_digest(data["stocks"])
+    cached = _adjusted_prices.get(key)
+    if cached is not None and cached[0] == digest:
+        digest, prices, adjusted, applied = cached
+        known = _action_keys(actions).isin(set(_action_keys(applied)))
+        if known.sum() == len(applied):
+            if not known.all():
+                adjusted, applied = readjust_prices(adjusted, prices, applied, actions[~known.to_numpy()])
+                _adjusted_prices[key] = (digest, prices, adjusted, applied)
+            return adjusted.copy()
+    else:
+        prices = _read_panel(data, "stocks")
+    adjusted = adjust_prices(prices, actions)
+    _adjusted_prices[key] = (digest, prices, adjusted, actions)
+    return adjusted.copy()
+
+def _listed_market_cap(Market_Cap, Stocks):
+    """
+    Keeps the market caps of the stocks with prices.
+    """
+    return Market_Cap[[stock for stock in Stocks.columns if stock in Market_Cap.columns]]
+
+def _listed_prices(Stocks, Market_Cap):
+    """
+    Keeps the index and the prices of the stocks with market caps.
+    """
+    return Stocks[["Index"] + [stock for stock in Stocks.columns if stock in Market_Cap.columns]]
+
+def _monthly_returns(Stocks):
+    """
+    The monthly stock returns, from the daily prices.
+    """
+    return ret_d2m(Stocks.pct_change().shift(-1).iloc[:-1, 1:])
+
+def _sector_returns(Sectors_M):
+    """
+    The monthly sector returns, from the monthly sector indices.
+    """
+    return Sectors_M.pct_change().shift(-1).iloc[:-1, 1:]
+
+def _constituent_returns(weighting, returns_M, Market_Cap_M):
+    """
+    The monthly industry returns built from the sector constituents of the current market.
+    """
+    return industry_returns(returns_M, Market_Cap_M, weighting = weighting)
+
+def _item(i, value):
+    """
+    Picks one part of a stage result, e.g. of the Farvardin split.
+    """
+    return value[i]
+
+def _collect(names, float32, *values):
+    """
+    Gathers the shared panels into the inputs dictionary of the batch steps.
+    """
+    inputs = dict(zip(names, values))
+    if float32:
+        inputs = compact_panels(inputs, float32 = True)[0]
+    return inputs
+
+def _plan_step(function, args, inputs, *deps):
+    """
+    Runs a batch_plan step as a pipeline stage.
+    """
+    return function(inputs, *args, *deps)
+
+input_stages = ["Stocks", "Market_Cap_M", "returns_M", "r_sec", "high_M",
+                "r_farvardin", "r_farvardin_excluded", "mc_farvardin", "mc_farvardin_excluded", "r_sec_farvardin", "r_sec_farvardin_excluded",
+                "mc_ragged", "mc_farvardin_excluded_ragged"]
+ragged_panels = [("Market_Cap_M", "mc_ragged"), ("mc_farvardin_excluded", "mc_farvardin_excluded_ragged")]
+
+def market_pipeline(data, J = 6, K = 6, spill = None, workers = 4):
+    """
+    Declares the whole study as a lazy pipeline: read_data, d2m, ret_d2m, year_high and Farvardin once each, then every table step of batch_plan.
+
+    Parameters:
+    data (dict): The "data" section of the batch configuration (see read_config); its "market" is the market the stages run in.
+    J (int): The ranking period of Tables I to IV.
+    K (int): The holding period of Tables I to IV.
+    spill (str, optional): A directory to keep the intermediate results in instead of memory.
+    workers (int): The number of threads running independent stages.
+
+    Returns:
+    Pipeline: The graph; e.g. market_pipeline(data).get("Table_I") reads and derives only what Table I needs.
+    """
+    pipeline = Pipeline(spill, workers, get_market(data.get("market")))
+    pipeline.add("Stocks_daily", _read_prices, args = (data,))
+    pipeline.add("Sectors", _read_panel, args = (data, "sectors"))
+    pipeline.add("Market_Cap_daily", _read_panel, args = (data, "market_cap"))
+    pipeline.add("Market_Cap", _listed_market_cap, ["Market_Cap_daily", "Stocks_daily"])
+    pipeline.add("Stocks", _listed_prices, ["Stocks_daily", "Market_Cap"])
+    pipeline.add("Sectors_M", d2m, ["Sectors"])
+    pipeline.add("Market_Cap_M", d2m, ["Market_Cap"])
+    pipeline.add("returns_M", _monthly_returns, ["Stocks"])
+    if data.get("industries"):
+        pipeline.add("r_sec", _constituent_returns, ["returns_M", "Market_Cap_M"], (data["industries"],))
+    else:
+        pipeline.add("r_sec", _sector_returns, ["Sectors_M"])
+    pipeline.add("high_M", monthly_high, ["Stocks"])
+    for panel, prefix in [("returns_M", "r"), ("Market_Cap_M", "mc"), ("r_sec", "r_sec")]:
+        pipeline.add(prefix + "_split", Farvardin, [panel])
+        pipeline.add(prefix + "_farvardin", _item, [prefix + "_split"], (0,))
+        pipeline.add(prefix + "_farvardin_excluded", _item, [prefix + "_split"], (1,))
+    for panel, name in ragged_panels:
+        pipeline.add(name, to_ragged, [panel])
+    pipeline.add("inputs", _collect, input_stages, (input_stages, data.get("float32")))
+    for name, (function, args, deps) in batch_plan(J, K).items():
+        pipeline.add(name, _plan_step, ["inputs"] + list(deps), (function, args))
+    return pipeline
+
+##### Rebalancing Backtests #####
+
+def rebalance_days(index, freq = "W"):
+    """
+    Finds the trading days a portfolio is rebalanced on.
+
+    Parameters:
+    index (pandas Index): The daily dates, JalaliDate or datetime.
+    freq (str or int): "D" for every day, "W" for the first trading day of every Saturday-to-Friday week, "M" for the first trading day of every month, or a number of trading days.
+
+    Returns:
+    numpy array: The positions of the rebalance days in `index`.
+    """
+    if isinstance(freq, (int, np.integer)):
+        return np.arange(0, len(index), freq)
+    if freq == "D":
+        return np.arange(len(index))
+    if freq == "W":
+        # Ordinal 6 (mod 7) is a Saturday, the first day of the Iranian week.
+        key = np.array([((date.todate() if hasattr(date, "todate") else date).toordinal() + 1) // 7 for date in index])
+    elif freq == "M":
+        key = np.array([date.year * 12 + date.month for date in index])
+    else:
+        raise ValueError("freq must be 'D', 'W', 'M' or a number of days, not " + repr(freq))
+    return np.flatnonzero(np.concatenate([[True], np.diff(key) != 0]))
+
+def price_limit_locks(prices, limit = 0.05, tolerance = 0.002):
+    """
+    Marks the stocks that cannot be bought or sold on a day because of the TSE daily price limits or a trading halt.
+
+    A stock closing at its upper limit has a queue of buyers and cannot be bought, one closing at its lower limit cannot be sold, and a halted stock (no price) can be neither.
+
+    Parameters:
+    prices (pandas DataFrame): Daily stock prices.
+    limit (float or array): The daily price limit, e.g. 0.05, or one limit per day as the band has changed over the years.
+    tolerance (float): How close to the limit a move counts as locked, absorbing tick size rounding.
+
+    Returns:
+    tuple: Two boolean numpy arrays of the shape of `prices`, the days a stock cannot be bought and the days it cannot be sold.
+    """
+    values = prices.to_numpy(dtype = float)
+    change = np.vstack([np.full((1, values.shape[1]), np.nan), values[1:] / values[:-1] - 1])
+    limit = np.asarray(limit, dtype = float)
+    if limit.ndim == 1:
+        limit = limit[:, None]
+    halted = np.isnan(values)
+    with np.errstate(invalid = "ignore"):
+        up = change >= limit - tolerance
+        down = change <= -limit + tolerance
+    return up | halted, down | halted
+
+def _limit_constrained(targets, lock_in, lock_out):
+    """
+    Follows the target memberships from one rebalance to the next, leaving out the entries and keeping the exits the locks block.
+
+    Returns:
+    tuple: The boolean memberships actually held after every rebalance and the number of blocked trades.
+    """
+    held = np.zeros(targets.shape, dtype = bool)
+    blocked = np.zeros(len(targets), dtype = int)
+    current = np.zeros(targets.shape[1], dtype = bool)
+    for k in range(len(targets)):
+        stuck_in = targets[k] & ~current & lock_in[k]
+        stuck_out = current & ~targets[k] & lock_out[k]
+        current = (targets[k] & ~stuck_in) | stuck_out
+        held[k] = current
+        blocked[k] = stuck_in.sum() + stuck_out.sum()
+    return held, blocked
+
+def daily_signals(prices, strategy, J = 126, sectors = None, high = None):
+    """
+    Builds the daily ranking signal of the FT, JK or MG strategy for rebalance_backtest.
+
+    Parameters:
+    prices (pandas DataFrame): Daily stock prices, without the market index column.
+    strategy (str): "FT" for the year-high ratio, "JK" for the return over the last J trading days, or "MG" for the J-day return of the stock's sector.
+    J (int): The lookback of "JK" and "MG" in trading days.
+    sectors (pandas DataFrame, optional): Daily sector indices, one column per sector of the current market, needed for "MG".
+    high (pandas DataFrame, optional): The precomputed daily year-high ratios, i.e. year_high(prices), for "FT".
+
+    Returns:
+    tuple: The (days x tickers) signal dataframe and the panel whose quantiles are the breakpoints: all stocks for "FT", the sectors for "MG", and None for "JK", which ranks the liquid stocks among themselves.
+    """
+    if strategy == "FT":
+        signal = year_high(prices) if high is None else high
+        return signal, signal
+    if strategy == "JK":
+        return prices / prices.shift(J) - 1, None
+    if strategy == "MG":
+        industry = sectors / sectors.shift(J) - 1
+        column_ids, members = sector_codes(prices.columns, current_market().sectors)
+        industry = industry.reindex(index = prices.index)
+        values = industry.to_numpy(dtype = float)
+        signal = np.full(prices.shape, np.nan)
+        for i, name in enumerate(industry.columns):
+            listed = np.isin(column_ids, members.get(name, np.zeros(0, dtype = np.int32)))
+            signal = np.fmax(signal, np.where(listed[None, :], values[:, i:i+1], np.nan))
+        return pd.DataFrame(signal, index = prices.index, columns = prices.columns), industry
+    raise ValueError("strategy must be 'FT', 'JK' or 'MG', not " + repr(strategy))
+
+def rebalance_backtest(prices, signal, mc = None, freq = "W", breakpoints = (0.3, 0.7), liquidity = 0.1, reference = None, limit = 0.05, weighting = "equal", cap = 0.9):
+    """
+    Backtests a winner - loser strategy rebalanced daily, weekly or at any other frequency on daily data.
+
+    On every rebalance day the liquid stocks are bucketed on the day's signal at the close, and the top and bottom buckets are held from the next day until the next rebalance.
+    Stocks locked at their price limit or halted cannot enter or leave: the winners skip stocks they cannot buy and keep stocks they cannot sell, the short losers the reverse.
+    Everything is computed for all rebalances at once except the limit bookkeeping, which is one vectorized step per rebalance.
+
+    Parameters:
+    prices (pandas DataFrame): Daily stock prices, without the market index column.
+    signal (pandas DataFrame): The daily signal, e.g. from daily_signals.
+    mc (pandas DataFrame, optional): Daily market capitalization, used for the liquidity filter and for "value" and "capped" weighting.
+    freq (str or int): The rebalance frequency, see rebalance_days.
+    breakpoints (sequence of float): The quantiles separating the buckets.
+    liquidity (float): The market cap quantile below which stocks are left out.
+    reference (pandas DataFrame, optional): The panel whose daily quantiles are the breakpoints, from daily_signals; by default the liquid ranked stocks.
+    limit (float or array, optional): The daily price limit (see price_limit_locks), None for no trading constraints.
+    weighting (str): "equal", "value" or "capped".
+    cap (float): The market cap ceiling quantile of the "capped" weighting.
+
+    Returns:
+    tuple: The daily "Winner", "Loser" and "Winner - Loser" returns, and a dataframe indexed by rebalance day with the number of "Winners" and "Losers" held, the "Blocked" trades and the one-sided "Turnover" of both legs.
+
+    Raises:
+    ValueError: If "value" or "capped" weighting is asked for without `mc`.
+    """
+    if weighting in ("value", "capped") and mc is None:
+        raise ValueError(repr(weighting) + " weighting needs the market capitalization, mc")
+    values = prices.to_numpy(dtype = float)
+    ret = np.vstack([np.full((1, values.shape[1]), np.nan), values[1:] / values[:-1] - 1])
+    days = rebalance_days(prices.index, freq)
+    ranked = signal.reindex(index = prices.index, columns = prices.columns).to_numpy(dtype = float)[days]
+    size = None
+    if mc is not None:
+        size = mc.reindex(index = prices.index, columns = prices.columns).to_numpy(dtype = float)[days]
+        ranked = np.where(quantile_buckets(size, (liquidity,)) == 1, ranked, np.nan)
+    if reference is not None:
+        reference = reference.reindex(index = prices.index).to_numpy(dtype = float)[days]
+    buckets = quantile_buckets(ranked, breakpoints, reference)
+
+    if limit is None:
+        up = down = np.zeros(buckets.shape, dtype = bool)
+    else:
+        up, down = price_limit_locks(prices, limit)
+        up, down = up[days], down[days]
+    winners, w_blocked = _limit_constrained(buckets == len(breakpoints), up, down)
+    losers, l_blocked = _limit_constrained(buckets == 0, down, up)
+    w_weights = weight_matrix(winners, size, weighting, cap)
+    l_weights = weight_matrix(losers, size, weighting, cap)
+
+    period = np.searchsorted(days, np.arange(len(prices)), side = "left") - 1
+    held = np.flatnonzero(period >= 0)
+    w_rets = masked_returns(ret, w_weights, period[held], held)
+    l_rets = masked_returns(ret, l_weights, period[held], held)
+    returns = pd.DataFrame({"Winner": w_rets, "Loser": l_rets, "Winner - Loser": w_rets - l_rets}, index = prices.index[held])
+    index = np.arange(len(days))[:, None]
+    rebalances = pd.DataFrame({"Winners": winners.sum(axis = 1), "Losers": losers.sum(axis = 1), "Blocked": w_blocked + l_blocked,
+                               "Turnover": portfolio_turnover(w_weights, index) + portfolio_turnover(l_weights, index)}, index = prices.index[days])
+    return returns, rebalances
+
+##### Prefetching #####
+
+def _timed_load(loader, data):
+    """
+    Loads one dataset in the background worker and times it.
+    """
+    start = time.perf_counter()
+    inputs = loader(data)
+    return inputs, time.perf_counter() - start
+
+class Prefetcher:
+    """
+    Iterates over datasets, loading the next ones on a background thread or process while the current one is used.
+
+    At most `depth` datasets are loaded ahead of the one being used, so memory stays bounded. The time the loads took and the time
+    the consumer spent waiting for them are recorded, and report() gives the overlap achieved.
+
+    Parameters:
+    datasets (list): The datasets to load, e.g. the "data" sections of several batch configurations.
+    loader (callable, optional): Loads one dataset, load_inputs by default. It must be a module-level function when processes is set.
+    depth (int): The number of datasets loaded ahead.
+    processes (bool): Whether to load in a separate process instead of a thread, for loaders that hold the GIL.
+    """
+
+    def __init__(self, datasets, loader = None, depth = 1, processes = False):
+        self.datasets = list(datasets)
+        self.loader = loader or load_inputs
+        self.depth = max(int(depth), 1)
+        self.processes = processes
+        self.loads = []
+        self.blocked = []
+
+    def __iter__(self):
+        executor = (ProcessPoolExecutor if self.processes else ThreadPoolExecutor)(1)
+        try:
+            pending = []
+            upcoming = iter(self.datasets)
+            # The first dataset plus depth - 1 more; each one taken submits another, so `depth` are ahead while one is in use.
+            for data in upcoming:
+                pending.append((data, executor.submit(_timed_load, self.loader, data)))
+                if len(pending) >= self.depth:
+                    break
+            while pending:
+                data, future = pending.pop(0)
+                start = time.perf_counter()
+                inputs, seconds = future.result()
+                self.blocked.append(time.perf_counter() - start)
+                self.loads.append(seconds)
+                for data_next in upcoming:
+                    pending.append((data_next, executor.submit(_timed_load, self.loader, data_next)))
+                    break
+                yield data, inputs
+        finally:
+            executor.shutdown(cancel_futures = True)
+
+    def report(self):
+        """
+        Summarizes the overlap of loading and computing.
+
+        Returns:
+        pandas Series: The seconds spent loading, the seconds the consumer was blocked waiting, the seconds of loading hidden behind computation and their ratio ("Overlap").
+        """
+        load = float(np.sum(self.loads))
+        blocked = float(np.sum(self.blocked))
+        hidden = float(np.sum(np.maximum(np.array(self.loads) - np.array(self.blocked), 0.0))) if self.loads else 0.0
+        return pd.Series({"Datasets": len(self.loads), "Load seconds": load, "Blocked seconds": blocked,
+                          "Hidden seconds": hidden, "Overlap": hidden / load if load > 0 else np.nan})
+
+##### Market-Adjusted Performance #####
+
+def market_returns(Stocks):
+    """
+    Calculates the monthly return of the market index column of the daily prices, aligned with returns_M.
+
+    Parameters:
+    Stocks (pandas DataFrame): Daily prices with the market index in the "Index" column.
+
+    Returns:
+    pandas Series: The monthly market return.
+    """
+    returns = Stocks[["Index"]].pct_change().shift(-1).iloc[:-1, :]
+    return ret_d2m(returns)["Index"]
+
+def size_factor(ret, mc):
+    """
+    Calculates a small minus big factor: the equal-weighted return of the stocks below the median market cap at the start of the month minus that of the stocks above it.
+
+    Parameters:
+    ret (pandas DataFrame): Monthly stock returns.
+    mc (pandas DataFrame): Monthly market capitalization.
+
+    Returns:
+    pandas Series: The monthly "SMB" return.
+    """
+    values = ret.to_numpy(dtype = float)
+    size = mc.reindex(index = ret.index, columns = ret.columns).to_numpy(dtype = float)
+    buckets = quantile_buckets(np.where(np.isnan(values), np.nan, size), (0.5,))
+    months = np.arange(len(ret))
+    small = masked_returns(values, weight_matrix(buckets == 0), months, months)
+    big = masked_returns(values, weight_matrix(buckets == 1), months, months)
+    return pd.Series(small - big, index = ret.index, name = "SMB")
+
+def batched_ols(Y, X, lags = None):
+    """
+    Fits Y[:, s] = X b_s + e_s for every column s in one batched solve, each series on its own non-missing months, with Newey-West (Bartlett kernel) standard errors.
+
+    Parameters:
+    Y (numpy array): A (months x series) matrix of dependent variables, NaN where a series is missing.
+    X (numpy array): A (months x regressors) design matrix, including the constant.
+    lags (int, optional): The Newey-West lag length, by default floor(4 * (months / 100) ** (2 / 9)).
+
+    Returns:
+    tuple: The (series x regressors) coefficients and HAC t-statistics, and the number of observations and R-squared of every series.
+    """
+    Y = np.asarray(Y, dtype = float)
+    X = np.asarray(X, dtype = float)
+    mask = ~np.isnan(Y) & ~np.isnan(X).any(axis = 1)[:, None]
+    Y0 = np.where(mask, Y, 0.0)
+    X0 = np.where(np.isnan(X), 0.0, X)
+    XtX = np.einsum("ts,tk,tl->skl", mask.astype(float), X0, X0)
+    inverse = np.linalg.pinv(XtX)
+    coefs = np.einsum("skl,sl->sk", inverse, Y0.T @ X0)
+    residuals = np.where(mask, Y0 - X0 @ coefs.T, 0.0)
+    if lags is None:
+        lags = int(np.floor(4 * (len(Y) / 100) ** (2 / 9)))
+    scores = X0[:, None, :] * residuals[:, :, None]
+    meat = np.einsum("tsk,tsl->skl", scores, scores)
+    for lag in range(1, lags + 1):
+        gamma = np.einsum("tsk,tsl->skl", scores[lag:], scores[:-lag])
+        meat += (1 - lag / (lags + 1)) * (gamma + gamma.transpose(0, 2, 1))
+    cov = inverse @ meat @ inverse
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        tstats = coefs / np.sqrt(np.einsum("skk->sk", cov))
+        observations = mask.sum(axis = 0)
+        means = Y0.sum(axis = 0) / observations
+        total = (np.where(mask, Y0 - means, 0.0) ** 2).sum(axis = 0)
+        r2 = 1 - (residuals ** 2).sum(axis = 0) / total
+    return coefs, tstats, observations, r2
+
+def market_adjusted(spreads, market, factors = None, lags = None):
+    """
+    Regresses many spread series on the market return, and optionally size or other factors, in one batched least-squares solve.
+
+    Parameters:
+    spreads (dict or pandas DataFrame): Monthly spread returns by name, e.g. from strategy_spreads, to which double-sort spreads can be added.
+    market (pandas Series): The monthly market return, e.g. from market_returns.
+    factors (pandas DataFrame or Series, optional): Further monthly factors, e.g. size_factor.
+    lags (int, optional): The Newey-West lag length (see batched_ols).
+
+    Returns:
+    pandas DataFrame: One row per spread with the "Alpha", "Beta" and factor loadings, each followed by its HAC t-statistic, the number of "Observations" and the "R2".
+    """
+    spreads = pd.DataFrame(spreads)
+    regressors = pd.DataFrame({"Beta": market})
+    if factors is not None:
+        regressors = regressors.join(pd.DataFrame(factors), how = "outer")
+    regressors = regressors.reindex(spreads.index)
+    X = np.column_stack([np.ones(len(regressors)), regressors.to_numpy(dtype = float)])
+    coefs, tstats, observations, r2 = batched_ols(spreads.to_numpy(dtype = float), X, lags)
+    result = pd.DataFrame(index = spreads.columns)
+    for i, name in enumerate(["Alpha"] + list(regressors.columns)):
+        result[name] = coefs[:, i]
+        result[name + " t"] = tstats[:, i]
+    result["Observations"] = observations
+    result["R2"] = r2
+    return result
+
+def strategy_spreads(inputs, J_list = (3, 6, 9, 12), K_list = (3, 6, 9, 12)):
+    """
+    Collects the monthly winner - loser returns of the JK, MG and FT strategies over a grid of ranking and holding periods.
+
+    Parameters:
+    inputs (dict): The shared panels, from load_inputs.
+    J_list (iterable of int): The ranking periods.
+    K_list (iterable of int): The holding periods.
+
+    Returns:
+    dict: Names such as "JK 6/6" mapped to monthly spread returns.
+    """
+    Stocks, r_sec, returns_M, Market_Cap_M = inputs["Stocks"], inputs["r_sec"], inputs["returns_M"], inputs["Market_Cap_M"]
+    spreads = {}
+    for J in J_list:
+        for K in K_list:
+            cell = " " + str(J) + "/" + str(K)
+            spreads["JK" + cell] = JK_Returns(returns_M, Market_Cap_M, J, K)["Winner - Loser"]
+            spreads["MG" + cell] = MG_Returns(r_sec, returns_M, J, K)["Winner - Loser"]
+            spreads["FT" + cell] = FT_Returns(Stocks, returns_M, Market_Cap_M, J, K, high = inputs.get("high_M"), ragged = inputs.get("mc_ragged"))["Winner - Loser"]
+    return spreads
+
+##### Recursive Fama-MacBeth #####
+
+def fama_macbeth_design(df, ind_ret, ret, mc, J, high = None, rows = None):
+    """
+    Builds the first-pass regressors of Fama_MacBeth for every ticker and month at once, from the membership matrices instead of one Ranker call per ticker and month.
+
+    The regressors of month t are the size and return of month t, the JH/JL, MH/ML and FHH/FHL dummies of the rankings formed in months t-2 to t-J-1
+    (a loser dummy only when the stock is not also a winner, as in Ranker) and the intercept; the dependent variable is the return of month t+1.
+    The year-high ratios are aligned with the returns by date.
+
+    Parameters:
+    df (DataFrame): The daily prices, used for the year-high ratios when `high` is not given.
+    ind_ret (DataFrame): The monthly industry returns.
+    ret (DataFrame): The monthly stock returns.
+    mc (DataFrame): The monthly market capitalization.
+    J (int): The ranking period and number of lagged rankings.
+    high (DataFrame, optional): The precomputed monthly year-high ratios from monthly_high.
+    rows (iterable of int, optional): The months to build, all of them by default; only the rankings these months use are formed.
+
+    Returns:
+    tuple: The (months x tickers x regressors) design array, the (months x tickers) next-month returns and the regressor names.
+    """
+    if high is None:
+        high = monthly_high(df)
+    high = high.reindex(index = ret.index)
+    ind_ret = ind_ret.reindex(index = ret.index)
+    rows = np.arange(len(ret)) if rows is None else np.asarray(list(rows), dtype = int)
+    formations = np.unique(np.concatenate([rows - j for j in range(2, J+2)] + [np.zeros(0, dtype = int)]))
+    formations = formations[formations >= 0]
+    members = {"J": JK_Members(ret, mc, J, formations), "M": MG_Members(ind_ret, ret, J, formations),
+               "FH": FT_Members(high, mc, high.quantile(0.7, axis = 1), high.quantile(0.3, axis = 1), formations, ret.columns)}
+    dummies = {}
+    for prefix, (winners, losers) in members.items():
+        for j in range(2, J+2):
+            formed = rows - j
+            ranked = formed >= 0
+            dummies[prefix + "H" + str(j)] = np.zeros((len(rows), ret.shape[1]))
+            dummies[prefix + "L" + str(j)] = np.zeros((len(rows), ret.shape[1]))
+            dummies[prefix + "H" + str(j)][ranked] = winners[formed[ranked]]
+            dummies[prefix + "L" + str(j)][ranked] = losers[formed[ranked]] & ~winners[formed[ranked]]
+    labels = [i + str(j) for i in ["JH", "JL", "MH", "ML", "FHH", "FHL"] for j in range(2, J+2)]
+    values = ret.to_numpy(dtype = float)
+    size = mc.reindex(index = ret.index, columns = ret.columns).to_numpy(dtype = float)
+    following = np.vstack([values[1:], np.full((1, values.shape[1]), np.nan)])
+    X = np.stack([size[rows], values[rows]] + [dummies[label] for label in labels] + [np.ones((len(rows), ret.shape[1]))], axis = 2)
+    return X, following[rows], ["size", "R_t-1"] + labels + ["Intercept"]
+
+def _recursive_observe(state, x, target, valid, sign):
+    """
+    Adds (sign 1) or removes (sign -1) one month of first-pass observations from a recursive Fama-MacBeth state with a Sherman-Morrison step.
+
+    Parameters:
+    state (dict): The state from recursive_fama_macbeth.
+    x (numpy array): The (tickers x regressors) standardized regressors, zero where not valid.
+    target (numpy array): The next-month returns of the tickers, zero where not valid.
+    valid (numpy array): Which tickers have a complete observation.
+    sign (int): 1 to add the month, -1 to remove it.
+    """
+    XtX, Xty, count, P, betas = state["XtX"], state["Xty"], state["count"], state["P"], state["betas"]
+    x, target = x[valid], target[valid]
+    XtX[valid] += sign * np.einsum("nk,nl->nkl", x, x)
+    Xty[valid] += sign * x * target[:, None]
+    count[valid] += sign
+    Px = np.einsum("nkl,nl->nk", P[valid], x)
+    gain = Px / (1 + sign * np.einsum("nk,nk->n", x, Px))[:, None]
+    betas[valid] += sign * gain * (target - np.einsum("nk,nk->n", x, betas[valid]))[:, None]
+    P[valid] -= sign * np.einsum("nk,nl->nkl", gain, Px)
+
+def _recursive_step(state, x, target, returns):
+    """
+    Moves a recursive Fama-MacBeth state forward one month: adds the first-pass observation that ended in the previous month, drops the one
+    leaving a rolling window and runs the cross-section of the month's returns.
+
+    Parameters:
+    state (dict): The state from recursive_fama_macbeth.
+    x (numpy array): The raw (tickers x regressors) regressors of the month two before.
+    target (numpy array): Their next-month returns, those of the previous month.
+    returns (numpy array): The returns of the month.
+
+    Returns:
+    numpy array: The premiums of the month, NaN when too few tickers have betas.
+    """
+    k = len(state["names"])
+    valid = ~np.isnan(x).any(axis = 1) & ~np.isnan(target)
+    x = np.where(valid[:, None], x / state["scale"], 0.0)
+    target = np.where(valid, target, 0.0)
+    _recursive_observe(state, x, target, valid, 1)
+    if state["window"] is not None:
+        state["observations"].append((x, target, valid))
+        if len(state["observations"]) > state["window"]:
+            _recursive_observe(state, *state["observations"].pop(0), -1)
+    state["month"] += 1
+    if state["refresh"] and state["month"] % state["refresh"] == 0:
+        state["P"][:] = np.linalg.inv(state["XtX"] + state["ridge"] * np.eye(k))
+        state["betas"][:] = np.einsum("nkl,nl->nk", state["P"], state["Xty"])
+    premiums = np.full(k, np.nan)
+    live = (state["count"] >= state["min_obs"]) & ~np.isnan(returns)
+    if live.sum() > k:
+        premiums = np.linalg.lstsq(state["betas"][live] / state["scale"], returns[live], rcond = None)[0]
+    return premiums
+
+def _recursive_tstats(premiums, window):
+    """
+    Computes the t-statistics of the mean premiums up to each month, over the last `window` months when given.
+
+    Parameters:
+    premiums (DataFrame): The (months x regressors) monthly premiums.
+    window (int, optional): The number of months of premiums the statistics use; expanding when omitted.
+
+    Returns:
+    DataFrame: The t-statistics, NaN until two months of premiums are available.
+    """
+    present = premiums.notna()
+    sums = premiums.fillna(0.0).cumsum()
+    squares = (premiums.fillna(0.0) ** 2).cumsum()
+    counts = present.cumsum()
+    if window is not None:
+        sums, squares, counts = sums - sums.shift(window, fill_value = 0.0), squares - squares.shift(window, fill_value = 0.0), counts - counts.shift(window, fill_value = 0)
+    means = sums / counts
+    stds = np.sqrt((squares - counts * means ** 2) / (counts - 1))
+    return (means * np.sqrt(counts) / stds).where(counts > 1)
+
+def recursive_fama_macbeth(df, ind_ret, ret, mc, J, window = None, high = None, min_obs = None, refresh = 12, ridge = 1e-8):
+    """
+    Runs Fama_MacBeth month by month with an expanding or rolling first pass, giving the time series of the premiums and their t-statistics.
+
+    Each ticker keeps its X'X and X'y and the inverse of its (ridge-stabilized) normal matrix. When a month arrives, or leaves a rolling window,
+    the betas of all tickers are updated with one vectorized recursive least squares (Sherman-Morrison) step, O(tickers x regressors ** 2) per month;
+    every `refresh` months the inverses are rebuilt from X'X to stop rounding errors from accumulating. The cross-section of month s uses the betas
+    estimated from the observations that ended by month s-1, so there is no look-ahead.
+
+    The returned state holds these running matrices, so update_fama_macbeth can add new months later without sweeping the history again.
+    The regressors are standardized with the scale of this first sample, which the state keeps.
+
+    Parameters:
+    df (DataFrame): The daily prices, used for the year-high ratios when `high` is not given.
+    ind_ret (DataFrame): The monthly industry returns.
+    ret (DataFrame): The monthly stock returns.
+    mc (DataFrame): The monthly market capitalization.
+    J (int): The ranking period and number of lagged rankings.
+    window (int, optional): The number of months of the rolling first pass; expanding when omitted. The t-statistics use the same window of premiums.
+    high (DataFrame, optional): The precomputed monthly year-high ratios from monthly_high.
+    min_obs (int, optional): The number of first-pass observations a ticker needs before it enters the cross-sections, by default one more than the number of regressors.
+    refresh (int): How often, in months, the inverses are rebuilt exactly.
+    ridge (float): The ridge added to the normal matrices of the standardized regressors, keeping never-active dummies at zero.
+
+    Returns:
+    tuple: Two (months x regressors) dataframes, the monthly premiums and the t-statistics of their mean up to each month, and the state.
+    """
+    X, y, names = fama_macbeth_design(df, ind_ret, ret, mc, J, high)
+    T, N, k = X.shape
+    valid = ~np.isnan(X).any(axis = 2) & ~np.isnan(y)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category = RuntimeWarning)
+        scale = np.nanstd(np.where(valid[..., None], X, np.nan), axis = (0, 1))
+    scale = np.where((scale > 0) & np.isfinite(scale), scale, 1.0)
+    scale[-1] = 1.0
+    returns = ret.to_numpy(dtype = float)
+
+    state = {"J": J, "names": names, "columns": ret.columns, "scale": scale, "window": window, "min_obs": min_obs or k + 1, "refresh": refresh, "ridge": ridge,
+             "XtX": np.zeros((N, k, k)), "Xty": np.zeros((N, k)), "count": np.zeros(N, dtype = int), "P": np.repeat(np.eye(k)[None] / ridge, N, axis = 0),
+             "betas": np.zeros((N, k)), "observations": [], "month": 1}
+    premiums = np.full((T, k), np.nan)
+    for s in range(2, T):
+        premiums[s] = _recursive_step(state, X[s-2], y[s-2], returns[s])
+
+    state["premiums"] = pd.DataFrame(premiums, index = ret.index, columns = names)
+    return state["premiums"], _recursive_tstats(state["premiums"], window), state
+
+def update_fama_macbeth(state, df, ind_ret, ret, mc, high = None):
+    """
+    Brings a recursive_fama_macbeth state up to the last month of panels that have grown since, running only the months it has not seen.
+
+    Only the regressors of the new months are built and each month costs one recursive least squares step and one cross-section. The panels
+    must keep the months the state was built on; tickers that are new get an empty first pass and enter the cross-sections once they have min_obs months.
+
+    Parameters:
+    state (dict): The state from recursive_fama_macbeth, updated in place.
+    df (DataFrame): The daily prices, used for the year-high ratios when `high` is not given.
+    ind_ret (DataFrame): The monthly industry returns.
+    ret (DataFrame): The monthly stock returns, including the new months.
+    mc (DataFrame): The monthly market capitalization.
+    high (DataFrame, optional): The precomputed monthly year-high ratios from monthly_high.
+
+    Returns:
+    tuple: The premiums and t-statistics of all months so far.
+    """
+    start = len(state["premiums"])
+    if not ret.index[:start].equals(state["premiums"].index):
+        raise ValueError("The panels do not extend the months of the Fama-MacBeth state")
+    columns = state["columns"].append(ret.columns.difference(state["columns"]))
+    added = len(columns) - len(state["columns"])
+    if added:
+        k = len(state["names"])
+        for key in ["XtX", "Xty", "count", "betas"]:
+            state[key] = np.concatenate([state[key], np.zeros((added,) + state[key].shape[1:], dtype = state[key].dtype)])
+        state["P"] = np.concatenate([state["P"], np.repeat(np.eye(k)[None] / state["ridge"], added, axis = 0)])
+        state["observations"] = [(np.vstack([x, np.zeros((added, k))]), np.concatenate([target, np.zeros(added)]), np.concatenate([valid, np.zeros(added, dtype = bool)]))
+                                 for x, target, valid in state["observations"]]
+        state["columns"] = columns
+    ret, mc = ret.reindex(columns = columns), mc.reindex(columns = columns)
+    if start < len(ret):
+        months = range(max(start, 2), len(ret))
+        X, y, names = fama_macbeth_design(df, ind_ret, ret, mc, state["J"], high, [s - 2 for s in months])
+        returns = ret.to_numpy(dtype = float)
+        premiums = np.full((len(ret) - start, len(names)), np.nan)
+        for i, s in enumerate(months):
+            premiums[s - start] = _recursive_step(state, X[i], y[i], returns[s])
+        state["premiums"] = pd.concat([state["premiums"], pd.DataFrame(premiums, index = ret.index[start:], columns = names)])
+    return state["premiums"], _recursive_tstats(state["premiums"], state["window"])
+
+##### Cross-Sectional Premiums #####
+
+def cross_sectional_premiums(coefs, ret, refresh = 12):
+    """
+    Runs the second pass of Fama-MacBeth, regressing every month's returns on the first-pass coefficients of the tickers with a return that month.
+
+    The Gram matrix of the coefficients of the live tickers is kept from month to month and updated with the rank-one terms of the tickers
+    entering and leaving, so each month only forms X'y and solves one small system; every `refresh` months it is rebuilt from scratch.
+
+    Parameters:
+    coefs (pandas DataFrame): The (tickers x regressors) first-pass coefficients; tickers with a missing coefficient are left out, as sm.OLS(missing="drop") does.
+    ret (pandas DataFrame): The monthly stock returns.
+    refresh (int): How often, in months, the Gram matrix is rebuilt exactly.
+
+    Returns:
+    pandas DataFrame: The (months x regressors) premiums, NaN in months with fewer live tickers than regressors.
+    """
+    B = coefs.reindex(ret.columns).to_numpy(dtype = float)
+    usable = ~np.isnan(B).any(axis = 1)
+    B = np.where(usable[:, None], B, 0.0)
+    values = ret.to_numpy(dtype = float)
+    T, k = len(values), B.shape[1]
+    gram = np.zeros((k, k))
+    previous = np.zeros(len(B), dtype = bool)
+    premiums = np.full((T, k), np.nan)
+    for t in range(T):
+        live = usable & ~np.isnan(values[t])
+        if refresh and t % refresh == 0:
+            gram = B[live].T @ B[live]
+        else:
+            entering, leaving = B[live & ~previous], B[previous & ~live]
+            gram += entering.T @ entering - leaving.T @ leaving
+        previous = live
+        if live.sum() >= k:
+            premiums[t] = np.linalg.lstsq(gram, B[live].T @ values[t, live], rcond = None)[0]
+    return pd.DataFrame(premiums, index = ret.index, columns = coefs.columns)
+
+def check_cross_sections(coefs, ret, refresh = 12):
+    """
+    Checks cross_sectional_premiums against a full least-squares solve of every month.
+
+    Parameters:
+    coefs (pandas DataFrame): The (tickers x regressors) first-pass coefficients.
+    ret (pandas DataFrame): The monthly stock returns.
+    refresh (int): How often the Gram matrix is rebuilt exactly.
+
+    Returns:
+    pandas Series: The largest absolute difference of every premium.
+    """
+    updated = cross_sectional_premiums(coefs, ret, refresh)
+    B = coefs.reindex(ret.columns).to_numpy(dtype = float)
+    usable = ~np.isnan(B).any(axis = 1)
+    values = ret.to_numpy(dtype = float)
+    full = np.full(updated.shape, np.nan)
+    for t in range(len(values)):
+        live = usable & ~np.isnan(values[t])
+        if live.sum() >= B.shape[1]:
+            full[t] = np.linalg.lstsq(B[live], values[t, live], rcond = None)[0]
+    return (updated - full).abs().max()
+
+##### Result Sink #####
+
+class ResultSink:
+    """
+    Writes the numeric outputs of the strategies and regressions (monthly returns, memberships, coefficients and premiums) to Arrow IPC files or
+    year-partitioned Parquet files, one dataset directory per name.
+
+    Every write adds a new part file, so months can be appended without rewriting what is already there, and the Arrow parts can be
+    memory-mapped by consumers without copies (see read_results). pyarrow is only needed when a sink is used.
+
+    Parameters:
+    directory (str): The root directory of the datasets.
+    format (str): "arrow" for Arrow IPC files or "parquet" for Parquet files partitioned by year.
+    """
+
+    def __init__(self, directory, format = "arrow"):
+        if format not in ("arrow", "parquet"):
+            raise ValueError("format must be 'arrow' or 'parquet', not " + repr(format))
+        self.directory = directory
+        self.format = format
+        os.makedirs(directory, exist_ok = True)
+
+    def _manifest_path(self, name):
+        return os.path.join(self.directory, name, "manifest.json")
+
+    def manifest(self, name):
+        """
+        The format, part files, last written key and run settings of a dataset.
+        """
+        path = self._manifest_path(name)
+        if not os.path.exists(path):
+            return {"format": self.format, "parts": [], "last": None, "settings": None}
+        with open(path, encoding = "utf-8") as f:
+            return json.load(f)
+
+    def write(self, name, frame, append = True, settings = None):
+        """
+        Writes a dataframe, its index becoming the first column (as strings, so Jalali dates sort correctly).
+
+        Parameters:
+        name (str): The dataset name.
+        frame (pandas DataFrame): The values, indexed by month or ticker.
+        append (bool): Whether to append only the rows whose index is later than the last one written; otherwise the dataset is replaced.
+        settings (dict, optional): The run settings that are not part of the name (breakpoints, industries, ...), kept in the manifest;
+            a dataset written with other settings is replaced instead of appended to.
+
+        Returns:
+        int: The number of rows written.
+        """
+        import pyarrow as pa
+        manifest = self.manifest(name)
+        if manifest["format"] != self.format:
+            raise ValueError(name + " was written as " + manifest["format"])
+        settings = json.loads(json.dumps(settings))
+        if manifest.get("settings") != settings:
+            for part in manifest["parts"]:
+                os.remove(os.path.join(self.directory, name, part))
+            manifest.update(parts = [], last = None, settings = settings)
+        key = frame.index.name or "Key"
+        table = frame.copy()
+        table.index = table.index.map(str)
+        table.columns = [str(column) for column in table.columns]
+        table = table.rename_axis(key).reset_index()
+        if append and manifest["last"] is not None:
+            table = table[table[key] > manifest["last"]]
+        elif not append:
+            for part in manifest["parts"]:
+                os.remove(os.path.join(self.directory, name, part))
+            manifest["parts"] = []
+        if len(table) == 0:
+            return 0
+        os.makedirs(os.path.join(self.directory, name), exist_ok = True)
+        if self.format == "arrow":
+            part = "part-%05d.arrow" % len(manifest["parts"])
+            arrow = pa.Table.from_pandas(table, preserve_index = False)
+            with pa.OSFile(os.path.join(self.directory, name, part), "wb") as sink:
+                with pa.ipc.new_file(sink, arrow.schema) as writer:
+                    writer.write_table(arrow)
+            manifest["parts"].append(part)
+        else:
+            import pyarrow.parquet as pq
+            groups = table.groupby(table[key].str[:4]) if append else [("all", table)]
+            number = len(manifest["parts"])
+            for year, group in groups:
+                part = os.path.join("Year=" + year, "part-%05d.parquet" % number) if append else "part-%05d.parquet" % number
+                os.makedirs(os.path.dirname(os.path.join(self.directory, name, part)), exist_ok = True)
+                pq.write_table(pa.Table.from_pandas(group, preserve_index = False), os.path.join(self.directory, name, part))
+                manifest["parts"].append(part)
+        manifest["last"] = max(table[key]) if append else None
+        with open(self._manifest_path(name) + ".tmp", "w", encoding = "utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(self._manifest_path(name) + ".tmp", self._manifest_path(name))
+        return len(table)
+
+    def strategy(self, name, returns, buckets, index, columns, settings = None):
+        """
+        Writes the monthly returns of a strategy to "<name>_returns" and its bucket memberships, one row per ranked stock, bucket and formation month, to "<name>_members",
+        both tagged with the run settings.
+        """
+        self.write(name + "_returns", returns, settings = settings)
+        if buckets.ndim == 3:
+            bucket, rows, tickers = np.nonzero(buckets)
+            order = np.argsort(rows, kind = "stable")
+            bucket, rows, tickers = bucket[order].astype(np.int8), rows[order], tickers[order]
+        else:
+            rows, tickers = np.nonzero(buckets >= 0)
+            bucket = buckets[rows, tickers]
+        members = pd.DataFrame({"Ticker": np.asarray(columns)[tickers], "Bucket": bucket}, index = pd.Index(np.asarray(index)[rows], name = "Date"))
+        self.write(name + "_members", members, settings = settings)
+
+    def regression(self, name, coefs, premiums):
+        """
+        Writes the first-pass coefficients of a Fama-MacBeth regression to "<name>_coefs", replacing earlier ones, and its monthly premiums to "<name>_premiums".
+        """
+        self.write(name + "_coefs", coefs.rename_axis("Ticker"), append = False)
+        self.write(name + "_premiums", premiums.rename_axis("Date"))
+
+def read_results(directory, name):
+    """
+    Opens a dataset written by a ResultSink; Arrow parts are memory-mapped, so the table shares the file pages instead of copying them.
+
+    Parameters:
+    directory (str): The root directory of the datasets.
+    name (str): The dataset name.
+
+    Returns:
+    pyarrow Table: All parts of the dataset.
+    """
+    import pyarrow as pa
+    with open(os.path.join(directory, name, "manifest.json"), encoding = "utf-8") as f:
+        manifest = json.load(f)
+    paths = [os.path.join(directory, name, part) for part in manifest["parts"]]
+    if manifest["format"] == "arrow":
+        tables = [pa.ipc.open_file(pa.memory_map(path, "r")).read_all() for path in paths]
+    else:
+        import pyarrow.parquet as pq
+        tables = [pq.read_table(path, memory_map = True) for path in paths]
+    return pa.concat_tables(tables)
+
+def _result_name(strategy, J, K, far = False, weighting = "equal"):
+    """
+    The dataset name of a strategy run, e.g. "JK_6_6" or "FT_6_6_far_value".
+    """
+    return "_".join([strategy, str(J), str(K)] + (["far"] if far else []) + ([weighting] if weighting != "equal" else []))
+
+def _result_settings(breakpoints, spreads, cap, industries = None):
+    """
+    The settings of a strategy run that its dataset name leaves out, stored in the sink manifests; for the industry strategy, a digest of
+    the tickers of each industry of the current market.
+    """
+    settings = {"market": current_market().name, "breakpoints": list(breakpoints), "spreads": [list(pair) for pair in spreads or []], "cap": cap}
+    if industries is not None:
+        sectors = current_market().sectors
+        members = {str(name): sorted(str(ticker) for ticker in sectors.get(name, [])) for name in industries}
+        settings["industries"] = hashlib.sha256(json.dumps(members, sort_keys = True, ensure_ascii = False).encode("utf-8")).hexdigest()
+    return settings
+
+##### Subperiod Stability #####
+
+def _stability(window, min_months, periods):
+    """
+    The mean, t-statistic (as in the strategy tables) and annualized Sharpe ratio of single-column window_stats, NaN for windows with fewer than min_months valid months.
+    """
+    count = window["count"][..., 0]
+    mean = np.where(count >= max(min_months, 1), window["mean"][..., 0], np.nan)
+    std = window["std"][..., 0]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        tstat = np.where(std > 0, mean * np.sqrt(count) / std, np.nan)
+        sharpe = np.where(std > 0, mean / std * np.sqrt(periods), np.nan)
+    return {"mean": mean, "tstat": tstat, "sharpe": sharpe, "months": np.where(np.isnan(mean), 0, count)}
+
+def subperiod_stats(spread, by = "month", min_months = 12, periods = 12):
+    """
+    The mean, t-statistic and Sharpe ratio of a monthly spread over every contiguous subperiod at once, from the running sums of the
+    spread and its squares instead of re-running the strategy on each slice of the panels.
+
+    Parameters:
+    spread (pandas Series): Monthly returns, e.g. the "Winner - Loser" column of FT_Returns.
+    by (str or sequence): "month" for every start/end month pair, "year" for every start/end year pair,
+    or the months at which regimes start, for every run of consecutive regimes (pre/post each change included).
+    min_months (int): Subperiods with fewer valid months are left NaN.
+    periods (int): The number of months per year, to annualize the Sharpe ratio.
+
+    Returns:
+    dict: (start x end) DataFrames "mean", "tstat", "sharpe" and "months", labelled by the first and last period of each subperiod,
+    NaN below the diagonal, ready to be drawn as heatmaps.
+    """
+    stats = rolling_stats(spread.to_frame(), squares = True)
+    index = spread.index
+    if isinstance(by, str) and by == "month":
+        starts = np.arange(len(index))
+    elif isinstance(by, str) and by == "year":
+        years = np.array([date.year for date in index])
+        starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    elif isinstance(by, str):
+        raise ValueError("by must be 'month', 'year' or a sequence of months, not " + repr(by))
+    else:
+        breaks = index.get_indexer(list(by))
+        if (breaks < 0).any():
+            raise KeyError("regime changes not in the spread index: " + str([month for month, row in zip(by, breaks) if row < 0]))
+        starts = np.unique(np.r_[0, breaks])
+    ends = np.r_[starts[1:], len(index)] - 1
+    labels = [index[row].year for row in starts] if isinstance(by, str) and by == "year" else index[starts]
+    columns = labels if isinstance(by, str) and by == "year" else index[ends]
+    result = _stability(window_stats(stats, starts[:, None], ends[None, :]), min_months, periods)
+    return {name: pd.DataFrame(values, index = labels, columns = columns) for name, values in result.items()}
+
+def rolling_stability(spread, window = 36, min_months = None, periods = 12):
+    """
+    The mean, t-statistic and Sharpe ratio of a monthly spread over the rolling window ending in every month.
+
+    Parameters:
+    spread (pandas Series): Monthly returns, e.g. the "Winner - Loser" column of FT_Returns.
+    window (int): The window length in months.
+    min_months (int, optional): The fewest valid months a window needs, the whole window by default.
+    periods (int): The number of months per year, to annualize the Sharpe ratio.
+
+    Returns:
+    pandas DataFrame: The "mean", "tstat", "sharpe" and "months" of every window, indexed by its last month.
+    """
+    stats = rolling_stats(spread.to_frame(), squares = True)
+    t = np.arange(len(spread))
+    result = _stability(window_stats(stats, t - window + 1, t), window if min_months is None else min_months, periods)
+    return pd.DataFrame(result, index = spread.index)
+
+##### Snapshots #####
+
+# Version 2 stores the FT ranking state aligned with the return months (version 1 bundles hold the misaligned one and are rebuilt).
+snapshot_version = 3
+snapshot_panels = ["Stocks", "Market_Cap_M", "returns_M", "r_sec", "high_M"]
+farvardin_panels = [("returns_M", "r"), ("Market_Cap_M", "mc"), ("r_sec", "r_sec")]
+
+def _file_digest(path):
+    """
+    The sha256 of a file, read in 1 MB blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_fingerprints(data):
+    """
+    Fingerprints the source files and settings of a batch configuration, so a snapshot can tell whether it is still current.
+
+    Parameters:
+    data (dict): The "data" section of the batch configuration (see read_config).
+
+    Returns:
+    dict: The size, modification time and sha256 of every csv file, and the settings the panels depend on.
+    """
+    files = {}
+    for key in ("stocks", "sectors", "market_cap", "actions"):
+        if data.get(key):
+            info = os.stat(data[key])
+            files[key] = {"path": os.path.abspath(data[key]), "size": info.st_size, "mtime": info.st_mtime_ns, "sha256": _file_digest(data[key])}
+    settings = {key: data.get(key) for key in ("start", "end", "industries", "float32", "market")}
+    return {"files": files, "settings": {key: str(value) if value is not None else None for key, value in settings.items()}}
+
+def _stale_sources(fingerprints, data):
+    """
+    Lists the files and settings of `data` that differ from the fingerprints; a file whose size and modification time match is not hashed again.
+    """
+    stale = [key for key, value in fingerprints["settings"].items() if value != (str(data.get(key)) if data.get(key) is not None else None)]
+    files = fingerprints["files"]
+    for key in ("stocks", "sectors", "market_cap", "actions"):
+        if bool(data.get(key)) != (key in files):
+            stale.append(key)
+        elif data.get(key):
+            if os.path.abspath(data[key]) != files[key]["path"] or not os.path.exists(data[key]):
+                stale.append(key)
+                continue
+            info = os.stat(data[key])
+            if (info.st_size, info.st_mtime_ns) != (files[key]["size"], files[key]["mtime"]) and _file_digest(data[key]) != files[key]["sha256"]:
+                stale.append(key)
+    return stale
+
+def _labels(index):
+    """
+    Index labels as JSON values, dates as "YYYY-MM-DD".
+    """
+    kind = "values"
+    if len(index) and isinstance(index[0], JalaliDate):
+        kind = "jalali"
+    elif isinstance(index, pd.DatetimeIndex):
+        kind = "datetime"
+    values = index.tolist() if kind == "values" else [str(label)[:10] for label in index]
+    return {"kind": kind, "name": index.name, "values": values}
+
+def _index(labels):
+    """
+    Rebuilds an index stored by _labels.
+    """
+    values = labels["values"]
+    if labels["kind"] == "jalali":
+        values = [JalaliDate(*[int(x) for x in value.split("-")]) for value in values]
+    elif labels["kind"] == "datetime":
+        return pd.DatetimeIndex(values, name = labels["name"])
+    return pd.Index(values, name = labels["name"], dtype = object if labels["kind"] == "jalali" else None)
+
+def save_snapshot(path, data, inputs = None, J_list = (6,)):
+    """
+    Saves the derived state of a configuration (the shared panels, their Farvardin masks, the year-high ratios, the rankings of ranking_state
+    and the sectors of the current market) as a versioned bundle of .npy arrays and a JSON manifest, fingerprinted against the source files.
+
+    The bundle is written next to `path` and moved into place when complete, so readers never see a partial one.
+
+    Parameters:
+    path (str): The bundle directory.
+    data (dict): The "data" section of the batch configuration (see read_config).
+    inputs (dict, optional): The already loaded panels of `data`, built with load_inputs when omitted.
+    J_list (iterable of int): The ranking periods to precompute.
+
+    Returns:
+    dict: The manifest of the bundle.
+    """
+    if inputs is None:
+        inputs = load_inputs(data)
+    state = ranking_state(inputs, J_list)
+    arrays = {}
+    manifest = {"version": snapshot_version, "fingerprints": source_fingerprints(data), "J": list(J_list),
+                "market": current_market().name, "calendar": current_market().calendar, "sectors": current_market().sectors, "panels": {}, "farvardin": {}, "rankings": []}
+    for name in snapshot_panels:
+        panel = inputs[name]
+        arrays[name] = panel.to_numpy(dtype = np.float32 if data.get("float32") else np.float64)
+        manifest["panels"][name] = {"index": _labels(panel.index), "columns": _labels(panel.columns)}
+    for name, prefix in farvardin_panels:
+        arrays[prefix + "_farvardin"] = np.array([date.month == 1 for date in inputs[name].index], dtype = bool)
+        manifest["farvardin"][prefix] = name
+    for (strategy, J), (winners, losers) in state["members"].items():
+        key = strategy + "_" + str(J)
+        arrays[key + "_winners"], arrays[key + "_losers"] = winners, losers
+        arrays[key + "_signals"] = state["signals"][(strategy, J)]
+        manifest["rankings"].append([strategy, J])
+    temp = path.rstrip(os.sep) + ".tmp"
+    if os.path.exists(temp):
+        shutil.rmtree(temp)
+    os.makedirs(temp)
+    for name, values in arrays.items():
+        np.save(os.path.join(temp, name + ".npy"), np.ascontiguousarray(values))
+    with open(os.path.join(temp, "manifest.json"), "w", encoding = "utf-8") as f:
+        json.dump(manifest, f, ensure_ascii = False)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(temp, path)
+    return manifest
+
+def load_snapshot(path, data = None, J_list = None):
+    """
+    Opens a bundle written by save_snapshot. The arrays are memory-mapped copy-on-write, so opening is immediate and the panels can still be modified
+    without touching the files. The stored sector mapping becomes that of the bundle's market.
+
+    Parameters:
+    path (str): The bundle directory.
+    data (dict, optional): The "data" section of the batch configuration to validate the bundle against.
+    J_list (iterable of int, optional): The ranking periods the bundle must hold.
+
+    Returns:
+    tuple: The inputs dictionary, as load_inputs builds it, and the ranking state, as ranking_state builds it.
+
+    Raises:
+    ValueError: If the bundle was written by another snapshot version, lacks a ranking period or its source files or settings have changed.
+    """
+    with open(os.path.join(path, "manifest.json"), encoding = "utf-8") as f:
+        manifest = json.load(f)
+    if manifest["version"] != snapshot_version:
+        raise ValueError("snapshot version " + str(manifest["version"]) + " is not " + str(snapshot_version) + ": " + path)
+    if data is not None:
+        stale = _stale_sources(manifest["fingerprints"], data)
+        if stale:
+            raise ValueError("snapshot " + path + " is stale, changed: " + ", ".join(stale))
+    missing = [J for J in J_list or [] if J not in manifest["J"]]
+    if missing:
+        raise ValueError("snapshot " + path + " has no rankings for J = " + ", ".join(str(J) for J in missing))
+    array = lambda name: np.load(os.path.join(path, name + ".npy"), mmap_mode = "c")
+    inputs = {}
+    for name, labels in manifest["panels"].items():
+        inputs[name] = pd.DataFrame(array(name), index = _index(labels["index"]), columns = _index(labels["columns"]), copy = False)
+    for prefix, name in manifest["farvardin"].items():
+        farvardin = np.asarray(array(prefix + "_farvardin"))
+        inputs[prefix + "_farvardin"] = inputs[name].loc[farvardin, :]
+        inputs[prefix + "_farvardin_excluded"] = inputs[name].loc[~farvardin, :]
+    for panel, name in ragged_panels:
+        inputs[name] = to_ragged(inputs[panel])
+    ret = inputs["returns_M"]
+    state = {"months": {month_key(date): row for row, date in enumerate(ret.index)}, "columns": ret.columns, "members": {}, "signals": {}}
+    for strategy, J in manifest["rankings"]:
+        key = strategy + "_" + str(J)
+        state["members"][(strategy, J)] = (array(key + "_winners"), array(key + "_losers"))
+        state["signals"][(strategy, J)] = array(key + "_signals")
+    name = manifest.get("market", "TSE")
+    markets.setdefault(name, Market(name, manifest.get("calendar", "jalali"))).sectors = manifest["sectors"]
+    return inputs, state
+
+def warm_start(path, data, J_list = (6,)):
+    """
+    Loads the snapshot of a configuration, rebuilding and saving it first when it is missing, from another version or stale.
+
+    Parameters:
+    path (str): The bundle directory.
+    data (dict): The "data" section of the batch configuration (see read_config).
+    J_list (iterable of int): The ranking periods a rebuilt snapshot precomputes.
+
+    Returns:
+    tuple: The inputs dictionary and the ranking state, as load_snapshot returns them.
+    """
+    try:
+        return load_snapshot(path, data, J_list)
+    except (FileNotFoundError, ValueError, KeyError) as error:
+        logger.info("Rebuilding snapshot: %s", error)
+    save_snapshot(path, data, J_list = J_list)
+    return load_snapshot(path)
+
+##### Batch Runs #####
+
+def read_config(name):
+    """
+    Reads a batch run configuration from a YAML or JSON file.
+
+    Keys:
+    data (dict): "stocks", "sectors" and "market_cap" csv files, the "start" and "end" dates ("YYYY-MM-DD") in the market calendar, the "market" (a name of `markets` or the Market arguments, see get_market; by default the current market), an optional "actions" csv file of corporate actions (see read_actions), "float32": true for the compact panel mode and "industries": "equal" or "value" to build the MG industry returns from the constituents of the market's sectors (see industry_returns) instead of the sectors csv.
+    tables (list of str): The tables to build, by default those of default_tables (see batch_plan).
+    output (str): The directory the finished tables are written to as excel files, by default "results".
+    checkpoint (str): The directory finished steps are checkpointed to, by default "<output>/checkpoints".
+    workers (int): The number of worker processes, by default all cores.
+    J, K (int): The ranking and holding periods of Tables I to IV, by default 6 and 6.
+    name (str): The label of the run in merged multi-market tables, by default the market name (see merge_markets).
+    snapshot (str): A snapshot bundle directory (see save_snapshot) to load the panels from, rebuilt when missing or stale.
+
+    Parameters:
+    name (str): The path of the configuration file.
+
+    Returns:
+    dict: The configuration.
+    """
+    with open(name, encoding = "utf-8") as f:
+        if name.endswith((".yaml", ".yml")):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def load_inputs(data):
+    """
+    Reads the csv files and builds the monthly panels shared by every table, the same way MyCode.ipynb does, through the "inputs" stage of market_pipeline.
+
+    Parameters:
+    data (dict): The "data" section of the batch configuration.
+
+    Returns:
+    dict: The daily prices ("Stocks"), the monthly panels with their Farvardin splits, the monthly year-high ratios ("high_M") and the ragged
+    market caps of the FT liquidity filter ("mc_ragged" and "mc_farvardin_excluded_ragged").
+    """
+    return market_pipeline(data).get("inputs")
+
+def _strategy_table(inputs, panel, J, K):
+    """
+    Builds Table I, II_A or II_B.
+    """
+    Stocks, r_sec, returns_M, Market_Cap_M = inputs["Stocks"], inputs["r_sec"], inputs["returns_M"], inputs["Market_Cap_M"]
+    high, ragged = inputs.get("high_M"), inputs.get("mc_ragged")
+    if panel == "I":
+        return pd.concat([JK_Strategy(returns_M, Market_Cap_M, J, K), MG_Strategy(r_sec, returns_M, J, K), FT_Strategy(Stocks, returns_M, Market_Cap_M, J, K, high = high, ragged = ragged)])
+    if panel == "II_A":
+        r_ex, mc_ex, r_sec_ex = inputs["r_farvardin_excluded"], inputs["mc_farvardin_excluded"], inputs["r_sec_farvardin_excluded"]
+        return pd.concat([JK_Strategy(r_ex, mc_ex, J, K), MG_Strategy(r_sec_ex, r_ex, J, K), FT_Strategy(Stocks, r_ex, mc_ex, J, K, t2 = True, high = high, ragged = inputs.get("mc_farvardin_excluded_ragged"))])
+    return pd.concat([JK_Strategy(returns_M, Market_Cap_M, J, K, far = True), MG_Strategy(r_sec, returns_M, J, K, far = True), FT_Strategy(Stocks, returns_M, Market_Cap_M, J, K, t2 = False, far = True, high = high, ragged = ragged)])
+
+def _mix_table(inputs, name, J, K):
+    """
+    Builds one of the double-sort Tables III and IV.
+    """
+    Stocks, r_sec, returns_M, Market_Cap_M = inputs["Stocks"], inputs["r_sec"], inputs["returns_M"], inputs["Market_Cap_M"]
+    if name == "JT_FT":
+        return JT_FT(Stocks, returns_M, Market_Cap_M, J, K, inputs.get("high_M"))
+    if name == "FT_JT":
+        return FT_JT(Stocks, returns_M, Market_Cap_M, J, K, inputs.get("high_M"))
+    if name == "MG_FT":
+        return MG_FT(Stocks, r_sec, returns_M, Market_Cap_M, J, K, inputs.get("high_M"))
+    return FT_MG(Stocks, r_sec, returns_M, Market_Cap_M, J, K, inputs.get("high_M"))
+
+def _fama_macbeth_step(inputs, J, excluded, lag = None):
+    """
+    Runs one Fama-MacBeth regression of Tables V, VI and IX.
+    """
+    if excluded:
+        args = (inputs["Stocks"], inputs["r_sec_farvardin_excluded"], inputs["r_farvardin_excluded"], inputs["mc_farvardin_excluded"], J)
+    else:
+        args = (inputs["Stocks"], inputs["r_sec"], inputs["returns_M"], inputs["Market_Cap_M"], J)
+    if lag is None:
+        return Fama_MacBeth(*args, t2 = excluded, high = inputs.get("high_M"))
+    return Fama_MacBeth_lag(*args, lag, t2 = excluded, high = inputs.get("high_M"))
+
+def _alpha_table(inputs):
+    """
+    Builds the table of market- and size-adjusted spreads over the strategy grid.
+    """
+    market = market_returns(inputs["Stocks"])
+    return market_adjusted(strategy_spreads(inputs), market, size_factor(inputs["returns_M"], inputs["Market_Cap_M"]))
+
+def _concat_step(inputs, *frames):
+    """
+    Stacks finished steps into one table.
+    """
+    return pd.concat(frames)
+
+def batch_plan(J = 6, K = 6):
+    """
+    Lists every step of the batch run with the steps it depends on.
+
+    The Fama-MacBeth regressions are separate steps so that tables repeating a regression (V, VI and IX) share one fit.
+
+    Parameters:
+    J (int): The ranking period of Tables I to IV.
+    K (int): The holding period of Tables I to IV.
+
+    Returns:
+    dict: Step names mapped to (function, arguments, dependencies); the step runs function(inputs, *arguments, *dependency results).
+    """
+    plan = {}
+    for panel in ["I", "II_A", "II_B"]:
+        plan["Table_" + panel] = (_strategy_table, (panel, J, K), [])
+    for table, name in [("Table_III_A", "JT_FT"), ("Table_III_B", "FT_JT"), ("Table_IV_A", "MG_FT"), ("Table_IV_B", "FT_MG")]:
+        plan[table] = (_mix_table, (name, J, K), [])
+    for j in [6, 12]:
+        plan["FM_6" + str(j) + "_FI"] = (_fama_macbeth_step, (j, False), [])
+        plan["FM_6" + str(j) + "_FE"] = (_fama_macbeth_step, (j, True), [])
+    for lag in [12, 24, 36, 48]:
+        plan["FM_" + str(lag) + "_FI"] = (_fama_macbeth_step, (6, False, lag), [])
+        plan["FM_" + str(lag) + "_FE"] = (_fama_macbeth_step, (6, True, lag), [])
+    regressions = ["FM_66_FI", "FM_66_FE", "FM_66_FI", "FM_66_FE", "FM_612_FI", "FM_612_FE", "FM_612_FI", "FM_612_FE"]
+    plan["Table_V"] = (_concat_step, (), regressions)
+    plan["Table_VI"] = (_concat_step, (), ["FM_12_FI", "FM_12_FE", "FM_24_FI", "FM_24_FE", "FM_36_FI", "FM_36_FE", "FM_48_FI", "FM_48_FE", "FM_612_FE"])
+    plan["Table_IX"] = (_concat_step, (), regressions)
+    plan["Table_Alpha"] = (_alpha_table, (), [])
+    return plan
+
+default_tables = ["Table_I", "Table_II_A", "Table_II_B", "Table_III_A", "Table_III_B", "Table_IV_A", "Table_IV_B", "Table_V", "Table_VI", "Table_IX", "Table_Alpha"]
+
+_batch_inputs = None
+
+def _set_batch_inputs(inputs, market = None):
+    """
+    Hands the shared inputs and the market to a worker process once, instead of with every step.
+    """
+    global _batch_inputs
+    _batch_inputs = inputs
+    if market is not None:
+        use_market(market)
+
+def _run_step(function, args):
+    """
+    Runs one step in a worker process.
+    """
+    return function(_batch_inputs, *args)
+
+def _checkpoint(directory, name, result):
+    """
+    Writes a finished step atomically, so a crash never leaves a partial checkpoint behind.
+    """
+    path = os.path.join(directory, name + ".pkl")
+    pd.to_pickle(result, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def _saved_inputs(checkpoints, data):
+    """
+    Whether the inputs checkpoint was built from the current source files and settings of `data` (see source_fingerprints).
+    """
+    path = os.path.join(checkpoints, "inputs.json")
+    if not os.path.exists(os.path.join(checkpoints, "inputs.pkl")) or not os.path.exists(path):
+        return False
+    with open(path, encoding = "utf-8") as f:
+        return not _stale_sources(json.load(f), data)
+
+def _checkpoint_inputs(checkpoints, data, inputs):
+    """
+    Checkpoints the inputs with the fingerprints of the sources they were built from.
+    """
+    _checkpoint(checkpoints, "inputs", inputs)
+    with open(os.path.join(checkpoints, "inputs.json.tmp"), "w", encoding = "utf-8") as f:
+        json.dump(source_fingerprints(data), f)
+    os.replace(os.path.join(checkpoints, "inputs.json.tmp"), os.path.join(checkpoints, "inputs.json"))
+
+def _checkpoint_dir(config):
+    """
+    The checkpoint directory of a batch configuration.
+    """
+    return config.get("checkpoint", os.path.join(config.get("output", "results"), "checkpoints"))
+
+def run_batch(config, workers = None, fresh = False, inputs = None):
+    """
+    Builds the requested tables, running independent steps concurrently and resuming from the checkpoints of an earlier run.
+
+    A step that fails is logged and the steps depending on it are skipped, while the rest of the batch carries on. The inputs
+    checkpoint is only reused while the source files and settings are unchanged.
+
+    Parameters:
+    config (dict): The batch configuration (see read_config).
+    workers (int, optional): The number of worker processes, overriding the configuration.
+    fresh (bool): Whether to ignore existing checkpoints.
+    inputs (dict, optional): The already loaded panels of config["data"], e.g. from a Prefetcher.
+
+    Returns:
+    dict: The names of the requested tables that were built mapped to their dataframes.
+    """
+    plan = batch_plan(config.get("J", 6), config.get("K", 6))
+    tables = config.get("tables") or default_tables
+    output = config.get("output", "results")
+    checkpoints = _checkpoint_dir(config)
+    workers = workers or config.get("workers")
+    market = get_market(config["data"].get("market"))
+    os.makedirs(checkpoints, exist_ok = True)
+
+    done = {}
+    pending = []
+    stack = list(tables)
+    while stack:
+        name = stack.pop()
+        if name in done or name in pending:
+            continue
+        path = os.path.join(checkpoints, name + ".pkl")
+        if not fresh and os.path.exists(path):
+            done[name] = pd.read_pickle(path)
+            logger.info("Resumed %s from %s", name, path)
+        else:
+            pending.append(name)
+            stack.extend(plan[name][2])
+
+    failed = {}
+    if pending:
+        with market:
+            if inputs is not None:
+                _checkpoint_inputs(checkpoints, config["data"], inputs)
+            elif not fresh and _saved_inputs(checkpoints, config["data"]):
+                inputs = pd.read_pickle(os.path.join(checkpoints, "inputs.pkl"))
+            else:
+                if config.get("snapshot"):
+                    inputs = warm_start(config["snapshot"], config["data"])[0]
+                else:
+                    inputs = load_inputs(config["data"])
+                _checkpoint_inputs(checkpoints, config["data"], inputs)
+        # Scrape the sectors here, once, instead of in every worker process.
+        if market.url is not None:
+            market.sectors
+        with ProcessPoolExecutor(workers, initializer = _set_batch_inputs, initargs = (inputs, market)) as executor:
+            running = {}
+            while pending or running:
+                for name in [name for name in pending if any(dep in failed for dep in plan[name][2])]:
+                    failed[name] = "skipped, it needs " + ", ".join(dict.fromkeys(dep for dep in plan[name][2] if dep in failed))
+                    logger.error("Skipped %s: %s", name, failed[name])
+                    pending.remove(name)
+                for name in [name for name in pending if all(dep in done for dep in plan[name][2])]:
+                    function, args, deps = plan[name]
+                    running[executor.submit(_run_step, function, args + tuple(done[dep] for dep in deps))] = name
+                    pending.remove(name)
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when = FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        done[name] = future.result()
+                    except Exception as error:
+                        failed[name] = repr(error)
+                        logger.error("Failed %s: %r", name, error)
+                        continue
+                    _checkpoint(checkpoints, name, done[name])
+                    logger.info("Finished %s", name)
+
+    built = [name for name in tables if name in done]
+    os.makedirs(output, exist_ok = True)
+    for name in built:
+        done[name].to_excel(os.path.join(output, name + ".xlsx"))
+    if failed:
+        logger.error("%d of %d steps failed; built %s", len(failed), len(failed) + len(done), ", ".join(built) or "no tables")
+    return {name: done[name] for name in built}
+
+def run_batches(configs, workers = None, fresh = False, depth = 1, processes = False):
+    """
+    Runs several batch configurations one after another, loading the data of the next ones while the current one computes.
+
+    Parameters:
+    configs (list of dict): The batch configurations, e.g. one per sample period or market.
+    workers (int, optional): The number of worker processes of each run.
+    fresh (bool): Whether to ignore existing checkpoints.
+    depth (int): The number of datasets loaded ahead.
+    processes (bool): Whether to load in a separate process instead of a thread.
+
+    Returns:
+    tuple: The tables of every configuration and the overlap report of the Prefetcher.
+    """
+    prefetcher = Prefetcher([config["data"] for config in configs], depth = depth, processes = processes)
+    results = [run_batch(config, workers, fresh, inputs) for config, (data, inputs) in zip(configs, prefetcher)]
+    report = prefetcher.report()
+    logger.info("Loaded %d datasets in %.1f s, blocked %.1f s, overlap %.1f %%", report["Datasets"], report["Load seconds"], report["Blocked seconds"], report["Overlap"] * 100)
+    return results, report
+
+def _market_label(config):
+    """
+    The label of a configuration in merged multi-market tables.
+    """
+    spec = config["data"].get("market")
+    if config.get("name"):
+        return config["name"]
+    if isinstance(spec, dict):
+        return spec["name"]
+    return spec or default_market
+
+def market_shards(configs, nodes):
+    """
+    Deals the configurations out to `nodes` shards in turn, e.g. one shard per machine.
+
+    Returns:
+    list of list: The positions in `configs` of every shard.
+    """
+    return [list(range(node, len(configs), nodes)) for node in range(nodes)]
+
+def _run_shard(configs, workers, fresh):
+    """
+    Runs the configurations of one shard one after another, in a worker process of its own.
+    """
+    for config in configs:
+        run_batch(config, workers, fresh)
+    return [_market_label(config) for config in configs]
+
+def merge_markets(configs, output = None):
+    """
+    Stacks the tables of several markets into comparable tables, one row block per market, from the checkpoints their runs left behind.
+    A table a market has not built (because one of its steps failed) is logged and left out of that market's rows.
+
+    Parameters:
+    configs (list of dict): The batch configurations of the markets (see read_config).
+    output (str, optional): The directory the merged tables are written to as excel files.
+
+    Returns:
+    dict: The table names mapped to dataframes with a "Market" level in front of their rows.
+    """
+    tables = {}
+    for config in configs:
+        for name in config.get("tables") or default_tables:
+            path = os.path.join(_checkpoint_dir(config), name + ".pkl")
+            if not os.path.exists(path):
+                logger.warning("%s has not built %s: %s", _market_label(config), name, path)
+                continue
+            tables.setdefault(name, {})[_market_label(config)] = pd.read_pickle(path)
+    merged = {name: pd.concat(frames, names = ["Market"]) for name, frames in tables.items()}
+    if output:
+        os.makedirs(output, exist_ok = True)
+        for name, table in merged.items():
+            table.to_excel(os.path.join(output, name + ".xlsx"))
+    return merged
+
+def run_markets(configs, nodes = None, workers = None, fresh = False, shard = None, output = None):
+    """
+    Runs the same study on several markets, every shard of markets in a worker process of its own, and merges their tables.
+
+    Each market keeps its own calendar, sectors and checkpoints, so the shards can also run on different machines sharing a file system:
+    run shard i of n on machine i with `shard`, then merge_markets once all have finished.
+
+    Parameters:
+    configs (list of dict): One batch configuration per market (see read_config), each with its own checkpoint directory.
+    nodes (int, optional): The number of shards, by default one per configuration.
+    workers (int, optional): The number of worker processes of each run.
+    fresh (bool): Whether to ignore existing checkpoints.
+    shard (int, optional): Runs only this shard, in this process, without merging.
+    output (str, optional): The directory the merged tables are written to as excel files.
+
+    Returns:
+    dict: The merged tables (see merge_markets), or the labels of the markets run when `shard` is given.
+    """
+    directories = [os.path.abspath(_checkpoint_dir(config)) for config in configs]
+    if len(set(directories)) < len(directories):
+        raise ValueError("every market needs its own checkpoint directory")
+    shards = market_shards(configs, nodes or len(configs))
+    if shard is not None:
+        return _run_shard([configs[i] for i in shards[shard]], workers, fresh)
+    with ProcessPoolExecutor(len(shards)) as executor:
+        futures = [executor.submit(_run_shard, [configs[i] for i in positions], workers, fresh) for positions in shards if positions]
+        for future in as_completed(futures):
+            logger.info("Finished %s", ", ".join(future.result()))
+    return merge_markets(configs, output)
+
+def main(argv = None):
+    """
+    Command-line entry point: python -m MyProject run config.yaml [more.yaml ...], python -m MyProject markets tse.yaml ifb.yaml [...],
+    python -m MyProject snapshot config.yaml, or python -m MyProject serve config.yaml
+    """
+    parser = argparse.ArgumentParser(prog = "python -m MyProject", description = "Replicates the 52-week high tables.")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    run = commands.add_parser("run", help = "build the tables listed in a configuration file")
+    run.add_argument("config", nargs = "+", help = "YAML or JSON configuration files, run one after another with the next data prefetched")
+    run.add_argument("--workers", type = int, help = "the number of worker processes")
+    run.add_argument("--fresh", action = "store_true", help = "ignore the checkpoints of earlier runs")
+    shards = commands.add_parser("markets", help = "build the tables of several markets in parallel processes and merge them")
+    shards.add_argument("config", nargs = "+", help = "one YAML or JSON configuration file per market")
+    shards.add_argument("--nodes", type = int, help = "the number of shards, by default one per market")
+    shards.add_argument("--shard", type = int, help = "run only this shard here (0-based), e.g. on one machine of --nodes")
+    shards.add_argument("--merge", action = "store_true", help = "only merge the tables the shards have built")
+    shards.add_argument("--output", default = os.path.join("results", "markets"), help = "the directory of the merged tables")
+    shards.add_argument("--workers", type = int, help = "the number of worker processes of each market")
+    shards.add_argument("--fresh", action = "store_true", help = "ignore the checkpoints of earlier runs")
+    snapshot = commands.add_parser("snapshot", help = "save the derived panels and rankings of a configuration as a snapshot bundle")
+    snapshot.add_argument("config", help = "a YAML or JSON configuration file")
+    snapshot.add_argument("--path", help = "the bundle directory, by default the configuration's snapshot or <output>/snapshot")
+    snapshot.add_argument("--J", type = int, nargs = "+", default = [6], help = "the ranking periods to precompute")
+    serve = commands.add_parser("serve", help = "answer ranking queries over HTTP from warm in-memory state")
+    serve.add_argument("config", help = "a YAML or JSON configuration file")
+    serve.add_argument("--host", default = "127.0.0.1")
+    serve.add_argument("--port", type = int, default = 8050)
+    serve.add_argument("--J", type = int, nargs = "+", default = [6], help = "the ranking periods to precompute")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level = logging.INFO, format = "%(message)s")
+    if args.command == "run":
+        if len(args.config) == 1:
+            run_batch(read_config(args.config[0]), args.workers, args.fresh)
+        else:
+            run_batches([read_config(name) for name in args.config], args.workers, args.fresh)
+    elif args.command == "markets":
+        configs = [read_config(name) for name in args.config]
+        if args.merge:
+            merge_markets(configs, args.output)
+        else:
+            run_markets(configs, args.nodes, args.workers, args.fresh, args.shard, None if args.shard is not None else args.output)
+    elif args.command == "snapshot":
+        config = read_config(args.config)
+        path = args.path or config.get("snapshot") or os.path.join(config.get("output", "results"), "snapshot")
+        save_snapshot(path, config["data"], J_list = args.J)
+        logger.info("Saved the snapshot to %s", path)
+    else:
+        serve_rankings(read_config(args.config), args.host, args.port, args.J)
+
+if __name__ == "__main__":
+    main()
 
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+MyProject = pytest.importorskip("MyProject")
+
+
+def daily_panels(days = 60, N = 12):
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2020-01-01", periods = days, freq = "D")
+    columns = ["s" + str(i) for i in range(N)]
+    prices = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.01, (days, N)), axis = 0)), index = index, columns = columns)
+    mc = prices * rng.lognormal(5, 1, N)
+    return prices, prices.pct_change(5), mc
+
+
+@pytest.mark.parametrize("weighting", ["value", "capped"])
+def test_rebalance_backtest_needs_mc_for_size_weights(weighting):
+    prices, signal, mc = daily_panels()
+    with pytest.raises(ValueError, match = "mc"):
+        MyProject.rebalance_backtest(prices, signal, weighting = weighting)
+    returns, holdings = MyProject.rebalance_backtest(prices, signal, mc, weighting = weighting, limit = None)
+    assert holdings["Winners"].iloc[-1] > 0 and returns["Winner - Loser"].notna().any()
@@ -0,0 +1,34 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+MyProject = pytest.importorskip("MyProject")
+
+
+class CountingFetch:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, ticker, start_date, end_date):
+        self.calls.append((ticker, start_date, end_date))
+        first, last = MyProject.JalaliDate(1400, 1, 1), MyProject.current_market().parse_date(end_date)
+        dates = [str(first + datetime.timedelta(days = i)) for i in range((last - first).days + 1)]
+        dates = [date for date in dates if MyProject.current_market().parse_date(date) >= MyProject.current_market().parse_date(start_date)]
+        return pd.DataFrame({"Price": [100.0 + i for i in range(len(dates))]}, index = dates)
+
+
+def test_download_prices_skips_tickers_already_fetched(tmp_path):
+    fetch = CountingFetch()
+    first = MyProject.download_prices(["AAA", "BBB"], str(tmp_path), fetch, "1400-01-01", "1400-01-09", workers = 2)
+    assert len(fetch.calls) == 2
+    assert (first["New Rows"] == 9).all()
+
+    again = MyProject.download_prices(["AAA", "BBB"], str(tmp_path), fetch, "1400-01-01", "1400-1-9", workers = 2)
+    assert len(fetch.calls) == 2
+    assert (again["New Rows"] == 0).all() and (again["Last Date"] == "1400-01-09").all()
+
+    later = MyProject.download_prices(["AAA", "CCC"], str(tmp_path), fetch, "1400-01-01", "1400-01-12", workers = 2)
+    assert sorted(fetch.calls[2:]) == [("AAA", "1400-01-10", "1400-01-12"), ("CCC", "1400-01-01", "1400-01-12")]
+    assert later.loc["AAA", "New Rows"] == 3 and later.loc["CCC", "New Rows"] == 12
+    assert len(MyProject.cached_panel(str(tmp_path), tickers = ["AAA"])) == 12
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+MyProject = pytest.importorskip("MyProject")
+
+
+def panels(T = 24, N = 24, seed = 0):
+    rng = np.random.default_rng(seed)
+    index = pd.Index([MyProject.JalaliDate(1395 + m // 12, m % 12 + 1, 1) for m in range(T)], name = "Date")
+    columns = ["s" + str(i) for i in range(N)]
+    ret = pd.DataFrame(rng.normal(0.01, 0.1, (T, N)), index = index, columns = columns)
+    ret.iloc[:3, :3] = np.nan
+    ret.iloc[10:14, 4] = np.nan
+    mc = pd.DataFrame(rng.lognormal(10, 1, (T, N)), index = index, columns = columns)
+    high = pd.DataFrame(rng.uniform(0.5, 1, (T, N)), index = index, columns = columns)
+    ind_ret = pd.DataFrame(rng.normal(0.01, 0.05, (T, 3)), index = index, columns = ["A", "B", "C"])
+    return ret, mc, high, ind_ret
+
+
+@pytest.mark.parametrize("refresh", [0, 1, 5, 12])
+def test_cross_sectional_premiums_match_monthly_lstsq(refresh):
+    ret, _, _, _ = panels(T = 40, N = 30)
+    rng = np.random.default_rng(1)
+    coefs = pd.DataFrame(rng.normal(size = (30, 4)), index = ret.columns, columns = ["a", "b", "c", "d"])
+    coefs.iloc[[2, 7], 1] = np.nan
+    ret.iloc[20:, 10:25] = np.nan
+    ret.iloc[25, :] = np.nan
+    premiums = MyProject.cross_sectional_premiums(coefs, ret, refresh)
+    B = coefs.to_numpy()
+    usable = ~np.isnan(B).any(axis = 1)
+    values = ret.to_numpy()
+    expected = np.full(premiums.shape, np.nan)
+    for t in range(len(values)):
+        live = usable & ~np.isnan(values[t])
+        if live.sum() >= B.shape[1]:
+            expected[t] = np.linalg.lstsq(B[live], values[t, live], rcond = None)[0]
+    np.testing.assert_allclose(premiums.to_numpy(), expected, atol = 1e-10)
+    assert premiums.iloc[25].isna().all()
+
+
+@pytest.mark.parametrize("name, args", [("Fama_MacBeth", ()), ("Fama_MacBeth_lag", (1,)), ("Fama_MacBeth_low", ())])
+def test_fama_macbeth_runs(name, args):
+    pytest.importorskip("statsmodels")
+    ret, mc, high, ind_ret = panels()
+    market = MyProject.Market("TEST", sectors = {"A": list(ret.columns[0::3]), "B": list(ret.columns[1::3]), "C": list(ret.columns[2::3])})
+    with market:
+        Results = getattr(MyProject, name)(None, ind_ret, ret, mc, 2, *args, high = high)
+    assert list(Results.index) == ["size", "R_t-1"] + [i + str(j) for i in ["JH", "JL", "MH", "ML", "FHH", "FHL"] for j in (2, 3)] + ["Intercept"]
+    assert not Results.iloc[:, 0].str.startswith("nan").all()
+
+
+def test_fama_macbeth_compact_panels():
+    pytest.importorskip("statsmodels")
+    ret, mc, high, ind_ret = panels()
+    market = MyProject.Market("TEST", sectors = {"A": list(ret.columns[0::3]), "B": list(ret.columns[1::3]), "C": list(ret.columns[2::3])})
+    compact = [panel.astype(np.float32) for panel in (ind_ret, ret, mc, high)]
+    with market:
+        Results = MyProject.Fama_MacBeth(None, ind_ret, ret, mc, 2, high = high)
+        Compact = MyProject.Fama_MacBeth(None, *compact[:3], 2, high = compact[3])
+    means = Results.iloc[:, 0].str.split(" ").str[0].astype(float)
+    compact_means = Compact.iloc[:, 0].str.split(" ").str[0].astype(float)
+    np.testing.assert_allclose(compact_means, means, rtol = 1e-4)
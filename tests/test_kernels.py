@@ -0,0 +1,85 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+MyProject = pytest.importorskip("MyProject")
+
+backends = ["numpy", pytest.param("numba", marks = pytest.mark.skipif(MyProject.numba is None, reason = "numba is not installed"))]
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size = (120, 12))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[:, 0] = np.nan
+    values[30:75, 1] = np.nan
+    values[:, 2] = np.round(values[:, 2])
+    values[:40, 3] = np.nan
+    return values
+
+
+def reference_max(values, starts):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category = RuntimeWarning)
+        return np.array([np.nanmax(values[max(s, 0):i+1], axis = 0) for i, s in enumerate(starts)])
+
+
+def test_numba_is_importable():
+    pytest.importorskip("numba")
+    assert MyProject._kernel("rolling_max", "numba") is MyProject._rolling_max_numba
+
+
+@pytest.mark.parametrize("backend", backends)
+@pytest.mark.parametrize("window", [1, 5, 40, 500])
+def test_rolling_max_fixed_windows(values, backend, window):
+    starts = np.arange(len(values)) - window + 1
+    expected = reference_max(values, starts)
+    np.testing.assert_array_equal(MyProject.rolling_max(values, starts, backend), expected)
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_rolling_max_nondecreasing_starts(values, backend):
+    rng = np.random.default_rng(1)
+    starts = np.maximum.accumulate(np.maximum(np.arange(len(values)) - rng.integers(0, 30, len(values)), 0))
+    starts[50:60] = starts[50]
+    expected = reference_max(values, starts)
+    np.testing.assert_array_equal(MyProject.rolling_max(values, starts, backend), expected)
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_rolling_max_nan_run_longer_than_window(values, backend):
+    starts = np.arange(len(values)) - 9
+    result = MyProject.rolling_max(values, starts, backend)
+    assert np.isnan(result[39:75, 1]).all()
+    assert not np.isnan(result[75:, 1]).all()
+    assert np.isnan(result[:, 0]).all()
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_percentile_rank(values, backend):
+    expected = pd.DataFrame(values).rank(axis = 1, method = "max", pct = True).to_numpy()
+    np.testing.assert_allclose(MyProject.percentile_rank(values, backend), expected)
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_percentile_rank_empty_row(backend):
+    values = np.array([[np.nan, np.nan, np.nan], [1.0, np.nan, 1.0]])
+    np.testing.assert_array_equal(MyProject.percentile_rank(values, backend), [[np.nan, np.nan, np.nan], [1.0, np.nan, 1.0]])
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_cohort_sums(values, backend):
+    rng = np.random.default_rng(2)
+    weights = MyProject.weight_matrix(rng.random(values.shape) < 0.3)
+    weights[15] = 0.0
+    cohorts = np.arange(20, len(values))[:, None] + np.arange(-7, -1)
+    holding = np.repeat(np.arange(20, len(values))[:, None], 6, axis = 1)
+    expected = np.zeros(len(cohorts))
+    for i in range(len(cohorts)):
+        for row, month in zip(cohorts[i], holding[i]):
+            live = (weights[row] > 0) & ~np.isnan(values[month])
+            expected[i] += (weights[row, live] * values[month, live]).sum() / weights[row, live].sum() if live.any() else np.nan
+    np.testing.assert_allclose(MyProject.cohort_sums(values, weights, cohorts, holding, backend), expected)
@@ -0,0 +1,10 @@
+import pytest
+
+MyProject = pytest.importorskip("MyProject")
+
+
+def test_sector_names_are_normalized_like_the_tickers():
+    arabic, persian = "كاني فلزي", "کانی فلزی"
+    market = MyProject.Market("TEST", sectors = {arabic: ["فولاد مباركه"], persian + "‌": ["A", "B"]})
+    assert list(market.sectors) == [persian]
+    assert market.sectors[persian] == MyProject.normalize_symbols(["فولاد مباركه", "A", "B"])
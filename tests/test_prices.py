@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+MyProject = pytest.importorskip("MyProject")
+
+
+def write_prices(path):
+    index = pd.date_range("2020-01-01", periods = 40, freq = "D")
+    rng = np.random.default_rng(0)
+    prices = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.01, (40, 4)), axis = 0)), index = index, columns = ["Index", "A", "B", "C"])
+    prices.index.name = "Date"
+    prices.to_csv(path)
+
+
+def test_read_prices_readjusts_only_the_new_actions(tmp_path, monkeypatch):
+    write_prices(tmp_path / "stocks.csv")
+    actions = pd.DataFrame({"Ticker": ["A", "C"], "Date": ["2020-01-10", "2020-01-20"], "Split": [2.0, 1.5], "Dividend": [np.nan, 1.0]})
+    actions.to_csv(tmp_path / "actions.csv", index = False)
+    data = {"stocks": str(tmp_path / "stocks.csv"), "actions": str(tmp_path / "actions.csv"), "start": "2020-01-01", "end": "2020-12-31"}
+    calls = []
+    readjust = MyProject.readjust_prices
+    monkeypatch.setattr(MyProject, "readjust_prices", lambda *args: calls.append(args[3]) or readjust(*args))
+    monkeypatch.setattr(MyProject, "_adjusted_prices", {})
+    with MyProject.Market("TEST_GREGORIAN", calendar = "gregorian"):
+        first = MyProject._read_prices(data)
+        pd.concat([actions, pd.DataFrame({"Ticker": ["B"], "Date": ["2020-01-25"], "Split": [1.2], "Dividend": [0.5]})]).to_csv(tmp_path / "actions.csv", index = False)
+        second = MyProject._read_prices(data)
+        expected = MyProject.adjust_prices(MyProject._read_panel(data, "stocks"), MyProject.read_actions(data["actions"]))
+    assert len(calls) == 1 and calls[0]["Ticker"].tolist() == ["B"]
+    pd.testing.assert_frame_equal(second, expected)
+    pd.testing.assert_frame_equal(first[["A", "C"]], second[["A", "C"]])
+    assert not np.allclose(first["B"], second["B"])
+
+
+def loop_ret_d2m(df):
+    df = df + 1
+    df2 = pd.DataFrame(columns = df.columns)
+    check = 0
+    for i in range(1, len(df)):
+        if (df.index[i].month != df.index[i-1].month) or (i == len(df) - 1):
+            temp = df.loc[df.index[check]:df.index[i], :].prod() - 1
+            temp[temp == 0] = np.nan
+            df2.loc[df.index[check], :] = temp
+            check = i
+    return df2.astype(float)
+
+
+@pytest.mark.parametrize("days", [0, 1, 2, 31, 75])
+def test_ret_d2m_matches_the_month_loop(days):
+    index = pd.date_range("2020-01-01", periods = days, freq = "D")
+    df = pd.DataFrame(np.random.default_rng(days).normal(0, 0.02, (days, 3)), index = index, columns = ["A", "B", "C"])
+    monthly = MyProject.ret_d2m(df)
+    assert list(monthly.columns) == ["A", "B", "C"]
+    pd.testing.assert_frame_equal(monthly, loop_ret_d2m(df), check_index_type = False, check_freq = False)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+MyProject = pytest.importorskip("MyProject")
+
+
+def panels(T = 30, N = 24, seed = 0):
+    rng = np.random.default_rng(seed)
+    index = pd.Index([MyProject.JalaliDate(1395 + m // 12, m % 12 + 1, 1) for m in range(T)], name = "Date")
+    columns = ["s" + str(i) for i in range(N)]
+    ret = pd.DataFrame(rng.normal(0.01, 0.1, (T, N)), index = index, columns = columns)
+    ret.iloc[:4, :3] = np.nan
+    ret.iloc[12:15, 5] = np.nan
+    mc = pd.DataFrame(rng.lognormal(10, 1, (T, N)), index = index, columns = columns)
+    mc.iloc[:6, 7] = np.nan
+    ind_ret = pd.DataFrame(rng.normal(0.01, 0.05, (T, 4)), index = index, columns = ["A", "B", "C", "D"])
+    ind_ret.iloc[8:10, 2] = np.nan
+    market = MyProject.Market("TEST", sectors = {name: columns[i::4] for i, name in enumerate(ind_ret.columns)})
+    return ret, mc, ind_ret, market
+
+
+def jk_reference(ret, mc, J, t):
+    size = mc.iloc[max(t - J, 0):t + 1].dropna(axis = 1).mean()
+    liquids = size[size >= size.quantile(0.1)].index
+    past = ret.iloc[max(t - J, 0):t].loc[:, liquids].dropna(axis = 1).mean()
+    return set(past[past >= past.quantile(0.7)].index), set(past[past <= past.quantile(0.3)].index)
+
+
+def mg_reference(ind_ret, ret, J, t, sectors):
+    past = ind_ret.iloc[max(t - J, 0):t].dropna(axis = 1, how = "all").mean()
+    pick = lambda names: {stock for name in names for stock in sectors[name] if stock in ret.columns}
+    return pick(past[past >= past.quantile(0.7)].index), pick(past[past <= past.quantile(0.3)].index)
+
+
+@pytest.mark.parametrize("J", [2, 6])
+def test_rankers_match_the_pandas_window_means(J):
+    ret, mc, ind_ret, market = panels()
+    stats = MyProject.ranking_stats(ret, mc, ind_ret)
+    with market:
+        for t in range(J + 1, len(ret)):
+            reference = jk_reference(ret, mc, J, t)
+            for ranked in [MyProject.JK_Ranker(ret, mc, J, t, stats), MyProject.JK_Ranker(ret, mc, J, t)]:
+                assert (set(ranked[0]), set(ranked[1])) == reference
+            reference = mg_reference(ind_ret, ret, J, t, market.sectors)
+            for ranked in [MyProject.MG_Ranker(ind_ret, ret, J, t, stats = stats), MyProject.MG_Ranker(ind_ret, ret, J, t)]:
+                assert (set(ranked[0]), set(ranked[1])) == reference
+
+
+def test_ft_signals_read_a_shared_ragged_panel():
+    ret, mc, ind_ret, market = panels()
+    high = ret.abs().cumsum()
+    rows = range(1, len(ret))
+    shared = MyProject.FT_Signals(high, mc, rows, ret.columns, ragged = MyProject.to_ragged(mc))
+    np.testing.assert_array_equal(shared, MyProject.FT_Signals(high, mc, rows, ret.columns))
+
+
+def test_ranking_state_signals_skip_missing_months():
+    ret, mc, ind_ret, market = panels()
+    high = ret.abs().cumsum()
+    J = 3
+    with market:
+        state = MyProject.ranking_state({"returns_M": ret, "Market_Cap_M": mc, "r_sec": ind_ret, "high_M": high}, (J,))
+    industry = state["signals"][("MG", J)][:, 2]
+    assert industry[10] == pytest.approx(ind_ret.iloc[7:10, 2].mean())
+    assert not np.isnan(industry[10])
+    np.testing.assert_array_equal(state["signals"][("JK", J)], MyProject.JK_Signals(ret, mc, J, range(J, len(ret))))
+    with pytest.raises(KeyError):
+        MyProject.query_rankings(state, "JK", J, MyProject.month_key(ret.index[J]))
+    month = MyProject.month_key(ret.index[2 * J + 1])
+    assert MyProject.query_rankings(state, "JK", J, month)["winners"]
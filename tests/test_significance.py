@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+MyProject = pytest.importorskip("MyProject")
+
+
+def test_block_bootstrap_runs_in_process_by_default(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("started a process pool")
+    monkeypatch.setattr(MyProject, "ProcessPoolExecutor", no_pool)
+    spread = np.random.default_rng(0).normal(0.01, 0.05, 60)
+    result = MyProject.block_bootstrap(spread, n_draws = 200, batch = 50)
+    assert result["Draws"] == 200
+    assert result["CI Low"] <= result["Mean"] <= result["CI High"]
+
+
+def test_block_bootstrap_shortens_the_block_of_short_series():
+    spread = np.array([0.02, np.nan, -0.01, 0.03])
+    result = MyProject.block_bootstrap(spread, n_draws = 100, block = 6)
+    assert result["Mean"] == pytest.approx(np.nanmean(spread))
+    assert MyProject.block_bootstrap(spread, n_draws = 100, block = 3)["Draws"] == 100
+
+
+def test_block_bootstrap_rejects_an_empty_spread():
+    with pytest.raises(ValueError):
+        MyProject.block_bootstrap(np.array([np.nan, np.nan]), n_draws = 10)